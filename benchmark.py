@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+
+# Usage:
+#   benchmark.py [--scales 1,10,100] [--repeat N] [--workdir DIR] \
+#     [--compare BASELINE.json [--threshold RATIO]] > RESULTS.json
+#
+# Times the stages of the pipeline on synthetic corpora, and the hot functions
+# of common, and writes the timings as JSON.
+#
+# The synthetic corpora are drawn from the (work, metrical_shape, sedes) counts
+# of expectancy.sedes-work,metrical_shape.csv, with SCALE times as many words as
+# the real corpus for each SCALE in --scales. Each stage is run as a separate
+# process, as make would run it, --repeat times, each time with an empty cache
+# directory. With --compare, also prints a comparison with the results of an
+# earlier run to standard error, and exits with status 1 if any timing is more
+# than --threshold times the earlier one.
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+import numpy as np
+
+import common
+
+SOURCE = "expectancy.sedes-work,metrical_shape.csv"
+
+ERAS = {
+    "archaic": ("Il.", "Od.", "Hom.Hymn", "Theog.", "W.D.", "Sh."),
+    "hellenistic": ("Argon.", "Callim.Hymn", "Phaen.", "Theoc."),
+    "imperial": ("Q.S.", "Dion."),
+}
+
+CORPUS_FIELDS = ("work", "book_n", "line_n", "word_n", "word", "lemma", "sedes", "metrical_shape", "scanned", "num_scansions", "line_text")
+
+WORDS_PER_LINE = 6
+LINES_PER_BOOK = 1000
+
+# Rows generated and written at a time.
+CHUNK_SIZE = 1 << 20
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def corpus_filename(directory, work):
+    return os.path.join(directory, "corpus", f"{work}.csv")
+
+def generate_corpus(C, scale, directory, rng):
+    """Writes a synthetic corpus CSV file for each work under directory, with
+    scale times as many words as C has for the work, drawn from its
+    distribution over shapes and sedes. Returns the total number of words."""
+    os.makedirs(os.path.join(directory, "corpus"), exist_ok = True)
+    shape_names = [common.decode_shape(shape) for shape in C.shapes]
+    total = 0
+    for work in C.works:
+        counts = C.x[C.work_index[work]].ravel()
+        n = scale * int(counts.sum())
+        if n == 0:
+            continue
+        total += n
+        with open(corpus_filename(directory, work), "w") as f:
+            f.write(",".join(CORPUS_FIELDS) + "\n")
+            for start in range(0, n, CHUNK_SIZE):
+                cells = rng.choice(len(counts), size = min(CHUNK_SIZE, n - start), p = counts / counts.sum())
+                shape_codes, sedes_codes = np.divmod(cells, len(C.sedes))
+                word_index = np.arange(start, start + len(cells))
+                line_index = word_index // WORDS_PER_LINE
+                f.writelines(
+                    f"{work},{book_n},{line_n},{word_n},w{j},w{j},{common.KNOWN_SEDES[k]},{shape_names[j]},auto,1,synthetic\n"
+                    for book_n, line_n, word_n, j, k in zip(
+                        (line_index // LINES_PER_BOOK + 1).tolist(),
+                        (line_index % LINES_PER_BOOK + 1).tolist(),
+                        (word_index % WORDS_PER_LINE + 1).tolist(),
+                        shape_codes.tolist(),
+                        sedes_codes.tolist(),
+                    )
+                )
+    return total
+
+def pipeline_stages(directory):
+    """Returns a list of (name, argv, output filename) for every stage of the
+    pipeline on the synthetic corpus under directory, in dependency order,
+    mirroring the Makefile, and run in directory. The synthetic corpus stands
+    for the output of merge-appositives.py, which is not timed, because the
+    lines of exceptional-appositives.csv are not in it. The reports are timed
+    both one script at a time and rendered together by reports.py, as make
+    does."""
+    def path(filename):
+        return os.path.join(directory, filename)
+    def corpus(eras):
+        return [corpus_filename(directory, work) for era in eras for work in ERAS[era] if os.path.exists(corpus_filename(directory, work))]
+    def script(name):
+        return [sys.executable, os.path.join(SCRIPT_DIR, name)]
+    return [
+        ("expectancy.py", script("expectancy.py") + [
+            "--job", "sedes/work,metrical_shape", path("expectancy.sedes-work,metrical_shape.csv"), *corpus(("archaic", "hellenistic", "imperial")),
+            "--job", "sedes/metrical_shape", path("expectancy.sedes-metrical_shape.archaic.csv"), *corpus(("archaic",)),
+            "--job", "sedes/metrical_shape", path("expectancy.sedes-metrical_shape.archaic+hellenistic.csv"), *corpus(("archaic", "hellenistic")),
+            "--job", "sedes/metrical_shape", path("expectancy.sedes-metrical_shape.csv"), *corpus(("archaic", "hellenistic", "imperial")),
+        ], None),
+        ("join-expectancy.py", script("join-expectancy.py") + [
+            "--by", "sedes/metrical_shape",
+            "--group", *corpus(("archaic",)), path("expectancy.sedes-metrical_shape.archaic.csv"),
+            "--group", *corpus(("hellenistic",)), path("expectancy.sedes-metrical_shape.archaic+hellenistic.csv"),
+            "--group", *corpus(("imperial",)), path("expectancy.sedes-metrical_shape.csv"),
+        ], path("joined.sedes-metrical_shape.csv")),
+        ("tables.py", script("tables.py") + [path("expectancy.sedes-work,metrical_shape.csv")], path("tables.html")),
+        ("summary-table.py", script("summary-table.py") + [path("expectancy.sedes-metrical_shape.csv")], path("summary-table.html")),
+        ("table-ssl.py", script("table-ssl.py") + [path("expectancy.sedes-work,metrical_shape.csv")], path("table-ssl.html")),
+        ("unexpected-table.py", script("unexpected-table.py") + [path("joined.sedes-metrical_shape.csv")], path("unexpected-table.html")),
+        ("reports.py", script("reports.py") + ["tables.html", "summary-table.html", "table-ssl.html", "unexpected-table.html"], None),
+        ("unexpected-lines.py", script("unexpected-lines.py") + [path("joined.sedes-metrical_shape.csv")], path("unexpected-lines.csv")),
+    ]
+
+def run_stage(argv, output, env, cwd):
+    """Runs argv in cwd, with standard output to output if not None, and
+    returns the elapsed time in seconds."""
+    with open(output, "w") if output is not None else open(os.devnull, "w") as f:
+        start = time.perf_counter()
+        subprocess.run(argv, stdout = f, env = env, cwd = cwd, check = True)
+        return time.perf_counter() - start
+
+def time_function(stmt, repeat):
+    """Returns a list of repeat timings of the callable stmt, in seconds per
+    call, each over enough calls to take at least 0.2 s."""
+    timer = timeit.Timer(stmt)
+    number, _ = timer.autorange()
+    return [t / number for t in timer.repeat(repeat = repeat, number = number)]
+
+def function_benchmarks(C):
+    """Returns a list of (name, callable) for the hot functions of common, on
+    the data of the CountTensor C."""
+    pairs = [(shape, sedes) for shape in C.shapes for sedes in C.sedes]
+    xvecs = C.x.reshape(-1, len(C.sedes)).tolist()
+    Z = C.expectancy()
+    zs = [common.z_or_none(z) for z in Z.ravel().tolist()]
+    with open(os.path.join(SCRIPT_DIR, SOURCE), newline = "") as f:
+        source_text = f.read()
+    dtypes = {"work": str, "metrical_shape": str, "sedes": float, "x": int, "z": float}
+    return [
+        ("common.is_metrically_permissible", lambda: [common.is_metrically_permissible(shape, sedes) for shape, sedes in pairs]),
+        ("common.permissible_shapes_gen", lambda: list(common.permissible_shapes_gen())),
+        ("common.expectancies", lambda: [common.expectancies(xvec) for xvec in xvecs]),
+        ("common.expectancy_array", lambda: common.expectancy_array(C.x)),
+        ("common.z_css", lambda: [common.z_css(z) for z in zs]),
+        ("common.z_css_array", lambda: common.z_css_array(Z)),
+        ("common.parse_csv_columns", lambda: common.parse_csv_columns(source_text.splitlines(keepends = True), dtypes)),
+        ("common.CountTensor.from_table", lambda: common.CountTensor.from_table(common.parse_csv_columns(source_text.splitlines(keepends = True), dtypes))),
+    ]
+
+def summarize(name, scale, times, **extra):
+    return {"name": name, "scale": scale, **extra, "times": times, "min": min(times), "median": statistics.median(times)}
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd = SCRIPT_DIR, capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline, threshold):
+    """Prints a comparison of results with baseline to standard error. Returns
+    True if no timing regressed by more than threshold."""
+    old = {(r["name"], r["scale"]): r for r in baseline["results"]}
+    ok = True
+    for r in results:
+        b = old.get((r["name"], r["scale"]))
+        if b is None:
+            continue
+        ratio = r["min"] / b["min"]
+        flag = ""
+        if ratio > threshold:
+            flag = " REGRESSION"
+            ok = False
+        scale = "" if r["scale"] is None else f" ×{r['scale']}"
+        print(f"{r['name']}{scale}: {b['min']:.6g} s → {r['min']:.6g} s ({ratio:.2f}×){flag}", file = sys.stderr)
+    return ok
+
+def parse_scales(s):
+    try:
+        scales = [int(scale) for scale in s.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid scales {s!r}")
+    if any(scale < 1 for scale in scales):
+        raise argparse.ArgumentTypeError(f"invalid scales {s!r}")
+    return scales
+
+parser = argparse.ArgumentParser(description = "Benchmark the pipeline on synthetic corpora.")
+parser.add_argument("--scales", type = parse_scales, default = [1, 10, 100], help = "comma-separated corpus size multipliers (default 1,10,100)")
+parser.add_argument("--repeat", type = int, default = 3, help = "number of timings of each stage (default 3)")
+parser.add_argument("--seed", type = int, default = 0, help = "random seed for the synthetic corpora (default 0)")
+parser.add_argument("--workdir", help = "directory for the synthetic corpora and outputs (default a temporary directory, removed afterwards)")
+parser.add_argument("--compare", metavar = "BASELINE.json", help = "compare with the results of an earlier run")
+parser.add_argument("--threshold", type = float, default = 1.1, metavar = "RATIO", help = "slowdown relative to BASELINE.json that counts as a regression (default 1.1)")
+args = parser.parse_args()
+
+C = common.CountTensor.from_table(common.load_csv(os.path.join(SCRIPT_DIR, SOURCE), {"work": str, "metrical_shape": str, "sedes": float, "x": int, "z": float}))
+
+results = []
+for name, stmt in function_benchmarks(C):
+    results.append(summarize(name, None, time_function(stmt, args.repeat)))
+    print(f"{name}: {results[-1]['min']:.6g} s", file = sys.stderr)
+
+workdir = args.workdir if args.workdir is not None else tempfile.mkdtemp(prefix = "benchmark-")
+try:
+    for scale in args.scales:
+        directory = os.path.join(workdir, f"x{scale}")
+        start = time.perf_counter()
+        words = generate_corpus(C, scale, directory, np.random.default_rng([args.seed, scale]))
+        print(f"generated ×{scale} corpus of {words:,} words in {time.perf_counter() - start:.1f} s", file = sys.stderr)
+        cache_dir = os.path.join(directory, "cache")
+        env = dict(os.environ, EPIC_RHYTHM_CACHE = cache_dir)
+        for name, argv, output in pipeline_stages(directory):
+            times = []
+            for _ in range(args.repeat):
+                shutil.rmtree(cache_dir, ignore_errors = True)
+                times.append(run_stage(argv, output, env, directory))
+            results.append(summarize(name, scale, times, words = words))
+            print(f"{name} ×{scale}: {results[-1]['min']:.6g} s", file = sys.stderr)
+finally:
+    if args.workdir is None:
+        shutil.rmtree(workdir, ignore_errors = True)
+
+json.dump({
+    "date": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec = "seconds"),
+    "commit": git_commit(),
+    "python": sys.version,
+    "platform": platform.platform(),
+    "repeat": args.repeat,
+    "seed": args.seed,
+    "results": results,
+}, sys.stdout, indent = 1, ensure_ascii = False)
+sys.stdout.write("\n")
+
+if args.compare is not None:
+    with open(args.compare) as f:
+        baseline = json.load(f)
+    if not compare(results, baseline, args.threshold):
+        sys.exit(1)
@@ -1,7 +1,109 @@
+import atexit
+import bisect
 import collections
+import contextlib
+import csv
+import functools
+import hashlib
 import html
+import io
 import itertools
+import json
 import math
+import mmap
+import os
+import resource
+import shutil
+import struct
+import sys
+import time
+
+import numpy as np
+
+# Instrumentation. When EPIC_RHYTHM_PROFILE is set to a non-empty value in the
+# environment, or enable_instrumentation has been called, the functions
+# decorated with @instrumented count their calls and the time spent in them,
+# begin_phase marks the phases of a script, and a JSON summary of both, with
+# peak memory use, is written to stderr when the script exits. When
+# instrumentation is disabled, @instrumented functions are not wrapped at all,
+# and begin_phase returns immediately.
+
+# Names of @instrumented functions.
+INSTRUMENTED = []
+
+# None while instrumentation is disabled.
+INSTRUMENTATION = None
+
+def instrumented(func):
+    INSTRUMENTED.append(func.__name__)
+    return func
+
+def counting_wrapper(func, stats):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stats[0] += 1
+            stats[1] += time.perf_counter() - start
+    return wrapper
+
+def enable_instrumentation():
+    """Starts recording phases and calls of @instrumented functions. Must be
+    called before the functions are looked up, i.e., they must be called as
+    common.name."""
+    global INSTRUMENTATION
+    if INSTRUMENTATION is not None:
+        return
+    INSTRUMENTATION = {"functions": {}}
+    reset_instrumentation()
+    g = globals()
+    for name in INSTRUMENTED:
+        stats = INSTRUMENTATION["functions"][name] = [0, 0.0]
+        g[name] = counting_wrapper(g[name], stats)
+    atexit.register(write_instrumentation)
+
+def reset_instrumentation():
+    """Forgets everything recorded so far."""
+    INSTRUMENTATION["start"] = time.perf_counter()
+    INSTRUMENTATION["phases"] = {}
+    INSTRUMENTATION["phase"] = None
+    for stats in INSTRUMENTATION["functions"].values():
+        stats[:] = [0, 0.0]
+
+def begin_phase(name):
+    """Ends the current phase of the script, if any, and begins the phase
+    name."""
+    if INSTRUMENTATION is None:
+        return
+    now = time.perf_counter()
+    current = INSTRUMENTATION["phase"]
+    if current is not None:
+        phases = INSTRUMENTATION["phases"]
+        phases[current[0]] = phases.get(current[0], 0.0) + (now - current[1])
+    INSTRUMENTATION["phase"] = None if name is None else (name, now)
+
+def write_instrumentation(label = None):
+    """Writes a JSON summary of what has been recorded since instrumentation
+    was enabled or reset to stderr, then resets it."""
+    if INSTRUMENTATION is None:
+        return
+    begin_phase(None)
+    summary = {
+        "script": label if label is not None else sys.argv[0],
+        "wall_seconds": time.perf_counter() - INSTRUMENTATION["start"],
+        # ru_maxrss is in kilobytes on Linux.
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "phases": INSTRUMENTATION["phases"],
+        "functions": {
+            name: {"calls": calls, "seconds": seconds}
+            for name, (calls, seconds) in INSTRUMENTATION["functions"].items()
+            if calls > 0
+        },
+    }
+    print(json.dumps(summary, ensure_ascii = False), file = sys.stderr, flush = True)
+    reset_instrumentation()
 
 KNOWN_SEDES = ("1", "2", "2.5", "3", "4", "4.5", "5", "6", "6.5", "7", "8", "8.5", "9", "10", "10.5", "11", "12")
 
@@ -21,36 +123,160 @@ KNOWN_WORKS = (
     Work("Dion.", "<i>Dion.</i>", "<i>Dionysiaca</i>, <span style=\"white-space: nowrap\">Nonnus of Panopolis</span>", "Book"),
 )
 
-def is_metrically_permissible(shape, sedes):
-    """Returns True iff shape is metrically permitted at sedes."""
+# Metrical shapes are packed into ints: a shape of n symbols is the int with
+# bit n set and, below it, one bit per symbol, the first symbol most
+# significant, 0 for "–" and 1 for "⏑". The empty shape is 1. Packed shapes
+# sort by length and then symbol by symbol with "–" first, the order of
+# shapes_gen. Shapes are encoded and decoded only where they are read or
+# written as text.
+SHAPE_SYMBOLS = ("–", "⏑")
+SHAPE_BITS = {c: bit for bit, c in enumerate(SHAPE_SYMBOLS)}
+
+# Number of half-morae in each metrical symbol.
+MORAE = {"⏑": 1, "–": 2}
+
+def encode_shape(text):
+    """Returns the packed shape of the string text, or raises ValueError."""
+    shape = 1
+    for c in text:
+        bit = SHAPE_BITS.get(c)
+        if bit is None:
+            raise ValueError(f"invalid shape {text!r}")
+        shape = (shape << 1) | bit
+    return shape
+
+def decode_shape(shape):
+    """Returns the string of the packed shape."""
+    return "".join(SHAPE_SYMBOLS[(shape >> i) & 1] for i in range(shape_length(shape) - 1, -1, -1))
+
+def shape_length(shape):
+    """Returns the number of symbols of the packed shape."""
+    return shape.bit_length() - 1
+
+def packed_shape(shape):
+    """Returns shape as a packed shape: shape itself if it is already packed,
+    or encoded if it is a string. Raises KeyError for a string with a symbol
+    other than those of MORAE, as the string functions did before shapes were
+    packed."""
+    if isinstance(shape, str):
+        try:
+            return encode_shape(shape)
+        except ValueError:
+            raise KeyError(shape) from None
+    return shape
+
+def shape_half_morae(shape):
+    """Returns the length of the packed shape in half-morae: 2 for every "–"
+    and 1 for every "⏑"."""
+    return 2 * shape_length(shape) - (shape.bit_count() - 1)
+
+# Half-mora positions in the line at which a word may begin or end, as a
+# bitmask with bit s set for every permitted position s. Sedes n corresponds
+# to position (n - 1) * 2; position 24 is the end of the line.
+PERMITTED_POSITIONS = sum(1 << s for s in range(25) if s != 23 and s % 4 in (0, 2, 3))
+
+def sedes_position(sedes):
+    """Returns the half-mora position of sedes, or raises ValueError."""
     s = (sedes - 1) * 2
     if s != int(s) or s < 0 or s > 24:
-        raise ValueError("invalid sedes {sedes}")
-    if s == 23 or s % 4 not in (0, 2, 3):
-        return False
-    for c in shape:
-        s += {"⏑": 1, "–": 2}[c]
-        if s > 24 or s == 23 or s % 4 not in (0, 2, 3):
-            return False
-    return True
+        raise ValueError(f"invalid sedes {sedes}")
+    return int(s)
+
+# Positions of KNOWN_SEDES, and the same as a bitmask.
+KNOWN_SEDES_POSITIONS = tuple(sedes_position(sedes) for sedes in map(float, KNOWN_SEDES))
+KNOWN_SEDES_MASK = sum(1 << s for s in KNOWN_SEDES_POSITIONS)
+
+@functools.lru_cache(maxsize = None)
+def metrically_permissible_mask(shape):
+    """Returns a bitmask with bit sedes_position(sedes) set for every sedes at
+    which shape (packed, or a string) is metrically permitted."""
+    shape = packed_shape(shape)
+    # Shifting the permitted positions right by the length of each prefix of
+    # the shape leaves only the starting positions from which the end of that
+    # prefix also lands on a permitted position.
+    mask = PERMITTED_POSITIONS
+    s = 0
+    for i in range(shape_length(shape) - 1, -1, -1):
+        s += 1 if (shape >> i) & 1 else 2
+        mask &= PERMITTED_POSITIONS >> s
+    return mask
+
+@instrumented
+def is_metrically_permissible(shape, sedes):
+    """Returns True iff shape (packed, or a string) is metrically permitted at
+    sedes."""
+    s = sedes_position(sedes)
+    return (metrically_permissible_mask(shape) >> s) & 1 == 1
+
+def is_metrically_permissible_batch(pairs):
+    """Returns a list of is_metrically_permissible(shape, sedes) for each
+    (shape, sedes) in pairs."""
+    positions = {}
+    result = []
+    for shape, sedes in pairs:
+        s = positions.get(sedes)
+        if s is None:
+            s = positions[sedes] = sedes_position(sedes)
+        result.append((metrically_permissible_mask(shape) >> s) & 1 == 1)
+    return result
+
+def metrically_permissible_sedes(shape):
+    """Returns the subsequence of KNOWN_SEDES at which shape is metrically
+    permitted."""
+    mask = metrically_permissible_mask(shape)
+    return tuple(sedes for sedes, s in zip(KNOWN_SEDES, KNOWN_SEDES_POSITIONS) if (mask >> s) & 1)
 
 def is_metrically_permissible_anywhere(shape):
-    return any(is_metrically_permissible(shape, sedes) for sedes in map(float, KNOWN_SEDES))
+    return metrically_permissible_mask(shape) & KNOWN_SEDES_MASK != 0
 
 def shapes_gen_length(length):
-    if length <= 0:
-        yield ""
-    else:
-        for x in shapes_gen_length(length - 1):
-            yield "–" + x
-        for x in shapes_gen_length(length - 1):
-            yield "⏑" + x
+    """Yields the packed shapes of length symbols, in order."""
+    length = max(length, 0)
+    yield from range(1 << length, 2 << length)
 
 def shapes_gen():
-    i = 0
-    while True:
-        yield from shapes_gen_length(i)
-        i += 1
+    """Yields all packed shapes, in order: every int from the empty shape up."""
+    yield from itertools.count(1)
+
+def permissible_shapes_gen(max_length = None, within = None):
+    """Yields the shapes of shapes_gen, in the same order, that are metrically
+    permitted at one of KNOWN_SEDES, stopping after shapes of length
+    max_length or when no longer shapes are possible. If within is not None,
+    yields only shapes that are members of within, which may be packed shapes
+    or strings; the members of within are yielded as they are given."""
+    if within is not None:
+        members = {}
+        for shape in within:
+            try:
+                members[packed_shape(shape)] = shape
+            except KeyError:
+                # Not a shape at all, so never permitted.
+                pass
+        within = set(members)
+        prefixes = set(shape >> i for shape in within for i in range(shape_length(shape) + 1))
+    # Each level is a list of (shape, mask, s) for permitted shapes of one
+    # length in order, where mask is metrically_permissible_mask(shape)
+    # restricted to KNOWN_SEDES and s is the length of shape in half-morae.
+    # A shape whose prefix is nowhere permitted is nowhere permitted itself,
+    # so every level is built by extending only the shapes of the level before.
+    extensions = tuple((bit, MORAE[c]) for bit, c in enumerate(SHAPE_SYMBOLS))
+    level = [(1, KNOWN_SEDES_MASK, 0)]
+    length = 0
+    while level and (max_length is None or length <= max_length):
+        next_level = []
+        for shape, mask, s in level:
+            if within is None:
+                yield shape
+            elif shape in within:
+                yield members[shape]
+            for bit, morae in extensions:
+                ext_shape = (shape << 1) | bit
+                ext_s = s + morae
+                ext_mask = mask & (PERMITTED_POSITIONS >> ext_s)
+                if ext_mask and (within is None or ext_shape in prefixes):
+                    next_level.append((ext_shape, ext_mask, ext_s))
+        level = next_level
+        length += 1
 
 # Colors for low-to-high color scale.
 COLOR_LOW  = (0x00, 0x00, 0x00)
@@ -100,15 +326,219 @@ def tone_map(z):
 def css_color(sr, sg, sb):
     return f"#{sr:02x}{sg:02x}{sb:02x}"
 
-def z_css(z):
-    if z is None:
-        z = 0.0
-    srgb = interpolate_srgb(tone_map(z), COLOR_LOW, COLOR_HIGH)
+def z_srgb(z):
+    return interpolate_srgb(tone_map(z), COLOR_LOW, COLOR_HIGH)
+
+def srgb_css(srgb):
     return (
         ("background-color", css_color(*srgb)),
         ("color", ("white" if srgb_luminance(*srgb) < LUMINANCE_INVERSION_THRESHOLD else "black")),
     )
 
+# z_css looks up z in a table of the exact z values at which the color changes,
+# rather than doing the color computations for every table cell. Outside
+# [-Z_CSS_TABLE_LIMIT, Z_CSS_TABLE_LIMIT] (and for NaN), the colors are computed
+# directly.
+Z_CSS_TABLE_LIMIT = 64.0
+
+def float_to_ordinal(z):
+    # Map a float to an int such that adjacent floats map to adjacent ints.
+    (i,) = struct.unpack("<q", struct.pack("<d", z))
+    return i if i >= 0 else -(i & 0x7fffffffffffffff)
+
+def ordinal_to_float(i):
+    if i < 0:
+        i = -i - 0x8000000000000000
+    (z,) = struct.unpack("<d", struct.pack("<q", i))
+    return z
+
+def z_srgb_candidate_breakpoints():
+    # Approximately where each sRGB component of z_srgb(z) rounds to a new
+    # integer, found by inverting the computation for each integer.
+    for s1, s2 in zip(COLOR_LOW, COLOR_HIGH):
+        u1 = srgb_component_to_linear(s1)
+        u2 = srgb_component_to_linear(s2)
+        if u1 == u2:
+            continue
+        for k in range(min(s1, s2) + 1, max(s1, s2) + 1):
+            s = (k - 0.5) / 255.0
+            if s <= 12.92 * 0.0031308:
+                u = s / 12.92
+            else:
+                u = math.pow((s + 0.055) / 1.055, 12.0/5.0)
+            x = (u - u1) / (u2 - u1)
+            if 0.0 < x < 1.0:
+                yield -math.log(1.0 / x - 1.0) / SHADE_MAPPING_ADJUST
+
+def z_srgb_breakpoints(lo, hi):
+    """Returns the sorted list of floats b in (lo, hi] such that z_srgb(b)
+    differs from z_srgb of the float just below b, and the list of values of
+    z_srgb on lo and at each breakpoint."""
+    # Every component of z_srgb is monotonic in z, so if z_srgb is equal at the
+    # ends of an interval, it is constant in between. The candidate breakpoints
+    # only serve to make the intervals that need bisecting small.
+    points = {float_to_ordinal(lo), float_to_ordinal(hi)}
+    for c in z_srgb_candidate_breakpoints():
+        if lo < c < hi:
+            δ = 1e-12 * max(1.0, abs(c))
+            points.add(float_to_ordinal(max(lo, c - δ)))
+            points.add(float_to_ordinal(min(hi, c + δ)))
+    points = sorted(points)
+    values = [z_srgb(ordinal_to_float(i)) for i in points]
+    breakpoints = []
+    breakpoint_values = [values[0]]
+    stack = list(zip(points[-2::-1], values[-2::-1], points[:0:-1], values[:0:-1]))
+    while stack:
+        a, fa, b, fb = stack.pop()
+        if fa == fb:
+            continue
+        if b - a == 1:
+            breakpoints.append(ordinal_to_float(b))
+            breakpoint_values.append(fb)
+            continue
+        m = (a + b) // 2
+        fm = z_srgb(ordinal_to_float(m))
+        stack.append((m, fm, b, fb))
+        stack.append((a, fa, m, fm))
+    return breakpoints, breakpoint_values
+
+# The parameters that z_css_table was built for, and the table.
+z_css_table_key = None
+z_css_table = None
+
+def get_z_css_table():
+    global z_css_table_key, z_css_table
+    key = (COLOR_LOW, COLOR_HIGH, SHADE_MAPPING_ADJUST, LUMINANCE_INVERSION_THRESHOLD, Z_CSS_TABLE_LIMIT)
+    if key != z_css_table_key:
+        breakpoints, values = z_srgb_breakpoints(-Z_CSS_TABLE_LIMIT, Z_CSS_TABLE_LIMIT)
+        styles = np.empty(len(values), dtype = object)
+        for i, srgb in enumerate(values):
+            styles[i] = srgb_css(srgb)
+        z_css_table = (breakpoints, np.array(breakpoints, dtype = float), styles)
+        z_css_table_key = key
+    return z_css_table
+
+@instrumented
+def z_css(z):
+    if z is None:
+        z = 0.0
+    if -Z_CSS_TABLE_LIMIT <= z <= Z_CSS_TABLE_LIMIT:
+        breakpoints, _, styles = get_z_css_table()
+        return styles[bisect.bisect_right(breakpoints, z)]
+    return srgb_css(z_srgb(z))
+
+@instrumented
+def z_css_array(z):
+    """Returns an object array of the same shape as z, with z_css of each
+    element. NaN elements are treated like None."""
+    z = np.asarray(z, dtype = float)
+    z = np.where(np.isnan(z), 0.0, z)
+    _, breakpoints, styles = get_z_css_table()
+    result = styles[np.searchsorted(breakpoints, z, side = "right")]
+    outside = np.abs(z) > Z_CSS_TABLE_LIMIT
+    for index in zip(*np.nonzero(outside)):
+        result[index] = z_css(z[index])
+    return result
+
+# Number of colors in the palette of z_palette_css_array, spaced evenly along
+# the tone mapping.
+PALETTE_SIZE = 32
+
+# The parameters that z_palette_styles was built for, and the styles.
+z_palette_styles_key = None
+z_palette_styles = None
+
+def get_z_palette_styles():
+    global z_palette_styles_key, z_palette_styles
+    key = (COLOR_LOW, COLOR_HIGH, LUMINANCE_INVERSION_THRESHOLD, PALETTE_SIZE)
+    if key != z_palette_styles_key:
+        z_palette_styles = np.empty(PALETTE_SIZE, dtype = object)
+        for i in range(PALETTE_SIZE):
+            z_palette_styles[i] = srgb_css(interpolate_srgb((i + 0.5) / PALETTE_SIZE, COLOR_LOW, COLOR_HIGH))
+        z_palette_styles_key = key
+    return z_palette_styles
+
+def z_palette_css_array(z):
+    """Like z_css_array, but with the color of every element quantized to one
+    of PALETTE_SIZE colors."""
+    z = np.asarray(z, dtype = float)
+    z = np.where(np.isnan(z), 0.0, z)
+    # tone_map, for arrays.
+    with np.errstate(over = "ignore"):
+        tone = 1.0 / (1.0 + np.exp(-z * SHADE_MAPPING_ADJUST))
+    return get_z_palette_styles()[np.minimum((tone * PALETTE_SIZE).astype(np.intp), PALETTE_SIZE - 1)]
+
+# Ways of styling the cells of HTML tables: with style attributes; with a
+# StyleSheet class for every distinct style, which renders the same; or with a
+# StyleSheet whose colors are quantized to PALETTE_SIZE colors. On the whole
+# corpus, classes make tables.html 244 KB instead of 850 KB (shape_table_html
+# also shortens its markup for them), summary-table.html 87 KB instead of
+# 330 KB, and table-ssl.html 36 KB instead of 67 KB; the palette makes them
+# 233 KB, 69 KB, and 22 KB.
+CSS_MODES = ("inline", "classes", "palette")
+
+def add_css_argument(parser):
+    parser.add_argument("--css", choices = CSS_MODES, default = "inline", help = "style cells with style attributes (default), with a class for each style, or with a class for each color of a fixed palette")
+
+def css_style_sheet(mode):
+    """Returns the StyleSheet for a --css mode of add_css_argument, or None for
+    inline styles."""
+    return None if mode == "inline" else StyleSheet(palette = mode == "palette")
+
+class StyleSheet:
+    """Gives every distinct style, a tuple of (property, value) pairs as taken
+    by html_start_tag_style, a class, so that elements can refer to their style
+    by a short class name instead of repeating it in a style attribute. The
+    rule of each class has the declarations of its style in the same order, so
+    an element renders the same either way.
+
+    With palette = True, z_css_array quantizes colors with
+    z_palette_css_array, so that there are fewer distinct styles."""
+
+    def __init__(self, palette = False, prefix = "s"):
+        self.palette = palette
+        self.prefix = prefix
+        self.rules = {}
+        self.classes = {}
+        self.tags = {}
+
+    def z_css_array(self, z):
+        return z_palette_css_array(z) if self.palette else z_css_array(z)
+
+    def start_tag(self, name, style = (), attrs = ()):
+        """Like html_start_tag_style, but with a class attribute."""
+        key = (name, tuple(style), tuple(attrs))
+        tag = self.tags.get(key)
+        if tag is None:
+            _, style, attrs = key
+            class_name = self.classes.get(style)
+            if class_name is None:
+                class_name = self.classes[style] = f"{self.prefix}{len(self.classes)}"
+            # Class names need no quotes.
+            tag = self.tags[key] = html_start_tag(name, attrs)[:-1] + f" class={class_name}>"
+        return tag
+
+    def add_rules(self, rules):
+        """Adds CSS rules, once however often they are added, before the rules
+        of the classes."""
+        self.rules[rules] = None
+
+    def css(self):
+        """Returns the CSS rules added with add_rules, then those of all the
+        classes given out so far."""
+        return "".join(self.rules) + "".join(
+            f".{class_name} {{ " + " ".join(css_escape_ident(property) + ": " + css_escape_value(value) + ";" for property, value in style) + " }\n"
+            for style, class_name in self.classes.items()
+        )
+
+    def insert(self, document):
+        """Returns the HTML document with a style element of the rules of
+        css inserted before its </head>. The document can only be completed
+        after all its elements have been given classes, so it is kept in
+        memory until then."""
+        i = document.index("</head>")
+        return document[:i] + "<style>\n" + self.css() + "</style>\n" + document[i:]
+
 # Return the mean of the sequence that arises from repeating each element e of
 # x, e times.
 def weighted_mean(x):
@@ -119,6 +549,7 @@ def weighted_sd_pop(x):
     μ = weighted_mean(x)
     return math.sqrt(sum(e*(e - μ)**2 for e in x) / sum(x))
 
+@instrumented
 def expectancy(x, xvec):
     if sum(xvec) > 0:
         μ = weighted_mean(xvec)
@@ -128,6 +559,928 @@ def expectancy(x, xvec):
         z = None
     return z
 
+@instrumented
+def expectancy_array(counts):
+    """Takes an array of counts whose last axis is sedes (for example, shapes ×
+    sedes or works × shapes × sedes), and returns a float array of the same
+    dimensions with the expectancy of every count among the counts that share
+    all its other indices. Where expectancy would return None, the result is
+    NaN."""
+    counts = np.asarray(counts, dtype = float)
+    # Sum over sedes one column at a time, in the same order as the sum() in
+    # weighted_mean and weighted_sd_pop, so the results are identical to
+    # expectancy.
+    n = np.zeros(counts.shape[:-1])
+    sum_sq = np.zeros(counts.shape[:-1])
+    for i in range(counts.shape[-1]):
+        n += counts[..., i]
+        sum_sq += counts[..., i] * counts[..., i]
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        μ = sum_sq / n
+        sum_dev = np.zeros(counts.shape[:-1])
+        for i in range(counts.shape[-1]):
+            sum_dev += counts[..., i] * (counts[..., i] - μ)**2
+        σ = np.sqrt(sum_dev / n)
+        z = (counts - μ[..., np.newaxis]) / σ[..., np.newaxis]
+    z[~((n > 0) & (σ != 0.0))] = np.nan
+    return z
+
+# Convert an element of an expectancy_array to what expectancy would return.
+def z_or_none(z):
+    return None if math.isnan(z) else float(z)
+
+# Return [expectancy(x, xvec) for x in xvec], but computing the mean and
+# standard deviation only once.
+@instrumented
+def expectancies(xvec):
+    if sum(xvec) > 0:
+        μ = weighted_mean(xvec)
+        σ = weighted_sd_pop(xvec)
+        if σ != 0.0:
+            return [(x - μ) / σ for x in xvec]
+    return [None] * len(xvec)
+
+# Format z as in expectancy CSV files.
+def format_z(z):
+    return "" if z is None else f"{z:+.15g}"
+
+def parse_by(by):
+    """Parses an expectancy grouping like "sedes/work,metrical_shape" into the
+    tuple of fields that groups the distribution of sedes, like ("work",
+    "metrical_shape")."""
+    var, sep, fields = by.partition("/")
+    if var != "sedes" or not sep:
+        raise ValueError(f"unsupported grouping {by!r}")
+    return tuple(fields.split(",")) if fields else ()
+
+def read_sedes_counts(f, fields):
+    """Counts the rows of the corpus CSV file f by the values of fields and by
+    sedes. Returns a Counter keyed by (*values, sedes), with sedes as a float.
+    Rows with no sedes are not counted."""
+    r = csv.reader(f)
+    header = next(r)
+    indices = [header.index(field) for field in fields + ("sedes",)]
+    counts = collections.Counter()
+    for key, x in collections.Counter(tuple(row[i] for i in indices) for row in r).items():
+        if key[-1] != "":
+            counts[key[:-1] + (float(key[-1]),)] += x
+    return counts
+
+def read_expectancy_index(f, fields):
+    """Reads an expectancy CSV file grouped by fields, as written by
+    expectancy.py. Returns a dict mapping (*values, sedes), with sedes as a
+    float, to the (x, z) strings of the matching row."""
+    r = csv.reader(f)
+    header = next(r)
+    indices = [header.index(field) for field in fields + ("sedes", "x", "z")]
+    index = {}
+    for row in r:
+        *key, sedes, x, z = (row[i] for i in indices)
+        index[tuple(key) + (float(sedes),)] = (x, z)
+    return index
+
+def expectancy_rows(counts):
+    """Takes a mapping from (*key, sedes) to x and yields (*key, sedes, x, z)
+    tuples in order of key and sedes, where z is the expectancy of x among all
+    the counts with the same key."""
+    for key, group in itertools.groupby(sorted(counts.items()), lambda item: item[0][:-1]):
+        group = list(group)
+        for ((*_, sedes), x), z in zip(group, expectancies([x for _, x in group])):
+            yield key + (sedes, x, z)
+
+def update_expectancy_rows(index, delta):
+    """Takes an index of an expectancy table as returned by
+    read_expectancy_index and a mapping delta from (*key, sedes) to a change in
+    x, and yields the (*key, sedes, x, z) tuples of the updated table in order,
+    as strings. z is recomputed only for keys whose counts have changed; the
+    rows of other keys are as in index."""
+    counts = {k: int(x) for k, (x, _) in index.items()}
+    for k, d in delta.items():
+        x = counts.get(k, 0) + d
+        if x < 0:
+            raise ValueError(f"negative count for {k}")
+        if x == 0:
+            counts.pop(k, None)
+        else:
+            counts[k] = x
+    affected = set(k[:-1] for k, d in delta.items() if d != 0)
+    updated = {}
+    for *key, sedes, x, z in expectancy_rows({k: x for k, x in counts.items() if k[:-1] in affected}):
+        updated[tuple(key) + (sedes,)] = (str(x), format_z(z))
+    for k in sorted(counts):
+        yield k + (updated[k] if k[:-1] in affected else index[k])
+
+# Directory for cached columnar copies of parsed CSV files. Set the
+# environment variable EPIC_RHYTHM_CACHE to use a different directory, or to
+# the empty string to disable caching.
+CACHE_DIR = os.environ.get("EPIC_RHYTHM_CACHE", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+
+# A dictionary-encoded string column: the value of row i is
+# categories[codes[i]].
+Categorical = collections.namedtuple("Categorical", ("codes", "categories"))
+
+class Table:
+    """Columns of a CSV file, as returned by load_csv. Numeric columns are
+    NumPy arrays and string columns are Categoricals."""
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __len__(self):
+        for column in self.columns.values():
+            return len(column.codes if isinstance(column, Categorical) else column)
+        return 0
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def strings(self, name):
+        """Returns the decoded values of the string column name as a list."""
+        codes, categories = self.columns[name]
+        return categories[codes].tolist()
+
+DTYPE_NAMES = {int: "int", float: "float", str: "str"}
+
+@instrumented
+def parse_csv_columns(f, dtypes):
+    """Parses the columns named in dtypes from the CSV file f. dtypes maps
+    column names to int, float, or str. An empty float is NaN. Returns a
+    Table."""
+    r = csv.reader(f)
+    header = next(r)
+    indices = [header.index(name) for name in dtypes]
+    encodings = [{} if dtype is str else None for dtype in dtypes.values()]
+    return Table(parse_csv_values(r, dtypes, indices, encodings))
+
+def parse_csv_values(rows, dtypes, indices, encodings):
+    """Parses the fields at indices of rows into a dict of columns as in
+    parse_csv_columns. encodings has a dict for each str column, mapping
+    strings to codes, which is extended with any new strings."""
+    values = [[] for _ in dtypes]
+    for row in rows:
+        for i, v, encoding, dtype in zip(indices, values, encodings, dtypes.values()):
+            s = row[i]
+            if encoding is not None:
+                code = encoding.get(s)
+                if code is None:
+                    code = encoding[s] = len(encoding)
+                v.append(code)
+            elif dtype is float:
+                v.append(float(s) if s != "" else math.nan)
+            else:
+                v.append(int(s))
+    columns = {}
+    for name, v, encoding, dtype in zip(dtypes, values, encodings, dtypes.values()):
+        if encoding is not None:
+            # np.array of an empty list of strings would have dtype float.
+            columns[name] = Categorical(np.array(v, dtype = np.int32), np.array(list(encoding), dtype = str) if encoding else np.array([], dtype = "<U1"))
+        else:
+            columns[name] = np.array(v, dtype = {int: np.int64, float: np.float64}[dtype])
+    return columns
+
+def file_sha256(filename):
+    h = hashlib.sha256()
+    with open(filename, "rb") as f:
+        while True:
+            data = f.read(1 << 20)
+            if not data:
+                break
+            h.update(data)
+    return h.hexdigest()
+
+def save_npy(filename, a):
+    tmp_filename = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp_filename, "wb") as f:
+        np.save(f, a)
+    os.replace(tmp_filename, filename)
+
+def save_json(filename, obj):
+    tmp_filename = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp_filename, "w") as f:
+        json.dump(obj, f)
+    os.replace(tmp_filename, filename)
+
+def save_text(filename, text):
+    tmp_filename = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp_filename, "w") as f:
+        f.write(text)
+    os.replace(tmp_filename, filename)
+
+def source_sha256(filename, cache_dir = None):
+    """Returns the SHA-256 of the contents of filename. The file is read every
+    time, as its contents can change without its size or modification time
+    changing. If caching is enabled, the SHA-256 is recorded under cache_dir
+    (by default CACHE_DIR), and when it differs from the one recorded before,
+    the cache entry of the old contents is pruned."""
+    sha256 = file_sha256(filename)
+    if cache_dir is None:
+        cache_dir = CACHE_DIR
+    if not cache_dir:
+        return sha256
+    path = os.path.abspath(filename)
+    source_filename = os.path.join(cache_dir, "sources", os.path.basename(path) + "-" + hashlib.sha256(path.encode()).hexdigest()[:16] + ".json")
+    try:
+        with open(source_filename) as f:
+            old_sha256 = json.load(f).get("sha256")
+    except (FileNotFoundError, json.JSONDecodeError):
+        old_sha256 = None
+    if old_sha256 != sha256:
+        os.makedirs(os.path.dirname(source_filename), exist_ok = True)
+        save_json(source_filename, {"sha256": sha256})
+        if old_sha256 is not None:
+            prune_cache_entry(old_sha256, cache_dir)
+    return sha256
+
+def prune_cache_entry(sha256, cache_dir):
+    """Removes the cache entry of the contents with the given SHA-256, unless
+    some source file recorded under cache_dir still has those contents. The
+    entry is first renamed out of the way, so processes that have its files
+    open keep reading them, and others find it missing and parse their file
+    again."""
+    sources_dir = os.path.join(cache_dir, "sources")
+    for name in os.listdir(sources_dir):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(sources_dir, name)) as f:
+                if json.load(f).get("sha256") == sha256:
+                    return
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+    trash_dir = os.path.join(cache_dir, "columns", f".{sha256}.{os.getpid()}.trash")
+    try:
+        os.rename(os.path.join(cache_dir, "columns", sha256), trash_dir)
+    except FileNotFoundError:
+        return
+    shutil.rmtree(trash_dir, ignore_errors = True)
+
+def csv_cache_dir(filename, cache_dir = None, sha256 = None):
+    """Returns the directory in which load_csv caches the columns of filename,
+    or None if caching is disabled. sha256, if given, is source_sha256 of
+    filename. The directory is named by the SHA-256 of the contents of
+    filename, so a changed file gets a new directory. Files are only ever
+    added to a directory, each one atomically, and only through
+    save_cache_files, so processes caching the same contents at the same time
+    do not interfere."""
+    if cache_dir is None:
+        cache_dir = CACHE_DIR
+    if not cache_dir:
+        return None
+    if sha256 is None:
+        sha256 = source_sha256(filename, cache_dir)
+    entry_dir = os.path.join(cache_dir, "columns", sha256)
+    os.makedirs(entry_dir, exist_ok = True)
+    return entry_dir
+
+def save_cache_files(entry_dir, filename, save):
+    """Calls save(), which writes files in the cache entry entry_dir of the
+    contents of filename, if filename still has those contents: it may have
+    changed while it was being parsed. Does nothing if the entry has been
+    pruned in the meantime."""
+    if file_sha256(filename) != os.path.basename(entry_dir):
+        return
+    with contextlib.suppress(FileNotFoundError):
+        save()
+
+def sedes_counts_filename(sha256, fields, cache_dir = None):
+    if cache_dir is None:
+        cache_dir = CACHE_DIR
+    if not cache_dir:
+        return None
+    return os.path.join(cache_dir, "sedes-counts", f"{sha256}.{','.join(fields)}.json")
+
+def stored_sedes_counts(sha256, fields, cache_dir = None):
+    """Returns the counts that load_sedes_counts stored for a corpus file with
+    contents of the given SHA-256, or None if there are none."""
+    filename = sedes_counts_filename(sha256, fields, cache_dir)
+    if filename is None:
+        return None
+    try:
+        with open(filename) as f:
+            rows = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    return collections.Counter({tuple(key): x for *key, x in rows})
+
+def load_sedes_counts(filename, fields, cache_dir = None):
+    """Returns the SHA-256 of the corpus CSV file filename and its
+    read_sedes_counts by fields. The counts are stored under cache_dir by the
+    contents of the file, so that they need not be counted again, and so that
+    the counts of earlier versions of the file remain available to
+    stored_sedes_counts after it changes."""
+    sha256 = source_sha256(filename, cache_dir)
+    counts = stored_sedes_counts(sha256, fields, cache_dir)
+    if counts is None:
+        with open(filename, newline = "") as f:
+            counts = read_sedes_counts(f, fields)
+        counts_filename = sedes_counts_filename(sha256, fields, cache_dir)
+        if counts_filename is not None:
+            os.makedirs(os.path.dirname(counts_filename), exist_ok = True)
+            save_json(counts_filename, [list(key) + [x] for key, x in counts.items()])
+    return sha256, counts
+
+# Columns already loaded from files by load_csv in this process, keyed by
+# (absolute filename, column name, dtype), with values of (SHA-256 of the
+# file, column). Processes forked after loading share them.
+LOADED_COLUMNS = {}
+
+@instrumented
+def load_csv(f, dtypes, cache_dir = None):
+    """Loads the columns named in dtypes from the CSV file f, which may be a
+    filename or a file object, as in parse_csv_columns. When f is a filename,
+    the parsed columns are cached in binary form under cache_dir (by default
+    CACHE_DIR), so that later loads of the same columns from an unchanged file
+    do not have to parse it, and are kept in LOADED_COLUMNS, so that later loads
+    in the same process do not have to read them again. Either way, the file
+    is hashed to check that it has not changed."""
+    if not isinstance(f, (str, os.PathLike)):
+        return parse_csv_columns(f, dtypes)
+    path = os.path.abspath(f)
+    sha256 = source_sha256(path, cache_dir)
+    loaded = [LOADED_COLUMNS.get((path, name, dtype)) for name, dtype in dtypes.items()]
+    if all(entry is not None and entry[0] == sha256 for entry in loaded):
+        return Table({name: column for name, (_, column) in zip(dtypes, loaded)})
+    table = load_csv_file(path, dtypes, cache_dir, sha256)
+    for name, dtype in dtypes.items():
+        LOADED_COLUMNS[(path, name, dtype)] = (sha256, table[name])
+    return table
+
+def cache_column_filenames(entry_dir, name, dtype):
+    """Returns the filenames of the cached column name of type dtype in the
+    cache entry entry_dir: the codes and categories of a str column, or the
+    values of another column."""
+    base = os.path.join(entry_dir, f"{name}.{DTYPE_NAMES[dtype]}")
+    return (base + ".codes.npy", base + ".categories.npy") if dtype is str else (base + ".npy",)
+
+def load_csv_file(filename, dtypes, cache_dir = None, sha256 = None):
+    """Loads the columns named in dtypes from the CSV file filename, through the
+    cache under cache_dir (by default CACHE_DIR) if caching is enabled. sha256
+    is as for csv_cache_dir."""
+    entry_dir = csv_cache_dir(filename, cache_dir, sha256)
+    if entry_dir is None:
+        with open(filename, newline = "") as fp:
+            return parse_csv_columns(fp, dtypes)
+
+    columns = {}
+    try:
+        for name, dtype in dtypes.items():
+            arrays = [np.load(npy_filename) for npy_filename in cache_column_filenames(entry_dir, name, dtype)]
+            columns[name] = Categorical(*arrays) if dtype is str else arrays[0]
+    except FileNotFoundError:
+        with open(filename, newline = "") as fp:
+            table = parse_csv_columns(fp, dtypes)
+        def save():
+            for name, dtype in dtypes.items():
+                arrays = table[name] if dtype is str else (table[name],)
+                for npy_filename, a in zip(cache_column_filenames(entry_dir, name, dtype), arrays):
+                    save_npy(npy_filename, a)
+        save_cache_files(entry_dir, filename, save)
+        return table
+    return Table(columns)
+
+# Number of rows in each chunk yielded by iter_csv_chunks.
+CSV_CHUNK_ROWS = 1 << 16
+
+def iter_csv_chunks(f, dtypes, chunk_size = CSV_CHUNK_ROWS, cache_dir = None):
+    """Like load_csv, but yields the columns in consecutive Tables of at most
+    chunk_size rows, so that memory use does not grow with the size of the
+    file. String columns are encoded consistently across chunks: the categories
+    of each chunk extend those of the chunk before.
+
+    When f is a filename whose columns are already cached, the chunks are
+    slices of memory-mapped cache files. Otherwise f is parsed as it is read,
+    and, if it is a filename and caching is enabled, its columns are cached
+    once all the chunks have been consumed."""
+    if not isinstance(f, (str, os.PathLike)):
+        yield from parse_csv_chunks(f, dtypes, chunk_size)
+        return
+    path = os.path.abspath(f)
+    sha256 = source_sha256(path, cache_dir)
+    loaded = [LOADED_COLUMNS.get((path, name, dtype)) for name, dtype in dtypes.items()]
+    if all(entry is not None and entry[0] == sha256 for entry in loaded):
+        yield from slice_table(Table({name: column for name, (_, column) in zip(dtypes, loaded)}), chunk_size)
+        return
+    entry_dir = csv_cache_dir(path, cache_dir, sha256)
+    if entry_dir is None:
+        with open(path, newline = "") as fp:
+            yield from parse_csv_chunks(fp, dtypes, chunk_size)
+        return
+    columns = {}
+    try:
+        for name, dtype in dtypes.items():
+            arrays = [np.load(filename, mmap_mode = "r") for filename in cache_column_filenames(entry_dir, name, dtype)]
+            columns[name] = Categorical(arrays[0], np.asarray(arrays[1])) if dtype is str else arrays[0]
+    except FileNotFoundError:
+        pass
+    else:
+        yield from slice_table(Table(columns), chunk_size)
+        return
+    # Parse the file, appending the parsed values of every chunk to raw
+    # temporary files, then convert those into cache files at the end.
+    raw_filenames = {name: f"{cache_column_filenames(entry_dir, name, dtype)[0]}.{os.getpid()}.raw" for name, dtype in dtypes.items()}
+    raw_files = {}
+    try:
+        try:
+            for name, raw_filename in raw_filenames.items():
+                raw_files[name] = open(raw_filename, "wb")
+        except FileNotFoundError:
+            # The entry has been pruned, as the file has changed since it was
+            # hashed.
+            with open(path, newline = "") as fp:
+                yield from parse_csv_chunks(fp, dtypes, chunk_size)
+            return
+        table = None
+        with open(path, newline = "") as fp:
+            for table in parse_csv_chunks(fp, dtypes, chunk_size):
+                for name, dtype in dtypes.items():
+                    (table[name].codes if dtype is str else table[name]).tofile(raw_files[name])
+                yield table
+        for raw_file in raw_files.values():
+            raw_file.close()
+        def save():
+            for name, dtype in dtypes.items():
+                filenames = cache_column_filenames(entry_dir, name, dtype)
+                if dtype is str:
+                    save_npy(filenames[1], table[name].categories if table is not None else np.array([], dtype = "<U1"))
+                save_npy_from_raw(filenames[0], raw_filenames[name], np.int32 if dtype is str else {int: np.int64, float: np.float64}[dtype])
+        save_cache_files(entry_dir, path, save)
+    finally:
+        for name, raw_file in raw_files.items():
+            raw_file.close()
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(raw_filenames[name])
+
+def save_npy_from_raw(filename, raw_filename, dtype, chunk_size = CSV_CHUNK_ROWS):
+    """Saves the raw array of dtype in raw_filename as an .npy file, without
+    reading all of it into memory at once."""
+    n = os.path.getsize(raw_filename) // np.dtype(dtype).itemsize
+    if n == 0:
+        save_npy(filename, np.empty(0, dtype = dtype))
+        return
+    raw = np.memmap(raw_filename, dtype = dtype, mode = "r", shape = (n,))
+    tmp_filename = f"{filename}.{os.getpid()}.tmp"
+    a = np.lib.format.open_memmap(tmp_filename, mode = "w+", dtype = dtype, shape = (n,))
+    for start in range(0, n, chunk_size):
+        a[start:start + chunk_size] = raw[start:start + chunk_size]
+    a.flush()
+    del a, raw
+    os.replace(tmp_filename, filename)
+
+def parse_csv_chunks(f, dtypes, chunk_size):
+    """Parses the columns named in dtypes from the CSV file f, as in
+    parse_csv_columns, and yields them in Tables of at most chunk_size rows,
+    as in iter_csv_chunks."""
+    r = csv.reader(f)
+    header = next(r)
+    indices = [header.index(name) for name in dtypes]
+    encodings = [{} if dtype is str else None for dtype in dtypes.values()]
+    while True:
+        rows = list(itertools.islice(r, chunk_size))
+        if not rows:
+            break
+        yield Table(parse_csv_values(rows, dtypes, indices, encodings))
+        if len(rows) < chunk_size:
+            break
+
+def slice_table(table, chunk_size):
+    """Yields consecutive slices of table of at most chunk_size rows."""
+    for start in range(0, len(table), chunk_size):
+        yield Table({
+            name: Categorical(column.codes[start:start + chunk_size], column.categories) if isinstance(column, Categorical) else column[start:start + chunk_size]
+            for name, column in table.columns.items()
+        })
+
+class CountTensor:
+    """Counts x and expectancies z of an expectancy table, as dense works ×
+    shapes × sedes arrays.
+
+    works, shapes, and sedes are tuples of the labels along each axis, and
+    work_index, shape_index, and sedes_index map labels back to indices. sedes
+    is KNOWN_SEDES as floats; shapes are packed shapes (see encode_shape), in
+    the order of shapes_gen. A table with no work column has a single work,
+    None.
+
+    present is True for cells that have a row in the table; x is 0 and z is
+    NaN elsewhere. covered starts out all False, for a report to mark the cells
+    it has rendered, so it can check with uncovered that it has not missed
+    any."""
+
+    def __init__(self, works, shapes, x, z, present):
+        self.works = tuple(works)
+        self.shapes = tuple(shapes)
+        self.sedes = tuple(map(float, KNOWN_SEDES))
+        self.work_index = {work: i for i, work in enumerate(self.works)}
+        self.shape_index = {shape: i for i, shape in enumerate(self.shapes)}
+        self.sedes_index = {sedes: i for i, sedes in enumerate(self.sedes)}
+        self.x = x
+        self.z = z
+        self.present = present
+        self.covered = np.zeros(present.shape, dtype = bool)
+
+    @classmethod
+    def from_table(cls, table, works = tuple(work.id for work in KNOWN_WORKS)):
+        """Makes a CountTensor from a Table with metrical_shape, sedes, x, and z
+        columns, and optionally a work column. The works axis starts with
+        works, followed by any other works in the table."""
+        n = len(table)
+        if "work" in table.columns:
+            codes, categories = table["work"]
+            works = tuple(works) + tuple(work for work in categories.tolist() if work not in works)
+            work_codes = np.array([works.index(work) for work in categories.tolist()], dtype = np.intp)[codes]
+        else:
+            works = (None,)
+            work_codes = np.zeros(n, dtype = np.intp)
+        codes, categories = table["metrical_shape"]
+        encoded = [encode_shape(shape) for shape in categories.tolist()]
+        shapes = sorted(encoded)
+        shape_codes = np.searchsorted(np.array(shapes, dtype = np.int64), np.array(encoded, dtype = np.int64)).astype(np.intp)[codes]
+        known_sedes = np.array(list(map(float, KNOWN_SEDES)))
+        sedes_codes = np.searchsorted(known_sedes, table["sedes"])
+        if n > 0 and not (known_sedes[np.minimum(sedes_codes, len(known_sedes) - 1)] == table["sedes"]).all():
+            raise ValueError(f"unknown sedes in {sorted(set(table['sedes'].tolist()) - set(known_sedes.tolist()))}")
+        dims = (len(works), len(shapes), len(known_sedes))
+        flat = np.ravel_multi_index((work_codes, shape_codes, sedes_codes), dims)
+        if n > 0 and np.bincount(flat).max() > 1:
+            raise ValueError("duplicate rows in expectancy table")
+        x = np.zeros(dims, dtype = np.int64)
+        z = np.full(dims, np.nan)
+        present = np.zeros(dims, dtype = bool)
+        x.flat[flat] = table["x"]
+        z.flat[flat] = table["z"]
+        present.flat[flat] = True
+        return cls(works, shapes, x, z, present)
+
+    def expectancy(self):
+        """Returns z, with the expectancy of a count of 0 filled in for cells
+        that are not present, as an array like that of expectancy_array."""
+        return np.where(self.present, self.z, expectancy_array(self.x))
+
+    def leave_one_out(self):
+        """Returns the works × shapes × sedes counts of all works but each one,
+        computed by subtracting the counts of each work from the total, and
+        their expectancies, as an array like that of expectancy_array."""
+        x = self.x.sum(axis = 0) - self.x
+        return x, expectancy_array(x)
+
+    def sum_works(self, works):
+        """Returns the shapes × sedes sum of x over the given works."""
+        return self.x[[self.work_index[work] for work in works]].sum(axis = 0)
+
+    def uncovered(self):
+        """Returns a list of the (work, shape, sedes) of present cells that are
+        not covered."""
+        return [(self.works[i], self.shapes[j], self.sedes[k]) for i, j, k in zip(*np.nonzero(self.present & ~self.covered))]
+
+class WindowCounts:
+    """Counts of flagged rows in sliding windows of rows, within groups of
+    rows, from one prefix sum over all the groups.
+
+    groups is a list of the group keys, in order of first appearance. order is
+    the permutation of row indices that brings the rows of each group together,
+    keeping their relative order; the rows of group g are
+    order[offsets[g]:offsets[g+1]]. prefix[p] is the number of flagged rows
+    among the first p rows in that order."""
+
+    def __init__(self, groups, order, offsets, prefix):
+        self.groups = groups
+        self.order = order
+        self.offsets = offsets
+        self.prefix = prefix
+        self.group_codes = np.repeat(np.arange(len(groups)), np.diff(offsets))
+
+    @classmethod
+    def from_flags(cls, keys, flags):
+        """Makes a WindowCounts from a list of Categorical key columns, which
+        identify the group of each row, and a boolean array of flags."""
+        flags = np.asarray(flags, dtype = bool)
+        n = len(flags)
+        combined = np.zeros(n, dtype = np.int64)
+        for codes, categories in keys:
+            combined = combined * len(categories) + codes
+        _, first, inverse = np.unique(combined, return_index = True, return_inverse = True)
+        # Number the groups in order of first appearance.
+        rank = np.empty(len(first), dtype = np.intp)
+        rank[np.argsort(first, kind = "stable")] = np.arange(len(first))
+        group_of_row = rank[inverse.reshape(-1)]
+        order = np.argsort(group_of_row, kind = "stable")
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(group_of_row, minlength = len(first)))))
+        prefix = np.concatenate(([0], np.cumsum(flags[order], dtype = np.int64)))
+        groups = [
+            tuple(str(categories[codes[i]]) for codes, categories in keys)
+            for i in np.sort(first).tolist()
+        ]
+        return cls(groups, order, offsets, prefix)
+
+    def windows(self, size, align = "left"):
+        """Returns, in grouped order, the number of flagged rows in the window
+        of size rows that starts at (align = "left") or is centered on (align =
+        "center") each row, or -1 where the window would extend past the ends
+        of the row's group. A centered window of even size has one more row
+        after its center than before, as in RcppRoll's roll_sum."""
+        if size < 1:
+            raise ValueError(f"window size must be positive: {size}")
+        if align == "left":
+            before = 0
+        elif align == "center":
+            before = (size - 1) // 2
+        else:
+            raise ValueError(f"unknown window alignment {align!r}")
+        p = np.arange(len(self.order))
+        start = p - before
+        end = start + size
+        valid = (start >= self.offsets[self.group_codes]) & (end <= self.offsets[self.group_codes + 1])
+        counts = np.full(len(p), -1, dtype = np.int64)
+        counts[valid] = self.prefix[end[valid]] - self.prefix[start[valid]]
+        return counts
+
+    def histogram(self, size):
+        """Returns a groups × (size + 1) array, whose [g, k] element is the
+        number of windows of size rows in group g that contain k flagged rows.
+        The set of windows does not depend on their alignment."""
+        counts = self.windows(size)
+        valid = counts >= 0
+        flat = self.group_codes[valid] * (size + 1) + counts[valid]
+        return np.bincount(flat, minlength = len(self.groups) * (size + 1)).reshape(len(self.groups), size + 1)
+
+def read_csv_header(f):
+    """Reads the header row of the CSV file f, opened in binary mode at its
+    start, and returns the header and the offset of the end of the header."""
+    end = 0
+    def lines():
+        nonlocal end
+        for line in f:
+            end += len(line)
+            yield line.decode("utf-8")
+    return next(csv.reader(lines())), end
+
+# Number of bytes read at a time by csv_row_boundaries.
+QUOTE_COUNT_BLOCK = 1 << 20
+
+def csv_row_boundaries(filename, n):
+    """Divides the rows of the CSV file filename into n ranges of about equal
+    size in bytes. Returns the header of the file and a list of n + 1 byte
+    offsets where rows start: the end of the header, the starts of the ranges
+    after the first, and the end of the file. A row starts after a newline that
+    is preceded by an even number of double quotes, so finding the starts reads
+    the file once, but does not parse it."""
+    with open(filename, "rb") as f:
+        header, offset = read_csv_header(f)
+        size = os.fstat(f.fileno()).st_size
+        boundaries = [offset]
+        if size == offset:
+            return header, boundaries * (n + 1)
+        with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as data:
+            def count_quotes(start, stop):
+                return sum(data[i:min(i + QUOTE_COUNT_BLOCK, stop)].count(b"\"") for i in range(start, stop, QUOTE_COUNT_BLOCK))
+            for k in range(1, n):
+                target = offset + k * (size - offset) // n
+                pos = boundaries[-1]
+                if target <= pos:
+                    boundaries.append(pos)
+                    continue
+                # Quotes between the last row start and the newline before
+                # each candidate.
+                quotes = count_quotes(pos, target - 1)
+                pos = target - 1
+                while True:
+                    newline = data.find(b"\n", pos)
+                    if newline < 0:
+                        boundaries.append(size)
+                        break
+                    quotes += count_quotes(pos, newline)
+                    if quotes % 2 == 0:
+                        boundaries.append(newline + 1)
+                        break
+                    pos = newline + 1
+    boundaries.append(size)
+    return header, boundaries
+
+def iter_verse_lines(filename, start, stop):
+    """Yields the verse lines of the corpus CSV file filename, each as a list
+    of its rows, which are lists of strings, reading rows only from byte offset
+    start, which is one of those returned by csv_row_boundaries. Lines are as
+    in LineIndex. The lines yielded are those whose first row follows a row
+    starting at or after start and before stop, and, if start is the end of
+    the header and stop is after it, the first line. So the lines of
+    consecutive ranges between the offsets from csv_row_boundaries are the
+    lines of the file, each once. Only the current line is held in memory."""
+    if start >= stop:
+        return
+    with open(filename, "rb") as f:
+        header, header_end = read_csv_header(f)
+        indices = [header.index(name) for name in ("work", "book_n", "line_n", "word_n")]
+        f.seek(start)
+        end = start
+        def lines():
+            nonlocal end
+            for line in f:
+                end += len(line)
+                yield line.decode("utf-8")
+        r = csv.reader(lines())
+        prev_key = prev_word_n = prev_start = None
+        if start != header_end:
+            # The row at start is only compared with the row after it.
+            row = next(r, None)
+            if row is None:
+                return
+            prev_key, prev_word_n = tuple(row[i] for i in indices[:3]), int(row[indices[3]])
+            prev_start = start
+        rows = []
+        row_start = end
+        for row in r:
+            key, word_n = tuple(row[i] for i in indices[:3]), int(row[indices[3]])
+            if key != prev_key or word_n <= prev_word_n:
+                if rows:
+                    yield rows
+                if prev_start is not None and prev_start >= stop:
+                    return
+                rows = [row]
+            elif rows:
+                rows.append(row)
+            prev_key, prev_word_n, prev_start = key, word_n, row_start
+            row_start = end
+        if rows:
+            yield rows
+
+class LineIndex:
+    """Index of the verse lines of a corpus CSV file, giving the bytes of the
+    rows of each line, which are sliced from the file through mmap.
+
+    Lines are numbered in file order. A new line starts wherever work, book_n,
+    or line_n changes, or word_n does not increase, as in unexpected.r, so a
+    (work, book_n, line_n) may have more than one line, for example when lines
+    are transposed. The rows of line i are bytes offsets[i]:offsets[i+1] of the
+    file. books[i] numbers the (work, book_n) of line i, increasing through the
+    file. keys are the keys of the lines, as made by key, in sorted order, and
+    order[k] is the line of keys[k]."""
+
+    ARRAYS = ("keys", "order", "offsets", "books")
+
+    def __init__(self, filename, keys, order, offsets, books):
+        self.filename = filename
+        self.keys = keys
+        self.order = order
+        self.offsets = offsets
+        self.books = books
+        with open(filename, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        self.header = next(csv.reader([self.data[:int(offsets[0])].decode("utf-8")]))
+        self.line_text_index = self.header.index("line_text")
+
+    @staticmethod
+    def key(work, book_n, line_n):
+        return "\x1f".join((work, book_n, line_n))
+
+    @classmethod
+    def load(cls, filename, cache_dir = None):
+        """Makes the LineIndex of filename, memory-mapped from the cache under
+        cache_dir (by default CACHE_DIR) if caching is enabled, scanning the
+        file and caching the index the first time."""
+        entry_dir = csv_cache_dir(filename, cache_dir)
+        if entry_dir is not None:
+            npy_filenames = [os.path.join(entry_dir, f"line-index.{name}.npy") for name in cls.ARRAYS]
+            try:
+                return cls(filename, *(np.load(npy_filename, mmap_mode = "r") for npy_filename in npy_filenames))
+            except FileNotFoundError:
+                pass
+        arrays = cls.scan(filename)
+        if entry_dir is not None:
+            def save():
+                for npy_filename, a in zip(npy_filenames, arrays):
+                    save_npy(npy_filename, a)
+            save_cache_files(entry_dir, filename, save)
+        return cls(filename, *arrays)
+
+    @classmethod
+    def scan(cls, filename):
+        """Reads filename once and returns the arrays of its LineIndex, in the
+        order of ARRAYS."""
+        keys = []
+        offsets = []
+        books = []
+        end = 0
+        with open(filename, "rb") as f:
+            def lines():
+                nonlocal end
+                for line in f:
+                    end += len(line)
+                    yield line.decode("utf-8")
+            # csv.reader reads no further than the end of each row, so end is
+            # the offset of the end of the row it last returned.
+            r = csv.reader(lines())
+            header = next(r)
+            indices = [header.index(name) for name in ("work", "book_n", "line_n", "word_n")]
+            prev_key = prev_book = prev_word_n = None
+            row_start = end
+            for row in r:
+                work, book_n, line_n, word_n = (row[i] for i in indices)
+                key = cls.key(work, book_n, line_n)
+                word_n = int(word_n)
+                if key != prev_key or word_n <= prev_word_n:
+                    if (work, book_n) != prev_book:
+                        books.append(books[-1] + 1 if books else 0)
+                        prev_book = (work, book_n)
+                    else:
+                        books.append(books[-1])
+                    keys.append(key)
+                    offsets.append(row_start)
+                    prev_key = key
+                prev_word_n = word_n
+                row_start = end
+            offsets.append(end)
+        keys = np.array(keys, dtype = str)
+        order = np.argsort(keys, kind = "stable")
+        return keys[order], order, np.array(offsets, dtype = np.int64), np.array(books, dtype = np.int64)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def find(self, work, book_n, line_n):
+        """Returns the list of the lines with the given work, book_n, and
+        line_n, in file order."""
+        key = self.key(work, book_n, line_n)
+        return self.order[np.searchsorted(self.keys, key, "left"):np.searchsorted(self.keys, key, "right")].tolist()
+
+    def line_bytes(self, i):
+        """Returns the rows of line i as a memoryview of the file."""
+        return memoryview(self.data)[int(self.offsets[i]):int(self.offsets[i + 1])]
+
+    def line_rows(self, i):
+        """Returns the rows of line i, as lists of strings."""
+        return list(csv.reader(io.StringIO(str(self.line_bytes(i), "utf-8"), newline = "")))
+
+    def line_text(self, i):
+        return self.line_rows(i)[0][self.line_text_index]
+
+    def context(self, i, n):
+        """Returns the range of lines from n before line i to n after it, not
+        going outside the book of line i."""
+        book = self.books[i]
+        return range(
+            max(i - n, int(np.searchsorted(self.books, book, "left"))),
+            min(i + n + 1, int(np.searchsorted(self.books, book, "right"))),
+        )
+
+# Resampling of unexpected-word flags. Only the number of flagged words and the
+# number of words in each book matter: the number of flags drawn when
+# resampling n flags, u of them set, with replacement is Binomial(n, u / n),
+# and the numbers of set flags that land in each book when the flags of a work
+# are permuted among its books are multivariate hypergeometric. So replicates
+# are drawn from those distributions directly, without a per-word array.
+
+# Maximum number of replicate values held in memory at once.
+RESAMPLE_BATCH = 1 << 20
+
+def bootstrap_rate_intervals(num_flagged, num_words, replicates, rng, level = 0.95):
+    """Returns an array of the (low, high) percentile bootstrap confidence
+    interval at level of the rate num_flagged / num_words of every element,
+    from replicates resamplings of its flags."""
+    num_flagged = np.asarray(num_flagged, dtype = np.int64)
+    num_words = np.asarray(num_words, dtype = np.int64)
+    intervals = np.empty((len(num_words), 2))
+    step = max(1, RESAMPLE_BATCH // replicates)
+    for start in range(0, len(num_words), step):
+        n = num_words[start:start + step]
+        p = num_flagged[start:start + step] / np.maximum(n, 1)
+        rates = rng.binomial(n, p, size = (replicates, len(n))) / np.maximum(n, 1)
+        intervals[start:start + step] = np.quantile(rates, [(1 - level) / 2, (1 + level) / 2], axis = 0).T
+    return intervals
+
+def permutation_spread_p(num_flagged, num_words, replicates, rng):
+    """Returns the permutation p-value of the difference between the highest
+    and lowest rates num_flagged / num_words among books, under random
+    reassignment of all the flags to the books, or None if there are fewer
+    than two books."""
+    num_flagged = np.asarray(num_flagged, dtype = np.int64)
+    num_words = np.asarray(num_words, dtype = np.int64)
+    if len(num_words) < 2:
+        return None
+    rates = num_flagged / num_words
+    observed = rates.max() - rates.min()
+    num_extreme = 0
+    step = max(1, RESAMPLE_BATCH // len(num_words))
+    for start in range(0, replicates, step):
+        draws = rng.multivariate_hypergeometric(num_words, int(num_flagged.sum()), size = min(step, replicates - start))
+        rates = draws / num_words
+        # Allow for rounding in the rates that equal the observed ones.
+        num_extreme += int(np.count_nonzero(rates.max(axis = 1) - rates.min(axis = 1) >= observed - 1e-12))
+    return (num_extreme + 1) / (replicates + 1)
+
+def resample_books(num_flagged, num_words, subsets, replicates, seed, level = 0.95):
+    """Bootstrap confidence intervals and a permutation test for the books of a
+    work, drawing from np.random.default_rng(seed), so that the results depend
+    only on seed, not on which process computes them. subsets is a list of
+    lists of indices of books whose pooled rate also gets an interval. Returns
+    the intervals of the books, the intervals of the subsets, and the
+    permutation_spread_p of the books."""
+    rng = np.random.default_rng(seed)
+    num_flagged = np.asarray(num_flagged, dtype = np.int64)
+    num_words = np.asarray(num_words, dtype = np.int64)
+    pooled_flagged = [int(num_flagged[subset].sum()) for subset in subsets]
+    pooled_words = [int(num_words[subset].sum()) for subset in subsets]
+    intervals = bootstrap_rate_intervals(np.concatenate((num_flagged, pooled_flagged)).astype(np.int64), np.concatenate((num_words, pooled_words)).astype(np.int64), replicates, rng, level)
+    return intervals[:len(num_words)], intervals[len(num_words):], permutation_spread_p(num_flagged, num_words, replicates, rng)
+
 # https://html.spec.whatwg.org/multipage/syntax.html#start-tags
 def html_start_tag(name, attrs = ()):
     return "<" + name + "".join(" " + key + "=\"" + html.escape(value) + "\"" for key, value in attrs) + ">"
@@ -159,8 +1512,161 @@ def css_escape_ident(s):
 def css_escape_value(s):
     return "".join(c if not (c == ";" or c == "\\") else css_escape_codepoint(c) for c in s)
 
+@instrumented
 def html_start_tag_style(name, style = (), attrs = ()):
+    return html_start_tag_style_tuple(name, tuple(style), tuple(attrs))
+
+# Almost all cells use one of a few constant styles, so the escaped tags are
+# memoized.
+@functools.lru_cache(maxsize = None)
+def html_start_tag_style_tuple(name, style, attrs):
     return html_start_tag(name, itertools.chain(
         attrs,
         (("style", " ".join(css_escape_ident(property) + ": " + css_escape_value(value) + ";" for property, value in style)),),
     ))
+
+class LineWriter:
+    """Writes lines of text to the file object f (by default sys.stdout)
+    through a buffer, which is written out whenever it reaches buffer_size
+    characters, and by close. Calling a LineWriter with a string writes the
+    string and a newline, like print."""
+
+    def __init__(self, f = None, buffer_size = 1 << 20):
+        self.f = f if f is not None else sys.stdout
+        self.buffer_size = buffer_size
+        self.parts = []
+        self.size = 0
+
+    def __call__(self, s):
+        self.parts.append(s)
+        self.parts.append("\n")
+        self.size += len(s) + 1
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        self.f.write("".join(self.parts))
+        self.parts.clear()
+        self.size = 0
+
+    def close(self):
+        self.flush()
+        self.f.flush()
+
+# The start of an HTML document of shape_table_html tables, up to <body>.
+SHAPE_TABLES_HTML_HEAD = """\
+<html>
+<head>
+<meta charset=utf-8>
+<style>
+th, td {
+    padding: 0 0.5ex;
+    width: 5ex;
+    vertical-align: top;
+}
+th {
+    background-color: lavender;
+    font-weight: bold;
+}
+tr th:first-child, tr td:first-child {
+    background-color: lavender;
+    text-align: left;
+}
+th, tr td {
+    text-align: right;
+}
+td.impermissible {
+    color: lightgray;
+    text-align: center;
+    background-color: cornsilk;
+    font-size: inherit;
+    vertical-align: middle;
+}
+.x {
+    font-size: small;
+}
+.z {
+    font-size: x-small;
+}
+</style>
+</head>
+<body>
+"""
+
+# Rules for the markup of shape_table_html with a StyleSheet, which renders
+# like that with style attributes, with SHAPE_TABLES_HTML_HEAD. Counts are in b
+# and expectancies in i, rather than in span.x and span.z, and impermissible
+# cells are empty, with their ✖ made by CSS. The first cell of a row holds the
+# name of the work, which may have i of its own.
+SHAPE_TABLE_CLASSES_CSS = """\
+td + td b { font-weight: inherit; font-size: small; }
+td + td i { font-style: inherit; font-size: x-small; }
+td:empty { color: lightgray; text-align: center; background-color: cornsilk; font-size: inherit; vertical-align: middle; }
+td:empty::before { content: "✖"; }
+"""
+
+@instrumented
+def shape_table_html(out, shape, rows, style_sheet = None):
+    """Writes with out the heading and table of tables.py for the packed shape,
+    with a row for each (html_name, xvec, zvec) in rows, where xvec and zvec
+    are arrays of counts and expectancies (as in expectancy_array) at
+    KNOWN_SEDES. With a StyleSheet style_sheet, the colors of cells are given
+    by its classes rather than by style attributes, and the markup of the rows
+    is that of SHAPE_TABLE_CLASSES_CSS, with the optional end tags of rows and
+    cells left out, and each row on one line."""
+    shape = packed_shape(shape)
+    text = decode_shape(shape)
+    out(f"<h2 id=\"shape-{html.escape(text)}\">{html.escape(' '.join(text) if text else '(empty shape)')}</h2>")
+
+    out("<table>")
+    out("<tr>")
+    out("<th>Work</th>")
+    for sedes in KNOWN_SEDES:
+        out(f"<th>{html.escape(sedes)}</th>")
+    out("<th>Total</th>")
+    out("</tr>")
+
+    permissible = is_metrically_permissible_batch((shape, float(sedes)) for sedes in KNOWN_SEDES)
+    if style_sheet is not None:
+        style_sheet.add_rules(SHAPE_TABLE_CLASSES_CSS)
+        for html_name, xvec, zvec in rows:
+            xvec = np.asarray(xvec).tolist()
+            cells = [f"<tr><td>{html_name}"]
+            for is_permissible, x, z, css in zip(permissible, xvec, np.asarray(zvec).tolist(), style_sheet.z_css_array(zvec)):
+                if not is_permissible:
+                    assert x == 0, (shape, x)
+                    cells.append("<td>")
+                else:
+                    z = z_or_none(z)
+                    cells.append(style_sheet.start_tag("td", css) + "<b>" + html.escape("{:,}".format(x)) + "</b>")
+                    if z is not None:
+                        cells.append("<br><i>" + html.escape("{:+.03f}".format(z).replace("-", "−")) + "</i>")
+            cells.append(f"<td><b>{html.escape('{:,}'.format(sum(xvec)))}</b>")
+            out("".join(cells))
+        out("</table>")
+        return
+
+    out("<tr>")
+    for html_name, xvec, zvec in rows:
+        out(f"<td>{html_name}</td>")
+        xvec = np.asarray(xvec).tolist()
+        for is_permissible, x, z, css in zip(permissible, xvec, np.asarray(zvec).tolist(), z_css_array(zvec) if style_sheet is None else style_sheet.z_css_array(zvec)):
+            if not is_permissible:
+                assert x == 0, (shape, x)
+                out("<td class=impermissible>✖</td>")
+            else:
+                z = z_or_none(z)
+                contents = "<span class=x>" + html.escape("{:,}".format(x)) + "</span>"
+                if z is not None:
+                    contents += "<br><span class=z>" + html.escape("{:+.03f}".format(z).replace("-", "−")) + "</span>"
+                out(
+                    (html_start_tag_style("td", css) if style_sheet is None else style_sheet.start_tag("td", css)) +
+                    contents +
+                    html_end_tag("td")
+                )
+        out(f"<td><span class=x>{html.escape('{:,}'.format(sum(xvec)))}</span></td>")
+        out("</tr>")
+    out("</table>")
+
+if os.environ.get("EPIC_RHYTHM_PROFILE"):
+    enable_instrumentation()
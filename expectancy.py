@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+# Usage:
+#   expectancy.py --by sedes/FIELDS INPUT.CSV... > OUTPUT.CSV
+#   expectancy.py --job sedes/FIELDS OUTPUT.CSV INPUT.CSV... [--job ...]
+#
+# Computes the expectancy of sedes, grouped by the comma-separated FIELDS, over
+# the corpus CSV files INPUT.CSV, in the same format as the expectancy program
+# of SEDES. Every --job writes one grouping over its own subset of the inputs
+# to OUTPUT.CSV. Each input file is read only once, however many jobs use it.
+#
+# The counts of every input file are stored in the cache directory (see
+# common.CACHE_DIR) by the contents of the file. When an OUTPUT.CSV was written
+# by an earlier run, and some of its inputs have changed since, only the
+# changed inputs are counted again: their old counts are subtracted from the
+# counts in OUTPUT.CSV and their new counts added, and z is recomputed only for
+# the groups whose counts have changed.
+
+import argparse
+import collections
+import csv
+import functools
+import hashlib
+import json
+import os
+import sys
+
+import common
+
+def write_expectancy(f, fields, counts):
+    w = csv.writer(f, lineterminator = "\n")
+    w.writerow(fields + ("sedes", "x", "z"))
+    for *key, sedes, x, z in common.expectancy_rows(counts):
+        w.writerow(key + [f"{sedes:g}", x, common.format_z(z)])
+
+parser = argparse.ArgumentParser(description = "Compute the expectancy of sedes in corpus CSV files.")
+parser.add_argument("--by", metavar = "sedes/FIELDS", help = "grouping for INPUT.CSV, written to standard output")
+parser.add_argument("--job", nargs = "+", action = "append", default = [], metavar = "sedes/FIELDS OUTPUT.CSV INPUT.CSV", help = "write a grouping of the given inputs to OUTPUT.CSV")
+parser.add_argument("inputs", nargs = "*", metavar = "INPUT.CSV")
+args = parser.parse_args()
+
+# List of (fields, output filename, input filenames). An output filename of
+# None means standard output.
+jobs = []
+try:
+    if args.by is not None:
+        jobs.append((common.parse_by(args.by), None, args.inputs))
+    elif args.inputs:
+        parser.error("INPUT.CSV arguments require --by")
+    for job in args.job:
+        if len(job) < 3:
+            parser.error(f"--job needs a grouping, an output, and at least one input: {' '.join(job)}")
+        jobs.append((common.parse_by(job[0]), job[1], job[2:]))
+except ValueError as e:
+    parser.error(str(e))
+if not jobs:
+    parser.error("one of --by or --job is required")
+
+# Count every input once, by the union of the fields of all jobs, then project
+# the counts onto the fields of each job.
+all_fields = tuple(sorted(set(field for fields, _, _ in jobs for field in fields)))
+file_sha256s = {}
+for _, _, inputs in jobs:
+    for filename in inputs:
+        if filename not in file_sha256s:
+            file_sha256s[filename] = common.source_sha256(filename)
+
+@functools.cache
+def file_counts(filename):
+    _, counts = common.load_sedes_counts(filename, all_fields)
+    return counts
+
+def project(counts, fields):
+    indices = [all_fields.index(field) for field in fields]
+    for key, x in counts.items():
+        yield tuple(key[i] for i in indices) + key[-1:], x
+
+def output_state_filename(output):
+    if not common.CACHE_DIR:
+        return None
+    path = os.path.abspath(output)
+    return os.path.join(common.CACHE_DIR, "expectancy-outputs", os.path.basename(path) + "-" + hashlib.sha256(path.encode()).hexdigest()[:16] + ".json")
+
+def incremental_delta(output, fields, inputs):
+    """Returns the change in counts between the inputs that output was last
+    written from and the current contents of inputs, or None if output cannot
+    be updated incrementally."""
+    state_filename = output_state_filename(output)
+    if state_filename is None:
+        return None
+    try:
+        with open(state_filename) as f:
+            state = json.load(f)
+        st = os.stat(output)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if (state.get("fields"), state.get("all_fields")) != (list(fields), list(all_fields)) or (state.get("size"), state.get("mtime_ns")) != (st.st_size, st.st_mtime_ns):
+        return None
+    old = collections.Counter(state["inputs"])
+    new = collections.Counter(file_sha256s[filename] for filename in inputs)
+    delta = collections.Counter()
+    for sha256, n in (old - new).items():
+        counts = common.stored_sedes_counts(sha256, all_fields)
+        if counts is None:
+            return None
+        for key, x in project(counts, fields):
+            delta[key] -= n * x
+    filenames = {file_sha256s[filename]: filename for filename in inputs}
+    for sha256, n in (new - old).items():
+        for key, x in project(file_counts(filenames[sha256]), fields):
+            delta[key] += n * x
+    return delta
+
+for fields, output, inputs in jobs:
+    delta = incremental_delta(output, fields, inputs) if output is not None else None
+    if delta is not None:
+        # Subtract the counts of the inputs that have changed since the last
+        # run, add their new counts, and recompute z only where counts changed.
+        with open(output, newline = "") as f:
+            index = common.read_expectancy_index(f, fields)
+        rows = list(common.update_expectancy_rows(index, delta))
+        tmp_filename = f"{output}.{os.getpid()}.tmp"
+        with open(tmp_filename, "w", newline = "") as f:
+            w = csv.writer(f, lineterminator = "\n")
+            w.writerow(fields + ("sedes", "x", "z"))
+            for *key, sedes, x, z in rows:
+                w.writerow(key + [f"{sedes:g}", x, z])
+        os.replace(tmp_filename, output)
+    else:
+        counts = collections.Counter()
+        for filename in inputs:
+            for key, x in project(file_counts(filename), fields):
+                counts[key] += x
+        if output is None:
+            write_expectancy(sys.stdout, fields, counts)
+        else:
+            with open(output, "w", newline = "") as f:
+                write_expectancy(f, fields, counts)
+    state_filename = output_state_filename(output) if output is not None else None
+    if state_filename is not None:
+        st = os.stat(output)
+        os.makedirs(os.path.dirname(state_filename), exist_ok = True)
+        common.save_json(state_filename, {
+            "fields": fields,
+            "all_fields": all_fields,
+            "inputs": [file_sha256s[filename] for filename in inputs],
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+        })
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+# Usage:
+#   join-expectancy.py [-j JOBS] --by sedes/FIELDS INPUT.CSV... EXPECTANCY.CSV > OUTPUT.CSV
+#   join-expectancy.py [-j JOBS] --by sedes/FIELDS --group INPUT.CSV... EXPECTANCY.CSV [--group ...] > OUTPUT.CSV
+#
+# Copies the rows of the corpus CSV files INPUT.CSV, adding the x and z columns
+# of the row of EXPECTANCY.CSV with the same FIELDS and sedes, like the
+# join-expectancy program of SEDES. Rows with no matching expectancy get empty
+# x and z. Each --group is a list of inputs joined with their own expectancy
+# table. Groups are joined in parallel, by up to JOBS worker processes, and
+# their rows are output in order under a single header.
+
+import argparse
+import concurrent.futures
+import csv
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+
+import common
+
+def join_group(fields, inputs, expectancy_filename, output_filename):
+    """Joins inputs with expectancy_filename into output_filename, without a
+    header. Returns the header of the inputs."""
+    with open(expectancy_filename, newline = "") as f:
+        index = common.read_expectancy_index(f, fields)
+    header = None
+    with open(output_filename, "w", newline = "") as out:
+        w = csv.writer(out, lineterminator = "\n")
+        for filename in inputs:
+            with open(filename, newline = "") as f:
+                r = csv.reader(f)
+                input_header = next(r)
+                if header is None:
+                    header = input_header
+                elif input_header != header:
+                    raise ValueError(f"{filename}: header {input_header} differs from {header}")
+                indices = [header.index(field) for field in fields]
+                sedes_index = header.index("sedes")
+                for row in r:
+                    sedes = row[sedes_index]
+                    entry = None
+                    if sedes != "":
+                        entry = index.get(tuple(row[i] for i in indices) + (float(sedes),))
+                    row.extend(entry if entry is not None else ("", ""))
+                    w.writerow(row)
+    return header
+
+parser = argparse.ArgumentParser(description = "Join corpus CSV files with expectancy.")
+parser.add_argument("--by", required = True, metavar = "sedes/FIELDS")
+parser.add_argument("--group", nargs = "+", action = "append", default = [], metavar = "INPUT.CSV... EXPECTANCY.CSV", help = "join INPUT.CSV with EXPECTANCY.CSV")
+parser.add_argument("-j", "--jobs", type = int, help = "number of worker processes")
+parser.add_argument("filenames", nargs = "*", metavar = "INPUT.CSV... EXPECTANCY.CSV")
+args = parser.parse_args()
+
+try:
+    fields = common.parse_by(args.by)
+except ValueError as e:
+    parser.error(str(e))
+groups = args.group
+if args.filenames:
+    groups = [args.filenames] + groups
+if not groups:
+    parser.error("no inputs")
+for group in groups:
+    if len(group) < 2:
+        parser.error(f"need at least one input and an expectancy table: {' '.join(group)}")
+
+# The joined rows of each group go to a file in a temporary directory, which is
+# removed with all its files however the join ends.
+with tempfile.TemporaryDirectory(prefix = "join-expectancy.") as tmp:
+    tmp_filenames = [os.path.join(tmp, f"{k}.csv") for k in range(len(groups))]
+    with concurrent.futures.ProcessPoolExecutor(max_workers = args.jobs, mp_context = multiprocessing.get_context("fork")) as executor:
+        futures = [executor.submit(join_group, fields, group[:-1], group[-1], tmp_filename) for group, tmp_filename in zip(groups, tmp_filenames)]
+        headers = [future.result() for future in futures]
+    header = headers[0]
+    for group, group_header in zip(groups, headers):
+        if group_header != header:
+            raise ValueError(f"{group[0]}: header {group_header} differs from {header}")
+    csv.writer(sys.stdout, lineterminator = "\n").writerow(header + ["x", "z"])
+    sys.stdout.flush()
+    for tmp_filename in tmp_filenames:
+        with open(tmp_filename, "rb") as f:
+            shutil.copyfileobj(f, sys.stdout.buffer)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+# Usage:
+#   leave-one-out.py [--html TABLES.HTML [--css MODE]] [EXPECTANCY.CSV] > LEAVE-ONE-OUT.CSV
+#
+# Computes, for every work, the expectancy of sedes by metrical shape in the
+# corpus without that work, from the counts by work and metrical shape in
+# EXPECTANCY.CSV (as in expectancy.sedes-work,metrical_shape.csv). The counts of
+# every work are subtracted from the total over all works, so there is no need
+# to count the corpus again for each work.
+#
+# Writes an expectancy CSV file grouped by work and metrical shape, in which the
+# rows of each work are those of the corpus without it, so that it can be
+# joined with join-expectancy.py --by sedes/work,metrical_shape. With --html,
+# also writes tables like those of tables.py to TABLES.HTML, with a row for each
+# work followed by a row for the corpus without it, with cells styled as with
+# tables.py --css MODE.
+
+import argparse
+import csv
+import io
+import sys
+
+import numpy as np
+
+import common
+
+parser = argparse.ArgumentParser(description = "Compute leave-one-work-out expectancy of sedes.")
+parser.add_argument("--html", metavar = "TABLES.HTML", help = "also write HTML tables")
+common.add_css_argument(parser)
+parser.add_argument("input", nargs = "?", metavar = "EXPECTANCY.CSV")
+args = parser.parse_args()
+
+common.begin_phase("load")
+C = common.CountTensor.from_table(common.load_csv(args.input if args.input is not None else sys.stdin, {"work": str, "metrical_shape": str, "sedes": float, "x": int, "z": float}))
+common.begin_phase("expectancy")
+X, Z = C.leave_one_out()
+
+common.begin_phase("render")
+# Works that have any counts, and shapes, in the order of expectancy_rows, which
+# sorts shapes by their text.
+works = sorted(work for work, present in zip(C.works, C.present.any(axis = (1, 2)).tolist()) if present)
+shapes = sorted(C.shapes, key = common.decode_shape)
+w = csv.writer(sys.stdout, lineterminator = "\n")
+w.writerow(("work", "metrical_shape", "sedes", "x", "z"))
+for work in works:
+    i = C.work_index[work]
+    for shape in shapes:
+        j = C.shape_index[shape]
+        for k in np.nonzero(X[i, j])[0].tolist():
+            w.writerow((work, common.decode_shape(shape), f"{C.sedes[k]:g}", int(X[i, j, k]), common.format_z(common.z_or_none(float(Z[i, j, k])))))
+
+if args.html is not None:
+    Z_own = C.expectancy()
+    style_sheet = common.css_style_sheet(args.css)
+    with open(args.html, "w") as f:
+        out = common.LineWriter(f if style_sheet is None else io.StringIO())
+        out(common.SHAPE_TABLES_HTML_HEAD)
+        known = [work for work in common.KNOWN_WORKS if work.id in works]
+        for shape in common.permissible_shapes_gen(12, within = C.shapes):
+            j = C.shape_index[shape]
+            rows = []
+            for work in known:
+                i = C.work_index[work.id]
+                rows.append((work.html_name, C.x[i, j], Z_own[i, j]))
+                rows.append((f"All but {work.html_name}", X[i, j], Z[i, j]))
+            common.shape_table_html(out, shape, rows, style_sheet)
+        out("""\
+</body>
+</html>
+""")
+        out.close()
+        if style_sheet is not None:
+            f.write(style_sheet.insert(out.f.getvalue()))
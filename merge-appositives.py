@@ -0,0 +1,510 @@
+#!/usr/bin/env python3
+
+# Usage:
+#   merge-appositives.py INPUT.CSV... > OUTPUT.CSV
+#   merge-appositives.py --output-dir DIR INPUT.CSV...
+#
+# Merges words with adjacent appositives in CSV files as output by SEDES
+# tei2csv. The `word` and `lemma` columns in merged rows are joined by spaces.
+# The `metrical_shape` columns are concatenated. The output is row for row the
+# same as that of merge-appositives.r.
+#
+# With --output-dir, each INPUT.CSV is merged separately, in parallel, into a
+# file of the same name in DIR.
+
+import argparse
+import concurrent.futures
+import contextlib
+import csv
+import multiprocessing
+import os
+import re
+import sys
+import unicodedata
+
+ALWAYS_PREPOSITIVE_WORDS = (
+    "ἀμ",
+    "ἀμφ᾽",
+    "ἀμφί",
+    "ἀμφὶ",
+    "ἀντί",
+    "ἀντὶ",
+    "ἀν’",
+    "ἀνά",
+    "ἀνὰ",
+    "ἄνευ",
+    "ἀπό",
+    "ἀπὸ",
+    "ἀπ’",
+    "ἀφ’",
+    "δί’",
+    "διά",
+    "διὰ",
+    "εἰν",
+    "εἰς",
+    "ἐκ",
+    "ἐν",
+    "ἐνί",
+    "ἐνὶ",
+    "ἐξ",
+    "ἐπ’",
+    "ἐπί",
+    "ἐπὶ",
+    "ἐς",
+    "ἐφ’",
+    "κάγ",
+    "κὰγ",
+    "κάδ",
+    "κὰδ",
+    "κάθ’",
+    "κάκ",
+    "κὰκ",
+    "κάπ",
+    "κὰπ",
+    "κάρ",
+    "κὰρ",
+    "κάτ",
+    "κὰτ",
+    "κατ’",
+    "κατά",
+    "κατὰ",
+    "μά",
+    "μὰ",
+    "μήδ’",
+    "μηδέ",
+    "μηδὲ",
+    "μηθ’",
+    "μητ’",
+    "μήτε",
+    "οὐ",
+    "οὐδέ",
+    "οὐδὲ",
+    "οὐθ’",
+    "οὐκ",
+    "οὐτ’",
+    "οὔτε",
+    "οὐχ",
+    "αἰ",
+    "ἀλλ’",
+    "ἀλλά",
+    "ἀλλὰ",
+    "αὐτάρ",
+    "αὐτὰρ",
+    "εἰ",
+    "ἐπεί",
+    "ἐπεὶ",
+    "ἐπήν",
+    "ἐπὴν",
+    "ἠ",
+    "ἠδ’",
+    "ἠδέ",
+    "ἠδὲ",
+    "ἠέ",
+    "ἠὲ",
+    "ἦε",
+    "ἠθ’",
+    "ἠμέν",
+    "ἠμὲν",
+    "ἤν",
+    "ἠτ’",
+    "ἰδ’",
+    "ἰδέ",
+    "ἰδὲ",
+    "ἵν’",
+    "ἵνα",
+    "καί",
+    "καὶ",
+    "ὁθ’",
+    "ὅθι",
+    "ὅπερ",
+    "ὁτ’",
+    "ὅτε",
+    "ὅτι",
+    "ὅταν",
+    "ὄφρ’",
+    "ὄφρα",
+    "τόφρ’",
+    "τόφρα",
+    "τῶ",
+    "ὤ",
+    "ὢ",
+    "ὦ",
+    "ὡς",
+    "ὥς",
+    "ὣς",
+    "ὁ",
+    "ἡ",
+    "τό",
+    "τὸ",
+    "οἱ",
+    "τοί",
+    "τοὶ",
+    "αἱ",
+    "ταί",
+    "ταὶ",
+    "τά",
+    "τὰ",
+    "τώ",
+    "τὼ",
+    "τόν",
+    "τὸν",
+    "τήν",
+    "τὴν",
+    "τούς",
+    "τοὺς",
+    "τώς",
+    "τὼς",
+    "τάς",
+    "τὰς",
+    "τοῖο",
+    "τοῦ",
+    "τῆς",
+    "τοῖιν",
+    "τῶν",
+    "τάων",
+    "τῷ",
+    "τῇ",
+    "τοῖς",
+    "τοῖσι",
+    "τοῖσιν",
+    "τῇς",
+    "τῇσι",
+    "τῇσιν",
+    "ὅς",
+    "ὃς",
+    "ἥν",
+    "ἣν",
+    "ὥ",
+    "ὣ",
+    "ἅ",
+    "ἃ",
+    "οὕς",
+    "οὓς",
+    "ἅς",
+    "ἃς",
+    "οὗ",
+    "ἧς",
+    "ὧν",
+    "ᾧ",
+    "ᾗ",
+    "οἷς",
+    "οἷσι",
+    "οἷσιν",
+    "ᾗς",
+    "ᾗσι",
+    "ᾗσιν",
+    "εὖ",
+    "χὠ",
+    "ἕνεκα",
+    "ἕνεκ’",
+    "ἕνεκεν",
+    "εἵνεκα",
+)
+
+ALWAYS_POSTPOSITIVE_WORDS = (
+    "ἄν",
+    "ἂν",
+    "ἄρ",
+    "ἂρ",
+    "ἄρ’",
+    "ἄρα",
+    "γε",
+    "γέ",
+    "γάρ",
+    "γὰρ",
+    "δέ",
+    "δὲ",
+    "δή",
+    "δὴ",
+    "θην",
+    "θήν",
+    "κε",
+    "κέ",
+    "κεν",
+    "κέν",
+    "μέν",
+    "μὲν",
+    "νυ",
+    "νύ",
+    "νυν",
+    "νύν",
+    "περ",
+    "πέρ",
+    "ῥ’",
+    "ῥα",
+    "ῥά",
+    "τε",
+    "τέ",
+    "πῃ",
+    "ποι",
+    "ποθ’",
+    "ποθε",
+    "ποθεν",
+    "ποθι",
+    "ποτ’",
+    "ποτε",
+    "που",
+    "πω",
+    "πως",
+    "με",
+    "μέ",
+    "σε",
+    "σέ",
+    "ἑ",
+    "ἕ",
+    "μιν",
+    "μίν",
+    "ἥμιν",
+    "ἦμιν",
+    "ὕμιν",
+    "ὗμιν",
+    "μευ",
+    "σεθεν",
+    "σεο",
+    "σευ",
+    "τευ",
+    "ἑθεν",
+    "ἑο",
+    "εὑ",
+    "σφε",
+    "σφας",
+    "σφεας",
+    "σφι",
+    "σφιν",
+    "σφω",
+    "σφωε",
+    "σφεων",
+    "σφωιν",
+    "σφωι",
+    "μοι",
+    "μοί",
+    "τοι",
+    "τοί",
+    "σοι",
+    "σοί",
+    "οἱ",
+    "σφισι",
+    "σφισιν",
+    "τις",
+    "τι",
+    "τινες",
+    "τιν’",
+    "τινα",
+    "τινας",
+    "τεο",
+    "τινος",
+    "του",
+    "τινων",
+    "τινι",
+    "τισι",
+    "τισιν",
+    "εἰμι",
+    "εἰμ’",
+    "ἐσσι",
+    "ἐσθ’",
+    "ἐστ’",
+    "ἐστι",
+    "ἐστιν",
+    "εἰμεν",
+    "ἐσμεν",
+    "ἐστον",
+    "ἐστε",
+    "εἰσ’",
+    "εἰσι",
+    "εἰσιν",
+    "ἐών",
+    "ἐὼν",
+    "φημ’",
+    "φημι",
+    "φησι",
+    "φησιν",
+    "φαμεν",
+    "φατ’",
+    "φατε",
+    "φασ’",
+    "φασι",
+    "φασιν",
+    "ἔνι",
+    "εἵνεκα",
+)
+
+# merge-appositives.r compares words against the NFD forms of the lists.
+ALWAYS_PREPOSITIVE = frozenset(unicodedata.normalize("NFD", word) for word in ALWAYS_PREPOSITIVE_WORDS)
+ALWAYS_POSTPOSITIVE = frozenset(unicodedata.normalize("NFD", word) for word in ALWAYS_POSTPOSITIVE_WORDS)
+
+APPOSITIVE_TYPES = ("no", "prepositive", "postpositive", "bidirectional")
+
+def load_exceptional(filename):
+    """Loads the manual list of appositive instances, as a dict mapping (work,
+    book_n, line_n, word_n) to (word, lemma, appositive)."""
+    exceptional = {}
+    with open(filename, newline = "") as f:
+        for row in csv.DictReader(f):
+            if row["appositive"] not in APPOSITIVE_TYPES:
+                raise ValueError(f"unknown appositive notation {row['appositive']!r} in {row}")
+            key = (row["work"], row["book_n"], row["line_n"], int(row["word_n"]))
+            if key in exceptional:
+                raise ValueError(f"duplicate exceptional appositive {key}")
+            exceptional[key] = (row["word"], row["lemma"], row["appositive"])
+    return exceptional
+
+EXCEPTIONAL = load_exceptional(os.path.join(os.path.dirname(os.path.abspath(__file__)), "exceptional-appositives.csv"))
+
+def paste(values, sep):
+    # Like R's paste0(collapse = sep), in which NA (here, "") becomes "NA".
+    return sep.join(value if value != "" else "NA" for value in values)
+
+def leading_int(s):
+    m = re.match(r"\d+", s)
+    return int(m.group()) if m else 0
+
+def nondigit_suffix(s):
+    return re.search(r"[^\d]*$", s).group()
+
+def merge_appositives(header, rows):
+    """Merges appositive groups in rows, which are lists of the fields named in
+    header, and returns the output header and rows."""
+    col = {name: i for i, name in enumerate(header)}
+    WORK, BOOK_N, LINE_N, WORD_N, WORD, LEMMA, SEDES, METRICAL_SHAPE = (col[name] for name in (
+        "work", "book_n", "line_n", "word_n", "word", "lemma", "sedes", "metrical_shape",
+    ))
+    rest = [i for i in range(len(header)) if i not in (WORK, BOOK_N, LINE_N, WORD_N, WORD, LEMMA, SEDES, METRICAL_SHAPE)]
+
+    # Works in order of first appearance, like the levels of a factor.
+    works = {}
+    for row in rows:
+        works.setdefault(row[WORK], len(works))
+
+    # Sanity check: every exceptional appositive matches a word, at least among
+    # the works present in rows.
+    unmatched = {key for key in EXCEPTIONAL if key[0] in works}
+    for row in rows:
+        key = (row[WORK], row[BOOK_N], row[LINE_N], int(row[WORD_N]))
+        e = EXCEPTIONAL.get(key)
+        if e is not None and e[:2] == (row[WORD], row[LEMMA]):
+            unmatched.discard(key)
+    if unmatched:
+        raise ValueError(f"unmatched exceptional appositives: {sorted(unmatched)}")
+
+    # Number the physical lines within each book. A line starts wherever the
+    # line_n changes or the word_n does not increase.
+    books = {}
+    for row in rows:
+        books.setdefault((row[WORK], row[BOOK_N]), []).append(row)
+    lines = {}
+    for (work, book_n), book_rows in books.items():
+        unique_line_n = 0
+        prev_line_n = None
+        prev_word_n = None
+        for row in book_rows:
+            line_n, word_n = row[LINE_N], int(row[WORD_N])
+            if prev_word_n is None:
+                unique_line_n += 1
+            elif (prev_line_n != "" and line_n != prev_line_n) or word_n <= prev_word_n:
+                unique_line_n += 1
+            prev_line_n, prev_word_n = line_n, word_n
+            lines.setdefault((work, book_n, unique_line_n), []).append(row)
+
+    # Merge each prepositive word with the next word, and each postpositive
+    # word with the previous word, by giving them the same word_n, as in
+    # merge-appositives.r.
+    groups = {}
+    for (work, book_n, unique_line_n), line_rows in lines.items():
+        num_prepositive = 0
+        num_postpositive = 0
+        prev_prepositive = False
+        for row in line_rows:
+            word_n = int(row[WORD_N])
+            e = EXCEPTIONAL.get((work, book_n, row[LINE_N], word_n))
+            if e is not None and e[:2] == (row[WORD], row[LEMMA]):
+                appositive = e[2]
+                is_prepositive = appositive in ("prepositive", "bidirectional")
+                is_postpositive = appositive in ("postpositive", "bidirectional")
+            else:
+                is_prepositive = row[WORD] in ALWAYS_PREPOSITIVE
+                is_postpositive = row[WORD] in ALWAYS_POSTPOSITIVE
+            num_prepositive += prev_prepositive
+            num_postpositive += word_n > 1 and is_postpositive and not prev_prepositive
+            prev_prepositive = is_prepositive
+            groups.setdefault((work, book_n, unique_line_n, word_n - num_prepositive - num_postpositive), []).append(row)
+
+    # Synthesize the appositive groups, in the order of the sorted group keys,
+    # then in a sensible order.
+    keys = sorted(groups, key = lambda key: (works[key[0]], key[1] == "", key[1], key[2], key[3]))
+    keys.sort(key = lambda key: (
+        works[key[0]],
+        # Deal with numeric and non-numeric book names.
+        leading_int(key[1]),
+        nondigit_suffix(key[1]),
+        key[2],
+        nondigit_suffix(groups[key][0][LINE_N]),
+        key[3],
+    ))
+    output = []
+    for key in keys:
+        work, book_n, _, word_n = key
+        group_rows = groups[key]
+        first = group_rows[0]
+        output.append([
+            work, book_n, first[LINE_N], str(word_n),
+            paste((row[WORD] for row in group_rows), " "),
+            paste((row[LEMMA] for row in group_rows), " "),
+            first[SEDES],
+            "".join(row[METRICAL_SHAPE] for row in group_rows),
+        ] + [first[i] for i in rest])
+    return ["work", "book_n", "line_n", "word_n", "word", "lemma", "sedes", "metrical_shape"] + [header[i] for i in rest], output
+
+def read_rows(filename):
+    with open(filename, newline = "") as f:
+        r = csv.reader(f)
+        header = next(r)
+        return header, list(r)
+
+def write_rows(f, header, rows):
+    w = csv.writer(f, lineterminator = "\n")
+    w.writerow(header)
+    w.writerows(rows)
+
+def merge_file(input_filename, output_filename):
+    header, rows = merge_appositives(*read_rows(input_filename))
+    tmp_filename = f"{output_filename}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_filename, "w", newline = "") as f:
+            write_rows(f, header, rows)
+        os.replace(tmp_filename, output_filename)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_filename)
+        raise
+
+parser = argparse.ArgumentParser(description = "Merge words with adjacent appositives.")
+parser.add_argument("-j", "--jobs", type = int, help = "number of worker processes with --output-dir")
+parser.add_argument("--output-dir", metavar = "DIR", help = "merge each input separately into DIR")
+parser.add_argument("inputs", nargs = "+", metavar = "INPUT.CSV")
+args = parser.parse_args()
+
+if args.output_dir is None:
+    header = None
+    rows = []
+    for filename in args.inputs:
+        file_header, file_rows = read_rows(filename)
+        if header is not None and file_header != header:
+            parser.error(f"{filename}: header differs from that of {args.inputs[0]}")
+        header = file_header
+        rows.extend(file_rows)
+    write_rows(sys.stdout, *merge_appositives(header, rows))
+else:
+    os.makedirs(args.output_dir, exist_ok = True)
+    status = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers = args.jobs, mp_context = multiprocessing.get_context("fork")) as executor:
+        futures = {
+            executor.submit(merge_file, filename, os.path.join(args.output_dir, os.path.basename(filename))): filename
+            for filename in args.inputs
+        }
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"{futures[future]}: {e!r}", file = sys.stderr)
+                status = 1
+    sys.exit(status)
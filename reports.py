@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+# Usage:
+#   reports.py [-j JOBS] [--profile] [--css MODE] [REPORT.html...]
+#
+# Renders HTML reports in one process, instead of starting an interpreter for
+# each report script. The inputs of all the reports are loaded once, then each
+# report script is run in a worker process forked from this one, and its output
+# is written atomically to REPORT.html. With no REPORT.html arguments, renders
+# all the reports in REPORTS. --css is passed on to every report script.
+
+import argparse
+import concurrent.futures
+import contextlib
+import multiprocessing
+import os
+import runpy
+import sys
+
+# Imported here so that worker processes do not have to import them again.
+import numpy
+
+import common
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Report filename → (script, input filename).
+REPORTS = {
+    "tables.html": ("tables.py", "expectancy.sedes-work,metrical_shape.csv"),
+    "summary-table.html": ("summary-table.py", "expectancy.sedes-metrical_shape.csv"),
+    "table-ssl.html": ("table-ssl.py", "expectancy.sedes-work,metrical_shape.csv"),
+    "unexpected-table.html": ("unexpected-table.py", "joined.sedes-metrical_shape.csv"),
+}
+
+# Columns that the report scripts load from each input, to be loaded once
+# before forking the workers. unexpected-table.py streams its input in chunks
+# instead, so that memory use does not grow with the size of the corpus.
+INPUT_DTYPES = {
+    "expectancy.sedes-work,metrical_shape.csv": {"metrical_shape": str, "work": str, "sedes": float, "x": int, "z": float},
+    "expectancy.sedes-metrical_shape.csv": {"metrical_shape": str, "sedes": float, "x": int, "z": float},
+}
+
+def render(output, script, input_filename, css):
+    """Runs script, in the directory of this file, on input_filename with --css
+    css, writing its standard output to output."""
+    script = os.path.join(SCRIPT_DIR, script)
+    tmp_filename = f"{output}.{os.getpid()}.tmp"
+    if common.INSTRUMENTATION is not None:
+        common.reset_instrumentation()
+    try:
+        with open(tmp_filename, "w") as f, contextlib.redirect_stdout(f):
+            sys.argv = [script, "--css", css, input_filename]
+            try:
+                runpy.run_path(script, run_name = "__main__")
+            except SystemExit as e:
+                # A script that exits with a nonzero status, as argparse does
+                # on a usage error, has failed.
+                if e.code not in (None, 0):
+                    raise RuntimeError(f"{script} exited with status {e.code!r}") from None
+        os.replace(tmp_filename, output)
+        # Worker processes do not run atexit handlers.
+        common.write_instrumentation(output)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_filename)
+        raise
+
+parser = argparse.ArgumentParser(description = "Render HTML reports in one process.")
+parser.add_argument("-j", "--jobs", type = int, help = "number of worker processes")
+parser.add_argument("--profile", action = "store_true", help = "write timings and call counts of each report to stderr, as with EPIC_RHYTHM_PROFILE")
+common.add_css_argument(parser)
+parser.add_argument("outputs", nargs = "*", metavar = "REPORT.html")
+args = parser.parse_args()
+for output in args.outputs:
+    if output not in REPORTS:
+        parser.error(f"unknown report {output!r} (choose from {', '.join(REPORTS)})")
+outputs = args.outputs or list(REPORTS)
+if args.profile:
+    common.enable_instrumentation()
+
+for input_filename in dict.fromkeys(REPORTS[output][1] for output in outputs):
+    if input_filename in INPUT_DTYPES:
+        common.load_csv(input_filename, INPUT_DTYPES[input_filename])
+
+status = 0
+with concurrent.futures.ProcessPoolExecutor(max_workers = args.jobs, mp_context = multiprocessing.get_context("fork")) as executor:
+    futures = {executor.submit(render, output, *REPORTS[output], args.css): output for output in outputs}
+    for future in concurrent.futures.as_completed(futures):
+        try:
+            future.result()
+        except (Exception, SystemExit) as e:
+            print(f"{futures[future]}: {e!r}", file = sys.stderr)
+            status = 1
+sys.exit(status)
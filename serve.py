@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+# Usage:
+#   serve.py [--host HOST] [--port PORT] [EXPECTANCY.CSV]
+#
+# Serves the expectancy of sedes over arbitrary subsets of works, over HTTP on
+# localhost. EXPECTANCY.CSV (by default expectancy.sedes-work,metrical_shape.csv)
+# gives the counts of each work, which are kept in memory and summed over the
+# requested works for every query.
+#
+#   GET /works
+#     JSON list of the work ids.
+#   GET /expectancy?shape=SHAPE[&sedes=SEDES][&works=W1,W2,...]
+#     JSON object of x and z of SHAPE at every sedes (or only at SEDES), over
+#     the given works (by default all of them). z is null where expectancy is
+#     undefined.
+#   GET /table?shape=SHAPE[&works=W1,W2,...]
+#     HTML fragment like a table of tables.html, with a row for each of the
+#     given works and a final row for their total.
+
+import argparse
+import functools
+import http.server
+import json
+import urllib.parse
+
+import numpy as np
+
+import common
+
+class QueryError(Exception):
+    pass
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query, keep_blank_values = True)
+        route = ROUTES.get(url.path)
+        if route is None:
+            self.send(404, "application/json", json.dumps({"error": f"unknown path {url.path!r}"}))
+            return
+        try:
+            content_type, body = route(query)
+        except QueryError as e:
+            self.send(400, "application/json", json.dumps({"error": str(e)}))
+            return
+        self.send(200, content_type, body)
+
+    def send(self, status, content_type, body):
+        body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def query_param(query, name, default = None):
+    values = query.get(name)
+    if not values:
+        if default is None:
+            raise QueryError(f"missing parameter {name!r}")
+        return default
+    if len(values) > 1:
+        raise QueryError(f"repeated parameter {name!r}")
+    return values[0]
+
+def query_works(query):
+    works = query_param(query, "works", ",".join(work for work in C.works if work is not None))
+    works = tuple(dict.fromkeys(works.split(",")))
+    for work in works:
+        if work not in C.work_index:
+            raise QueryError(f"unknown work {work!r}")
+    return works
+
+def query_shape(query):
+    try:
+        return common.encode_shape(query_param(query, "shape"))
+    except ValueError as e:
+        raise QueryError(str(e))
+
+@functools.lru_cache(maxsize = 256)
+def sum_works(works):
+    """Returns the shapes × sedes counts and expectancies summed over works."""
+    X = C.sum_works(works)
+    return X, common.expectancy_array(X)
+
+def shape_vectors(works, shape):
+    """Returns the xvec and zvec of shape summed over works."""
+    j = C.shape_index.get(shape)
+    if j is None:
+        # A shape that does not occur at all.
+        xvec = np.zeros(len(C.sedes), dtype = np.int64)
+        return xvec, common.expectancy_array(xvec)
+    X, Z = sum_works(tuple(sorted(works)))
+    return X[j], Z[j]
+
+def route_works(query):
+    return "application/json", json.dumps([work for work in C.works if work is not None], ensure_ascii = False)
+
+def route_expectancy(query):
+    works = query_works(query)
+    shape = query_shape(query)
+    xvec, zvec = shape_vectors(works, shape)
+    result = {"works": works, "shape": common.decode_shape(shape)}
+    sedes = query.get("sedes")
+    if sedes is None:
+        result["sedes"] = list(common.KNOWN_SEDES)
+        result["x"] = xvec.tolist()
+        result["z"] = [common.z_or_none(z) for z in zvec.tolist()]
+    else:
+        try:
+            k = C.sedes_index[float(query_param(query, "sedes"))]
+        except (KeyError, ValueError):
+            raise QueryError(f"unknown sedes {sedes[0]!r}")
+        result["sedes"] = common.KNOWN_SEDES[k]
+        result["x"] = int(xvec[k])
+        result["z"] = common.z_or_none(float(zvec[k]))
+    return "application/json", json.dumps(result, ensure_ascii = False)
+
+def route_table(query):
+    works = query_works(query)
+    shape = query_shape(query)
+    if not common.is_metrically_permissible_anywhere(shape):
+        raise QueryError(f"shape {common.decode_shape(shape)!r} is not metrically permissible at any sedes")
+    html_names = {work.id: work.html_name for work in common.KNOWN_WORKS}
+    rows = []
+    j = C.shape_index.get(shape)
+    for work in works:
+        if j is None:
+            rows.append((html_names.get(work, work),) + shape_vectors((work,), shape))
+        else:
+            i = C.work_index[work]
+            rows.append((html_names.get(work, work), C.x[i, j], Z[i, j]))
+    rows.append(("Total",) + shape_vectors(works, shape))
+    lines = []
+    common.shape_table_html(lines.append, shape, rows)
+    return "text/html", "".join(line + "\n" for line in lines)
+
+ROUTES = {
+    "/works": route_works,
+    "/expectancy": route_expectancy,
+    "/table": route_table,
+}
+
+parser = argparse.ArgumentParser(description = "Serve expectancy of sedes over subsets of works.")
+parser.add_argument("--host", default = "127.0.0.1", help = "address to listen on (default 127.0.0.1)")
+parser.add_argument("--port", type = int, default = 8000, help = "port to listen on (default 8000)")
+parser.add_argument("input", nargs = "?", default = "expectancy.sedes-work,metrical_shape.csv", metavar = "EXPECTANCY.CSV")
+args = parser.parse_args()
+
+C = common.CountTensor.from_table(common.load_csv(args.input, {"work": str, "metrical_shape": str, "sedes": float, "x": int, "z": float}))
+Z = C.expectancy()
+
+with http.server.ThreadingHTTPServer((args.host, args.port), Handler) as server:
+    print(f"Serving on http://{args.host}:{server.server_address[1]}/", flush = True)
+    server.serve_forever()
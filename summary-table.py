@@ -1,8 +1,14 @@
 #!/usr/bin/env python3
 
+# Usage:
+#   summary-table.py [--css MODE] [EXPECTANCY.CSV] > SUMMARY-TABLE.HTML
+#
+# MODE is one of common.CSS_MODES: inline (the default), classes, or palette.
+
+import argparse
 import collections
-import csv
 import html
+import io
 import sys
 
 import common
@@ -55,14 +61,24 @@ def format_percent(x):
 
 Entry = collections.namedtuple("Entry", ("x", "z"))
 
-M = {}
-r = csv.DictReader(sys.stdin)
-for row in r:
-    key = (row["metrical_shape"], float(row["sedes"]))
-    assert key not in M
-    M[key] = Entry(int(row["x"]), float(row["z"]) if row["z"] != "" else None)
+parser = argparse.ArgumentParser(description = "Write an HTML table of expectancy by metrical shape.")
+common.add_css_argument(parser)
+parser.add_argument("input", nargs = "?", metavar = "EXPECTANCY.CSV")
+args = parser.parse_args()
+style_sheet = common.css_style_sheet(args.css)
+start_tag_style = common.html_start_tag_style if style_sheet is None else style_sheet.start_tag
+z_css_array = common.z_css_array if style_sheet is None else style_sheet.z_css_array
+
+common.begin_phase("load")
+C = common.CountTensor.from_table(common.load_csv(args.input if args.input is not None else sys.stdin, {"metrical_shape": str, "sedes": float, "x": int, "z": float}))
+common.begin_phase("expectancy")
+Z = C.expectancy()
+
+common.begin_phase("render")
+
+out = common.LineWriter() if style_sheet is None else common.LineWriter(io.StringIO())
 
-print("""\
+out("""\
 <html>
 <head>
 <meta charset=utf-8>
@@ -70,76 +86,62 @@ print("""\
 <body>
 """)
 
-print(common.html_start_tag_style("table", STYLE_TABLE))
-print(common.html_start_tag("tr"))
-print(
-    common.html_start_tag_style("th", STYLE_TH + STYLE_LEFT) +
+out(start_tag_style("table", STYLE_TABLE))
+out(common.html_start_tag("tr"))
+out(
+    start_tag_style("th", STYLE_TH + STYLE_LEFT) +
     html.escape("Shape") +
     common.html_end_tag("th")
 )
 for sedes in common.KNOWN_SEDES:
-    print(
-        common.html_start_tag_style("th", STYLE_TH + STYLE_RIGHT) +
+    out(
+        start_tag_style("th", STYLE_TH + STYLE_RIGHT) +
         html.escape(sedes) +
         common.html_end_tag("th")
     )
-print(
-    common.html_start_tag_style("th", STYLE_TH + STYLE_RIGHT) +
+out(
+    start_tag_style("th", STYLE_TH + STYLE_RIGHT) +
     "Total&nbsp;(Σ<var>x</var>)" +
     common.html_end_tag("th")
 )
-print(common.html_end_tag("tr"))
+out(common.html_end_tag("tr"))
 
-for shape in common.shapes_gen():
-    if len(shape) > 12:
-        break
-
-    xvec = []
-    for sedes in map(float, common.KNOWN_SEDES):
-        entry = M.get((shape, sedes))
-        if entry is not None:
-            xvec.append(entry.x)
+# Cells of impermissible shapes, or of shapes longer than 12, are never
+# covered, and so are caught by the assertion at the end.
+for shape in common.permissible_shapes_gen(12, within = C.shapes):
+    j = C.shape_index[shape]
+    xvec = C.x[0, j].tolist()
 
     if sum(xvec) == 0:
-        for sedes in map(float, common.KNOWN_SEDES):
-            assert M.get((shape, sedes)) is None, (shape, sedes)
         continue
 
-    if not common.is_metrically_permissible_anywhere(shape):
-        assert sum(xvec) == 0, xvec
-
-    print(common.html_start_tag("tr"))
-    print(
-        common.html_start_tag_style("td", STYLE_HEADER + STYLE_LEFT) +
-        html.escape('\u2009'.join(shape)) +
+    out(common.html_start_tag("tr"))
+    out(
+        start_tag_style("td", STYLE_HEADER + STYLE_LEFT) +
+        html.escape('\u2009'.join(common.decode_shape(shape))) +
         common.html_end_tag("td")
     )
-    for sedes in map(float, common.KNOWN_SEDES):
-        entry = M.get((shape, sedes))
+    for k, (sedes, x, z, css) in enumerate(zip(C.sedes, xvec, Z[0, j].tolist(), z_css_array(Z[0, j]))):
+        entry = Entry(x, common.z_or_none(z))
         if not common.is_metrically_permissible(shape, sedes):
-            assert entry is None, entry
-            print(
-                common.html_start_tag_style("td", STYLE_IMPERMISSIBLE) +
+            assert not C.present[0, j, k], entry
+            out(
+                start_tag_style("td", STYLE_IMPERMISSIBLE) +
                 html.escape("✖") +
                 common.html_end_tag("td")
             )
         else:
-            if entry is None:
-                entry = Entry(0, common.expectancy(0, xvec))
-            try:
-                del M[(shape, sedes)]
-            except KeyError:
-                pass
+            C.covered[0, j, k] = True
             contents = ""
             contents += (
-                common.html_start_tag_style("span", STYLE_X) +
+                start_tag_style("span", STYLE_X) +
                 html.escape(f"{entry.x:,}") +
                 common.html_end_tag("span")
             )
             contents += common.html_start_tag("br")
             if sum(xvec) > 0:
                 contents += (
-                    common.html_start_tag_style("span", STYLE_PERCENT) +
+                    start_tag_style("span", STYLE_PERCENT) +
                     html.escape(format_percent(entry.x/sum(xvec))) +
                     common.html_end_tag("span")
                 )
@@ -148,30 +150,34 @@ for shape in common.shapes_gen():
             contents += common.html_start_tag("br")
             if entry.z is not None:
                 contents += (
-                    common.html_start_tag_style("span", STYLE_Z) +
+                    start_tag_style("span", STYLE_Z) +
                     html.escape("{:+.02f}".format(entry.z).replace("-", "−")) +
                     common.html_end_tag("span")
                 )
             else:
                 contents += "\u200c"
-            print(
-                common.html_start_tag_style("td", STYLE_CELL + common.z_css(entry.z) + STYLE_RIGHT) +
+            out(
+                start_tag_style("td", STYLE_CELL + css + STYLE_RIGHT) +
                 contents +
                 common.html_end_tag("td")
             )
-    print(common.html_start_tag_style("td", STYLE_CELL + STYLE_RIGHT))
-    print(
-        common.html_start_tag_style("span", STYLE_X) +
+    out(start_tag_style("td", STYLE_CELL + STYLE_RIGHT))
+    out(
+        start_tag_style("span", STYLE_X) +
         html.escape('{:,}'.format(sum(xvec))) +
         common.html_end_tag("span")
     )
-    print(common.html_end_tag("td"))
-    print("</tr>")
-assert len(M) == 0, M
+    out(common.html_end_tag("td"))
+    out("</tr>")
+assert not C.uncovered(), C.uncovered()
 
-print(common.html_end_tag("table"))
+out(common.html_end_tag("table"))
 
-print("""\
+out("""\
 </body>
 </html>
 """)
+
+out.close()
+if style_sheet is not None:
+    sys.stdout.write(style_sheet.insert(out.f.getvalue()))
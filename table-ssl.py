@@ -4,15 +4,23 @@
 # - includes a percentage with each x count
 # - sedes following the anchor sedes are also colored, for as far as SHAPE
 #   reaches.
+#
+# Usage:
+#   table-ssl.py [--css MODE] [EXPECTANCY.CSV] > TABLE-SSL.HTML
+#
+# MODE is one of common.CSS_MODES: inline (the default), classes, or palette.
 
+import argparse
 import collections
-import csv
 import html
+import io
 import sys
 
+import numpy as np
+
 import common
 
-SHAPE = "⏑⏑–"
+SHAPE = common.encode_shape("⏑⏑–")
 
 STYLE_TABLE = (
     ("border-collapse", "collapse"),
@@ -62,17 +70,24 @@ def format_percent(x):
 
 Entry = collections.namedtuple("Entry", ("x", "z"))
 
-M = {}
-r = csv.DictReader(sys.stdin)
-for row in r:
-    key = (row["metrical_shape"], row["work"], float(row["sedes"]))
-    assert key not in M
-    M[key] = Entry(int(row["x"]), float(row["z"]) if row["z"] != "" else None)
+parser = argparse.ArgumentParser(description = f"Write an HTML table of expectancy of {common.decode_shape(SHAPE)} by work.")
+common.add_css_argument(parser)
+parser.add_argument("input", nargs = "?", metavar = "EXPECTANCY.CSV")
+args = parser.parse_args()
+style_sheet = common.css_style_sheet(args.css)
+start_tag_style = common.html_start_tag_style if style_sheet is None else style_sheet.start_tag
+z_css_array = common.z_css_array if style_sheet is None else style_sheet.z_css_array
+
+common.begin_phase("load")
+C = common.CountTensor.from_table(common.load_csv(args.input if args.input is not None else sys.stdin, {"metrical_shape": str, "work": str, "sedes": float, "x": int, "z": float}))
 
 def metrical_length(shape):
-    return sum({"⏑": 0.5, "–": 1.0}[c] for c in shape)
+    return common.shape_half_morae(shape) / 2
+
+common.begin_phase("render")
+out = common.LineWriter() if style_sheet is None else common.LineWriter(io.StringIO())
 
-print("""\
+out("""\
 <html>
 <head>
 <meta charset=utf-8>
@@ -80,53 +95,54 @@ print("""\
 <body>
 """)
 
-print(common.html_start_tag_style("table", STYLE_TABLE))
-print(common.html_start_tag("tr"))
-print(
-    common.html_start_tag_style("th", STYLE_TH + STYLE_LEFT) +
+out(start_tag_style("table", STYLE_TABLE))
+out(common.html_start_tag("tr"))
+out(
+    start_tag_style("th", STYLE_TH + STYLE_LEFT) +
     html.escape("Work") +
     common.html_end_tag("th")
 )
 for sedes in common.KNOWN_SEDES:
-    print(
-        common.html_start_tag_style("th", STYLE_TH + STYLE_RIGHT) +
+    out(
+        start_tag_style("th", STYLE_TH + STYLE_RIGHT) +
         html.escape(sedes) +
         common.html_end_tag("th")
     )
-print(
-    common.html_start_tag_style("th", STYLE_TH + STYLE_RIGHT) +
+out(
+    start_tag_style("th", STYLE_TH + STYLE_RIGHT) +
     "Total&nbsp;(Σ<var>x</var>)" +
     common.html_end_tag("th")
 )
-print(common.html_end_tag("tr"))
-
-for sedes in map(float, common.KNOWN_SEDES):
-    if common.is_metrically_permissible(SHAPE, sedes):
-        M[(SHAPE, "total", sedes)] = Entry(0, 0)
-
-for work in common.KNOWN_WORKS + (common.Work("total", "TOTAL", "TOTAL", "Book"),):
-    print(common.html_start_tag("tr"))
-    print(
-        common.html_start_tag_style("td", STYLE_HEADER + STYLE_LEFT) +
+out(common.html_end_tag("tr"))
+
+WORKS = common.KNOWN_WORKS + (common.Work("total", "TOTAL", "TOTAL", "Book"),)
+
+# Counts and expectancy of SHAPE for every work and sedes, with a final row of
+# totals.
+rows = [C.work_index[work.id] for work in common.KNOWN_WORKS]
+X = C.x[rows, C.shape_index[SHAPE]]
+Z = C.expectancy()[rows, C.shape_index[SHAPE]]
+X = np.vstack((X, X.sum(axis = 0)))
+Z = np.vstack((Z, common.expectancy_array(X[-1])))
+
+for work, xvec, zvec, cssvec in zip(WORKS, X.tolist(), Z.tolist(), z_css_array(Z)):
+    out(common.html_start_tag("tr"))
+    out(
+        start_tag_style("td", STYLE_HEADER + STYLE_LEFT) +
         work.html_name +
         common.html_end_tag("td")
     )
 
-    xvec = []
-    for sedes in map(float, common.KNOWN_SEDES):
-        entry = M.get((SHAPE, work.id, sedes))
-        if entry is not None:
-            xvec.append(entry.x)
-
     recent_sedes = None
     recent_entry = None
-    for sedes in map(float, common.KNOWN_SEDES):
+    recent_css = None
+    for sedes, x, z, css in zip(C.sedes, xvec, zvec, cssvec):
         styles = []
-        entry = M.get((SHAPE, work.id, sedes))
+        entry = Entry(x, common.z_or_none(z))
         if not common.is_metrically_permissible(SHAPE, sedes):
-            assert entry is None, entry
+            assert entry.x == 0, entry
             if recent_entry is not None and sedes - recent_sedes < metrical_length(SHAPE):
-                styles.extend(common.z_css(recent_entry.z))
+                styles.extend(recent_css)
                 styles.extend(STYLE_CELL)
                 styles.append(("border-left-style", "dashed"))
                 styles.append(("border-right-style", "none"))
@@ -135,24 +151,16 @@ for work in common.KNOWN_WORKS + (common.Work("total", "TOTAL", "TOTAL", "Book")
                 styles.extend(STYLE_IMPERMISSIBLE)
                 contents = html.escape("✖\ufe0e")
         else:
-            if entry is None:
-                entry = Entry(0, common.expectancy(0, xvec))
-            try:
-                del M[(SHAPE, work.id, sedes)]
-            except KeyError:
-                pass
-            if work.id != "total":
-                M[(SHAPE, "total", sedes)] = Entry(M[(SHAPE, "total", sedes)].x + entry.x, 0)
             contents = ""
             contents += (
-                common.html_start_tag_style("span", STYLE_X) +
+                start_tag_style("span", STYLE_X) +
                 html.escape(f"{entry.x:,}") +
                 common.html_end_tag("span")
             )
             contents += common.html_start_tag("br")
             if sum(xvec) > 0:
                 contents += (
-                    common.html_start_tag_style("span", STYLE_PERCENT) +
+                    start_tag_style("span", STYLE_PERCENT) +
                     html.escape(format_percent(entry.x/sum(xvec))) +
                     common.html_end_tag("span")
                 )
@@ -161,13 +169,13 @@ for work in common.KNOWN_WORKS + (common.Work("total", "TOTAL", "TOTAL", "Book")
             contents += common.html_start_tag("br")
             if entry.z is not None:
                 contents += (
-                    common.html_start_tag_style("span", STYLE_Z) +
+                    start_tag_style("span", STYLE_Z) +
                     html.escape("{:+.02f}".format(entry.z).replace("-", "−")) +
                     common.html_end_tag("span")
                 )
             else:
                 contents += "\u200c"
-            styles.extend(common.z_css(entry.z))
+            styles.extend(css)
             styles.extend(STYLE_CELL)
             styles.extend(STYLE_RIGHT)
             try:
@@ -178,34 +186,28 @@ for work in common.KNOWN_WORKS + (common.Work("total", "TOTAL", "TOTAL", "Book")
                 pass
             recent_sedes = sedes
             recent_entry = entry
-        print(
-            common.html_start_tag_style("td", styles) +
+            recent_css = css
+        out(
+            start_tag_style("td", styles) +
             contents +
             common.html_end_tag("td")
         )
-    print(common.html_start_tag_style("td", STYLE_CELL + STYLE_RIGHT))
-    print(
-        common.html_start_tag_style("span", STYLE_X) +
+    out(start_tag_style("td", STYLE_CELL + STYLE_RIGHT))
+    out(
+        start_tag_style("span", STYLE_X) +
         html.escape('{:,}'.format(sum(xvec))) +
         common.html_end_tag("span")
     )
-    print(common.html_end_tag("td"))
-    print(common.html_end_tag("tr"))
-
-    total_xvec = []
-    for sedes in map(float, common.KNOWN_SEDES):
-        try:
-            total_xvec.append(M[(SHAPE, "total", sedes)].x)
-        except KeyError:
-            pass
-    for sedes in map(float, common.KNOWN_SEDES):
-        try:
-            M[(SHAPE, "total", sedes)] = Entry(M[(SHAPE, "total", sedes)].x, common.expectancy(M[(SHAPE, "total", sedes)].x, total_xvec))
-        except KeyError:
-            pass
-print("</table>")
-
-print("""\
+    out(common.html_end_tag("td"))
+    out(common.html_end_tag("tr"))
+
+out("</table>")
+
+out("""\
 </body>
 </html>
 """)
+
+out.close()
+if style_sheet is not None:
+    sys.stdout.write(style_sheet.insert(out.f.getvalue()))
@@ -1,124 +1,153 @@
 #!/usr/bin/env python3
 
-import collections
-import csv
+# Usage:
+#   tables.py [--css MODE] [EXPECTANCY.CSV] > TABLES.HTML
+#   tables.py [--css MODE] [-j JOBS] --output-dir DIR [EXPECTANCY.CSV]
+#
+# MODE is one of common.CSS_MODES: inline (the default), classes, or palette.
+#
+# With --output-dir, writes the table of each shape to its own page in DIR,
+# and an index page DIR/index.html linking to them. The pages are rendered in
+# parallel by worker processes forked from this one, which share the loaded
+# counts. DIR/manifest.json records a digest of the inputs of every page (its
+# counts and expectancies, the --css mode, and the code that renders it), and
+# pages whose digest has not changed since the last run are not rewritten.
+
+import argparse
+import concurrent.futures
+import hashlib
 import html
+import io
+import json
+import multiprocessing
+import os
 import sys
 
+import numpy as np
+
 import common
 
-Entry = collections.namedtuple("Entry", ("x", "z"))
-
-M = {}
-r = csv.DictReader(sys.stdin)
-for row in r:
-    key = (row["metrical_shape"], row["work"], float(row["sedes"]))
-    assert key not in M
-    M[key] = Entry(int(row["x"]), float(row["z"]) if row["z"] != "" else None)
-
-print("""\
-<html>
-<head>
-<meta charset=utf-8>
-<style>
-th, td {
-    padding: 0 0.5ex;
-    width: 5ex;
-    vertical-align: top;
-}
-th {
-    background-color: lavender;
-    font-weight: bold;
-}
-tr th:first-child, tr td:first-child {
-    background-color: lavender;
-    text-align: left;
-}
-th, tr td {
-    text-align: right;
-}
-td.impermissible {
-    color: lightgray;
-    text-align: center;
-    background-color: cornsilk;
-    font-size: inherit;
-    vertical-align: middle;
-}
-.x {
-    font-size: small;
-}
-.z {
-    font-size: x-small;
-}
-</style>
-</head>
-<body>
-""")
-
-for shape in common.shapes_gen():
-    if len(shape) > 12:
-        break
-
-    if not common.is_metrically_permissible_anywhere(shape):
-        for work in common.KNOWN_WORKS:
-            for sedes in map(float, common.KNOWN_SEDES):
-                assert M.get((shape, work.id, sedes)) is None, (shape, work.id, sedes)
-        continue
-
-    for work in common.KNOWN_WORKS:
-        for sedes in map(float, common.KNOWN_SEDES):
-            if M.get((shape, work.id, sedes)) is not None:
-                break
-        else:
-            continue
-        break
-    else:
-        continue
-
-    print(f"<h2 id=\"shape-{html.escape(shape)}\">{html.escape(' '.join(shape) if shape else '(empty shape)')}</h2>")
-
-    print("<table>")
-    print("<tr>")
-    print("<th>Work</th>")
-    for sedes in common.KNOWN_SEDES:
-        print(f"<th>{html.escape(sedes)}</th>")
-    print("<th>Total</th>")
-    print("</tr>")
-
-    print("<tr>")
-    for work in common.KNOWN_WORKS:
-        print(f"<td>{work.html_name}</td>")
-        xvec = []
-        for sedes in map(float, common.KNOWN_SEDES):
-            entry = M.get((shape, work.id, sedes))
-            if entry is not None:
-                xvec.append(entry.x)
-        for sedes in map(float, common.KNOWN_SEDES):
-            entry = M.get((shape, work.id, sedes))
-            if not common.is_metrically_permissible(shape, sedes):
-                assert entry is None, (shape, sedes, entry)
-                print("<td class=impermissible>✖</td>")
-            else:
-                if entry is None:
-                    entry = Entry(0, common.expectancy(0, xvec))
-                try:
-                    del M[(shape, work.id, sedes)]
-                except KeyError:
-                    pass
-                contents = "<span class=x>" + html.escape("{:,}".format(entry.x)) + "</span>"
-                if entry.z is not None:
-                    contents += "<br><span class=z>" + html.escape("{:+.03f}".format(entry.z).replace("-", "−")) + "</span>"
-                print(
-                    common.html_start_tag_style("td", common.z_css(entry.z)) +
-                    contents +
-                    common.html_end_tag("td")
-                )
-        print(f"<td><span class=x>{html.escape('{:,}'.format(sum(xvec)))}</span></td>")
-        print("</tr>")
-    print("</table>")
-assert len(M) == 0, M
-
-print("""\
+TAIL = """\
 </body>
 </html>
-""")
+"""
+
+def shape_page_filename(shape):
+    return "shape-" + ("".join({"–": "l", "⏑": "s"}[c] for c in common.decode_shape(shape)) or "empty") + ".html"
+
+def shape_rows(shape):
+    j = C.shape_index[shape]
+    return [(work.html_name, C.x[i, j], Z[i, j]) for work, i in zip(common.KNOWN_WORKS, rows)]
+
+def shape_page_digest(shape, code_digest):
+    h = hashlib.sha256()
+    h.update(json.dumps([code_digest, args.css, common.decode_shape(shape)]).encode())
+    for html_name, xvec, zvec in shape_rows(shape):
+        h.update(html_name.encode() + b"\0")
+        h.update(np.ascontiguousarray(xvec, dtype = np.int64).tobytes())
+        h.update(np.ascontiguousarray(zvec, dtype = np.float64).tobytes())
+    return h.hexdigest()
+
+def write_shape_page(shape):
+    """Writes the page of shape in args.output_dir."""
+    style_sheet = common.css_style_sheet(args.css)
+    f = io.StringIO()
+    out = common.LineWriter(f)
+    out(common.SHAPE_TABLES_HTML_HEAD)
+    out(common.html_start_tag("p") + common.html_start_tag("a", (("href", "index.html"),)) + "All shapes" + common.html_end_tag("a") + common.html_end_tag("p"))
+    common.shape_table_html(out, shape, shape_rows(shape), style_sheet)
+    out(TAIL)
+    out.close()
+    common.save_text(os.path.join(args.output_dir, shape_page_filename(shape)), f.getvalue() if style_sheet is None else style_sheet.insert(f.getvalue()))
+
+parser = argparse.ArgumentParser(description = "Write HTML tables of expectancy by work, for every metrical shape.")
+common.add_css_argument(parser)
+parser.add_argument("--output-dir", metavar = "DIR", help = "write a page for every shape, and an index, to DIR")
+parser.add_argument("-j", "--jobs", type = int, help = "number of worker processes for --output-dir")
+parser.add_argument("input", nargs = "?", metavar = "EXPECTANCY.CSV")
+args = parser.parse_args()
+style_sheet = common.css_style_sheet(args.css)
+
+common.begin_phase("load")
+C = common.CountTensor.from_table(common.load_csv(args.input if args.input is not None else sys.stdin, {"work": str, "metrical_shape": str, "sedes": float, "x": int, "z": float}))
+common.begin_phase("expectancy")
+Z = C.expectancy()
+
+common.begin_phase("render")
+
+# Cells of impermissible shapes, or of shapes longer than 12, are never
+# covered, and so are caught by the assertion after rendering.
+rows = [C.work_index[work.id] for work in common.KNOWN_WORKS]
+shapes = list(common.permissible_shapes_gen(12, within = C.shapes))
+for shape in shapes:
+    j = C.shape_index[shape]
+    permissible = np.nonzero(common.is_metrically_permissible_batch((shape, sedes) for sedes in C.sedes))[0]
+    C.covered[np.ix_(rows, [j], permissible)] = True
+
+if args.output_dir is None:
+    out = common.LineWriter() if style_sheet is None else common.LineWriter(io.StringIO())
+
+    out(common.SHAPE_TABLES_HTML_HEAD)
+
+    for shape in shapes:
+        common.shape_table_html(out, shape, shape_rows(shape), style_sheet)
+    assert not C.uncovered(), C.uncovered()
+
+    out(TAIL)
+
+    out.close()
+    if style_sheet is not None:
+        sys.stdout.write(style_sheet.insert(out.f.getvalue()))
+else:
+    assert not C.uncovered(), C.uncovered()
+    os.makedirs(args.output_dir, exist_ok = True)
+    manifest_filename = os.path.join(args.output_dir, "manifest.json")
+    try:
+        with open(manifest_filename) as f:
+            old_digests = json.load(f)["pages"]
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        old_digests = {}
+    code_digest = hashlib.sha256(b"".join(common.file_sha256(filename).encode() for filename in (__file__, common.__file__))).hexdigest()
+    digests = {shape_page_filename(shape): shape_page_digest(shape, code_digest) for shape in shapes}
+    stale = [
+        shape for shape in shapes
+        if old_digests.get(shape_page_filename(shape)) != digests[shape_page_filename(shape)]
+        or not os.path.exists(os.path.join(args.output_dir, shape_page_filename(shape)))
+    ]
+    if stale:
+        with concurrent.futures.ProcessPoolExecutor(max_workers = args.jobs, mp_context = multiprocessing.get_context("fork")) as executor:
+            for _ in executor.map(write_shape_page, stale, chunksize = max(1, len(stale) // (4 * (args.jobs or os.cpu_count() or 1)))):
+                pass
+    for filename in set(old_digests) - set(digests):
+        try:
+            os.remove(os.path.join(args.output_dir, filename))
+        except FileNotFoundError:
+            pass
+
+    f = io.StringIO()
+    out = common.LineWriter(f)
+    out(common.SHAPE_TABLES_HTML_HEAD)
+    out("<ul>")
+    for shape in shapes:
+        total = int(C.x[rows, C.shape_index[shape]].sum())
+        out(
+            common.html_start_tag("li") +
+            common.html_start_tag("a", (("href", shape_page_filename(shape)),)) +
+            html.escape(" ".join(common.decode_shape(shape)) or "(empty shape)") +
+            common.html_end_tag("a") +
+            html.escape(f" ({total:,})") +
+            common.html_end_tag("li")
+        )
+    out("</ul>")
+    out(TAIL)
+    out.close()
+    index_filename = os.path.join(args.output_dir, "index.html")
+    try:
+        with open(index_filename) as index_f:
+            unchanged = index_f.read() == f.getvalue()
+    except FileNotFoundError:
+        unchanged = False
+    if not unchanged:
+        common.save_text(index_filename, f.getvalue())
+    common.save_json(manifest_filename, {"pages": digests})
+    print(f"{len(stale)} of {len(shapes)} shape pages written to {args.output_dir}", file = sys.stderr)
@@ -1,7 +1,39 @@
+import io
+import itertools
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
 import unittest
 
+import numpy as np
+
 import common
 
+class TestShapeEncoding(unittest.TestCase):
+    def test_round_trip(self):
+        for text in ("", "⏑", "–", "⏑⏑", "–⏑–", "–––⏑⏑––"):
+            shape = common.encode_shape(text)
+            self.assertEqual(common.decode_shape(shape), text)
+            self.assertEqual(common.shape_length(shape), len(text))
+            self.assertEqual(common.shape_half_morae(shape), sum(common.MORAE[c] for c in text))
+
+    def test_order(self):
+        texts = ["".join(symbols) for n in range(6) for symbols in itertools.product(common.SHAPE_SYMBOLS, repeat = n)]
+        self.assertEqual(
+            sorted(map(common.encode_shape, texts)),
+            [common.encode_shape(text) for text in sorted(texts, key = lambda text: (len(text), text))],
+        )
+        self.assertEqual(list(itertools.islice(common.shapes_gen(), len(texts))), sorted(map(common.encode_shape, texts)))
+
+    def test_invalid(self):
+        for text in ("a", "b", "-+", "⏑x"):
+            with self.assertRaises(ValueError, msg = text):
+                common.encode_shape(text)
+
 class TestIsMetricallyPermissible(unittest.TestCase):
     def test_invalid_sedes(self):
         for sedes in (0, 0.5, 1.1, 13.5):
@@ -30,3 +62,543 @@ class TestIsMetricallyPermissible(unittest.TestCase):
         ):
             for sedes, expected in zip(map(float, common.KNOWN_SEDES + ("13",)), cases):
                 self.assertEqual(common.is_metrically_permissible(shape, sedes), expected, (shape, sedes))
+
+    def test_batch(self):
+        shapes = ("", "⏑", "–", "⏑⏑", "⏑–⏑", "–––⏑⏑––")
+        pairs = [(shape, sedes) for shape in shapes for sedes in map(float, common.KNOWN_SEDES + ("13",))]
+        self.assertEqual(
+            common.is_metrically_permissible_batch(pairs),
+            [common.is_metrically_permissible(shape, sedes) for shape, sedes in pairs],
+        )
+        with self.assertRaises(ValueError):
+            common.is_metrically_permissible_batch([("", 1.0), ("", 13.5)])
+
+    def test_permissible_sedes(self):
+        for shape in ("", "⏑", "–", "⏑⏑", "⏑–⏑", "–⏑–", "–––⏑⏑–⏑"):
+            self.assertEqual(
+                common.metrically_permissible_sedes(shape),
+                tuple(sedes for sedes in common.KNOWN_SEDES if common.is_metrically_permissible(shape, float(sedes))),
+                shape,
+            )
+            self.assertEqual(
+                common.is_metrically_permissible_anywhere(shape),
+                len(common.metrically_permissible_sedes(shape)) > 0,
+                shape,
+            )
+
+    def test_packed(self):
+        for shape in ("", "⏑", "–", "⏑⏑", "⏑–⏑", "–⏑–", "–––⏑⏑–⏑"):
+            packed = common.encode_shape(shape)
+            self.assertEqual(common.metrically_permissible_sedes(packed), common.metrically_permissible_sedes(shape), shape)
+            for sedes in map(float, common.KNOWN_SEDES):
+                self.assertEqual(common.is_metrically_permissible(packed, sedes), common.is_metrically_permissible(shape, sedes), (shape, sedes))
+
+class TestPermissibleShapesGen(unittest.TestCase):
+    def test_order(self):
+        expected = []
+        for shape in common.shapes_gen():
+            if common.shape_length(shape) > 10:
+                break
+            if common.is_metrically_permissible_anywhere(shape):
+                expected.append(shape)
+        self.assertEqual(list(common.permissible_shapes_gen(10)), expected)
+
+    def test_terminates(self):
+        shapes = list(common.permissible_shapes_gen())
+        self.assertTrue(all(common.is_metrically_permissible_anywhere(shape) for shape in shapes))
+        self.assertIn(common.encode_shape("–"*12), shapes)
+        self.assertNotIn(common.encode_shape("–"*13), shapes)
+
+    def test_within(self):
+        within = ("⏑–⏑", "–", "–⏑–", "––––", "⏑⏑", "x")
+        self.assertEqual(list(common.permissible_shapes_gen(within = within)), ["–", "⏑⏑", "⏑–⏑", "––––"])
+        self.assertEqual(list(common.permissible_shapes_gen(3, within = within)), ["–", "⏑⏑", "⏑–⏑"])
+
+    def test_within_packed(self):
+        within = [common.encode_shape(shape) for shape in ("⏑–⏑", "–", "–⏑–", "––––", "⏑⏑")]
+        self.assertEqual([common.decode_shape(shape) for shape in common.permissible_shapes_gen(within = within)], ["–", "⏑⏑", "⏑–⏑", "––––"])
+        self.assertEqual([common.decode_shape(shape) for shape in common.permissible_shapes_gen(3, within = within)], ["–", "⏑⏑", "⏑–⏑"])
+
+class TestExpectancy(unittest.TestCase):
+    def test_expectancies(self):
+        for xvec in ([], [0, 0], [5], [3, 3, 3], [1, 2, 3], [14, 1734, 0, 27]):
+            self.assertEqual(common.expectancies(xvec), [common.expectancy(x, xvec) for x in xvec], xvec)
+
+    def test_expectancy_array(self):
+        X = [
+            [[0, 0, 0], [5, 0, 0], [3, 3, 3]],
+            [[1, 2, 3], [14, 1734, 27], [0, 7, 1]],
+        ]
+        Z = common.expectancy_array(X)
+        self.assertEqual(Z.shape, (2, 3, 3))
+        for xrow, zrow in zip((xvec for m in X for xvec in m), (zvec for m in Z for zvec in m)):
+            self.assertEqual([common.z_or_none(z) for z in zrow], [common.expectancy(x, xrow) for x in xrow], xrow)
+
+    def test_parse_by(self):
+        self.assertEqual(common.parse_by("sedes/work,metrical_shape"), ("work", "metrical_shape"))
+        self.assertEqual(common.parse_by("sedes/metrical_shape"), ("metrical_shape",))
+        for by in ("sedes", "work/metrical_shape"):
+            with self.assertRaises(ValueError, msg = by):
+                common.parse_by(by)
+
+    def test_expectancy_rows(self):
+        counts = {("⏑⏑", 10.0): 1, ("–", 2.0): 3, ("⏑⏑", 2.0): 1, ("–", 1.5): 1, ("–", 12.0): 2}
+        rows = list(common.expectancy_rows(counts))
+        self.assertEqual([row[:3] for row in rows], [("–", 1.5, 1), ("–", 2.0, 3), ("–", 12.0, 2), ("⏑⏑", 2.0, 1), ("⏑⏑", 10.0, 1)])
+        self.assertEqual([row[3] for row in rows[:3]], common.expectancies([1, 3, 2]))
+        self.assertEqual([row[3] for row in rows[3:]], [None, None])
+        self.assertEqual(common.format_z(None), "")
+        self.assertEqual(common.format_z(0.722698509237399), "+0.722698509237399")
+        self.assertEqual(common.format_z(-1.72287841586418), "-1.72287841586418")
+
+    def test_update_expectancy_rows(self):
+        def index(counts):
+            return {(*key, sedes): (str(x), common.format_z(z)) for *key, sedes, x, z in common.expectancy_rows(counts)}
+        old = {("⏑⏑", 10.0): 1, ("–", 2.0): 3, ("⏑⏑", 2.0): 1, ("–", 1.5): 1, ("–", 12.0): 2}
+        new = {("⏑⏑", 10.0): 1, ("–", 2.0): 1, ("⏑⏑", 2.0): 1, ("–", 12.0): 2, ("–", 5.0): 4}
+        delta = {("–", 2.0): -2, ("–", 1.5): -1, ("–", 5.0): 4, ("⏑⏑", 10.0): 0}
+        rows = list(common.update_expectancy_rows(index(old), delta))
+        self.assertEqual(rows, [k + v for k, v in index(new).items()])
+        # Unaffected keys keep the strings of the old index.
+        stale = index(old)
+        stale[("⏑⏑", 2.0)] = ("1", "stale")
+        self.assertIn(("⏑⏑", 2.0, "1", "stale"), list(common.update_expectancy_rows(stale, delta)))
+        with self.assertRaises(ValueError):
+            list(common.update_expectancy_rows(index(old), {("–", 1.5): -2}))
+
+    def test_load_sedes_counts(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "corpus.csv")
+            cache_dir = os.path.join(tmp, "cache")
+            with open(filename, "w") as f:
+                f.write("work,metrical_shape,sedes\nIl.,–,1\nIl.,–,1\nIl.,⏑⏑,5.5\nIl.,–,\n")
+            sha256, counts = common.load_sedes_counts(filename, ("metrical_shape",), cache_dir)
+            self.assertEqual(counts, {("–", 1.0): 2, ("⏑⏑", 5.5): 1})
+            with open(filename, "w") as f:
+                f.write("work,metrical_shape,sedes\nIl.,–,1\n")
+            new_sha256, new_counts = common.load_sedes_counts(filename, ("metrical_shape",), cache_dir)
+            self.assertNotEqual(new_sha256, sha256)
+            self.assertEqual(new_counts, {("–", 1.0): 1})
+            self.assertEqual(common.stored_sedes_counts(sha256, ("metrical_shape",), cache_dir), counts)
+            self.assertIsNone(common.stored_sedes_counts(sha256, ("work", "metrical_shape"), cache_dir))
+
+class TestLoadCSV(unittest.TestCase):
+    DTYPES = {"work": str, "sedes": float, "x": int, "z": float}
+
+    def write(self, filename, text):
+        with open(filename, "w") as f:
+            f.write(text)
+
+    def check(self, table, works, sedes, x, z):
+        self.assertEqual(len(table), len(works))
+        self.assertEqual(table.strings("work"), works)
+        self.assertEqual(table["sedes"].tolist(), sedes)
+        self.assertEqual(table["x"].tolist(), x)
+        self.assertEqual([common.z_or_none(v) for v in table["z"]], z)
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "e.csv")
+            cache_dir = os.path.join(tmp, "cache")
+            self.write(filename, "work,metrical_shape,sedes,x,z\nIl.,–,1,5,+1.5\nOd.,,2.5,7,\nIl.,⏑,12,1,-0.25\n")
+            expected = (["Il.", "Od.", "Il."], [1.0, 2.5, 12.0], [5, 7, 1], [1.5, None, -0.25])
+            with open(filename) as f:
+                self.check(common.load_csv(f, self.DTYPES), *expected)
+            self.check(common.load_csv(filename, self.DTYPES, cache_dir = cache_dir), *expected)
+            # Loaded from the cache.
+            self.check(common.load_csv(filename, self.DTYPES, cache_dir = cache_dir), *expected)
+            self.assertEqual(common.load_csv(filename, {"work": str}, cache_dir = cache_dir).strings("work"), expected[0])
+
+            # Touched but unchanged.
+            os.utime(filename, ns = (0, 0))
+            self.check(common.load_csv(filename, self.DTYPES, cache_dir = cache_dir), *expected)
+
+            # Changed, even with the same size and modification time.
+            st = os.stat(filename)
+            self.write(filename, "work,metrical_shape,sedes,x,z\nIl.,–,1,5,+1.5\nOd.,,2.5,8,\nIl.,⏑,12,1,-0.25\n")
+            os.utime(filename, ns = (st.st_atime_ns, st.st_mtime_ns))
+            self.check(common.load_csv(filename, self.DTYPES, cache_dir = cache_dir), expected[0], expected[1], [5, 8, 1], expected[3])
+
+    def test_prune(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "e.csv")
+            copy_filename = os.path.join(tmp, "copy.csv")
+            cache_dir = os.path.join(tmp, "cache")
+            for name in (filename, copy_filename):
+                self.write(name, "work,metrical_shape,sedes,x,z\nIl.,–,1,5,+1.5\n")
+                common.load_csv(name, self.DTYPES, cache_dir = cache_dir)
+            entries = os.listdir(os.path.join(cache_dir, "columns"))
+            self.assertEqual(len(entries), 1)
+            # Its old contents are still those of copy.csv.
+            self.write(filename, "work,metrical_shape,sedes,x,z\nIl.,–,1,6,+1.5\n")
+            common.load_csv(filename, self.DTYPES, cache_dir = cache_dir)
+            self.assertEqual(len(os.listdir(os.path.join(cache_dir, "columns"))), 2)
+            self.write(copy_filename, "work,metrical_shape,sedes,x,z\nIl.,–,1,7,+1.5\n")
+            common.load_csv(copy_filename, self.DTYPES, cache_dir = cache_dir)
+            self.assertEqual(len(os.listdir(os.path.join(cache_dir, "columns"))), 2)
+            self.assertNotIn(entries[0], os.listdir(os.path.join(cache_dir, "columns")))
+            self.check(common.load_csv(copy_filename, self.DTYPES, cache_dir = cache_dir), ["Il."], [1.0], [7], [1.5])
+
+    def test_changed_while_caching(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "e.csv")
+            cache_dir = os.path.join(tmp, "cache")
+            self.write(filename, "work,metrical_shape,sedes,x,z\nIl.,–,1,5,+1.5\nOd.,,2.5,7,\nIl.,⏑,12,1,-0.25\n")
+            chunks = common.iter_csv_chunks(filename, self.DTYPES, 2, cache_dir = cache_dir)
+            next(chunks)
+            # Another process sees the file change while this one is still
+            # caching the old contents.
+            self.write(filename, "work,metrical_shape,sedes,x,z\nIl.,–,1,5,+1.5\n")
+            self.check(common.load_csv(filename, self.DTYPES, cache_dir = cache_dir), ["Il."], [1.0], [5], [1.5])
+            self.assertEqual(len(list(chunks)), 1)
+
+    def test_concurrent(self):
+        # Processes that cache a file at the same time, even as it changes
+        # under them, must not remove each other's cache files.
+        script = """
+import os, sys, time
+import common
+filename, cache_dir, start_filename = sys.argv[1:]
+while not os.path.exists(start_filename):
+    time.sleep(0.001)
+for _ in range(3):
+    table = common.load_csv(filename, {"work": str, "line_n": str, "z": float}, cache_dir = cache_dir)
+    assert len(table) > 0
+    for chunk in common.iter_csv_chunks(filename, {"word_n": int}, 1000, cache_dir = cache_dir):
+        pass
+    assert len(common.LineIndex.load(filename, cache_dir = cache_dir)) > 0
+"""
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "joined.csv")
+            cache_dir = os.path.join(tmp, "cache")
+            for version in range(3):
+                self.write(filename, "work,book_n,line_n,word_n,line_text,z\n" + "".join(f"A,1,{i // 5},{i % 5},t,{version - i % 3}\n" for i in range(20000)))
+                start_filename = os.path.join(tmp, f"start.{version}")
+                processes = [
+                    subprocess.Popen([sys.executable, "-c", script, filename, cache_dir, start_filename], cwd = os.path.dirname(os.path.abspath(common.__file__)), stderr = subprocess.PIPE)
+                    for _ in range(4)
+                ]
+                # Start them all at once.
+                time.sleep(0.5)
+                self.write(start_filename, "")
+                for process in processes:
+                    _, stderr = process.communicate()
+                    self.assertEqual(process.returncode, 0, stderr.decode())
+                self.assertEqual(common.load_csv(filename, {"z": float}, cache_dir = cache_dir)["z"][:3].tolist(), [version, version - 1, version - 2])
+
+    def test_empty(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "e.csv")
+            self.write(filename, "work,metrical_shape,sedes,x,z\n")
+            for _ in range(2):
+                self.check(common.load_csv(filename, self.DTYPES, cache_dir = os.path.join(tmp, "cache")), [], [], [], [])
+
+    def check_chunks(self, chunks, works, sedes, x, z):
+        self.assertEqual([len(table) for table in chunks], [2, 2, 1])
+        self.check(common.Table({
+            "work": common.Categorical(np.concatenate([table["work"].codes for table in chunks]), chunks[-1]["work"].categories),
+            **{name: np.concatenate([table[name] for table in chunks]) for name in ("sedes", "x", "z")},
+        }), works, sedes, x, z)
+
+    def test_chunks(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "e.csv")
+            cache_dir = os.path.join(tmp, "cache")
+            self.write(filename, "work,metrical_shape,sedes,x,z\nIl.,–,1,5,+1.5\nOd.,,2.5,7,\nIl.,⏑,12,1,-0.25\nHes.,–,1,2,0\nOd.,–,1,3,-2\n")
+            expected = (["Il.", "Od.", "Il.", "Hes.", "Od."], [1.0, 2.5, 12.0, 1.0, 1.0], [5, 7, 1, 2, 3], [1.5, None, -0.25, 0.0, -2.0])
+            with open(filename) as f:
+                self.check_chunks(list(common.iter_csv_chunks(f, self.DTYPES, 2)), *expected)
+            # Nothing is cached until all the chunks have been consumed.
+            next(common.iter_csv_chunks(filename, self.DTYPES, 2, cache_dir = cache_dir))
+            self.assertFalse(any(name.endswith(".npy") for _, _, names in os.walk(cache_dir) for name in names))
+            self.check_chunks(list(common.iter_csv_chunks(filename, self.DTYPES, 2, cache_dir = cache_dir)), *expected)
+            # Memory-mapped from the cache.
+            chunks = list(common.iter_csv_chunks(filename, self.DTYPES, 2, cache_dir = cache_dir))
+            self.assertIsInstance(chunks[0]["x"].base, np.memmap)
+            self.check_chunks(chunks, *expected)
+            self.check(common.load_csv(filename, self.DTYPES, cache_dir = cache_dir), *expected)
+            # Sliced from the columns already loaded.
+            self.check_chunks(list(common.iter_csv_chunks(filename, self.DTYPES, 2, cache_dir = cache_dir)), *expected)
+
+class TestCountTensor(unittest.TestCase):
+    def make(self, text):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "e.csv")
+            with open(filename, "w") as f:
+                f.write(text)
+            with open(filename) as f:
+                return common.CountTensor.from_table(common.load_csv(f, {"work": str, "metrical_shape": str, "sedes": float, "x": int, "z": float}))
+
+    def test(self):
+        C = self.make("work,metrical_shape,sedes,x,z\nOd.,⏑⏑,2,3,+1\nIl.,–,1,5,\nOther,–,12,2,-1\nOd.,⏑⏑,4,1,-1\n")
+        self.assertEqual(C.works, tuple(work.id for work in common.KNOWN_WORKS) + ("Other",))
+        self.assertEqual(C.shapes, (common.encode_shape("–"), common.encode_shape("⏑⏑")))
+        self.assertEqual(C.x.shape, (len(C.works), 2, len(common.KNOWN_SEDES)))
+        self.assertEqual(C.x[C.work_index["Od."], C.shape_index[common.encode_shape("⏑⏑")], C.sedes_index[2.0]], 3)
+        self.assertEqual(C.sum_works(["Il.", "Other"])[C.shape_index[common.encode_shape("–")]].tolist(), [5] + [0] * 15 + [2])
+        self.assertEqual(C.present.sum(), 4)
+
+        Z = C.expectancy()
+        i, j = C.work_index["Od."], C.shape_index[common.encode_shape("⏑⏑")]
+        self.assertEqual(Z[i, j, C.sedes_index[2.0]], 1.0)
+        self.assertEqual(common.z_or_none(Z[i, j, C.sedes_index[1.0]]), common.expectancy(0, [3, 1]))
+        self.assertTrue(np.isnan(Z[C.work_index["Il."], C.shape_index[common.encode_shape("–")], C.sedes_index[1.0]]))
+
+        self.assertEqual(len(C.uncovered()), 4)
+        C.covered[i, j] = True
+        self.assertEqual(sorted(C.uncovered()), [("Il.", common.encode_shape("–"), 1.0), ("Other", common.encode_shape("–"), 12.0)])
+
+    def test_leave_one_out(self):
+        C = self.make("work,metrical_shape,sedes,x,z\nIl.,–,1,5,\nOd.,–,1,2,\nOd.,–,12,4,\nOther,⏑⏑,2,1,\n")
+        X, Z = C.leave_one_out()
+        j = C.shape_index[common.encode_shape("–")]
+        self.assertEqual(X[C.work_index["Il."], j].tolist(), [2] + [0] * 15 + [4])
+        self.assertEqual(X[C.work_index["Od."], j].tolist(), [5] + [0] * 16)
+        self.assertEqual(X[C.work_index["Other"], j].tolist(), [7] + [0] * 15 + [4])
+        self.assertEqual(common.z_or_none(Z[C.work_index["Il."], j, 0]), common.expectancy(2, [2] + [0] * 15 + [4]))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            self.make("work,metrical_shape,sedes,x,z\nIl.,–,1,5,\nIl.,–,1,5,\n")
+        with self.assertRaises(ValueError):
+            self.make("work,metrical_shape,sedes,x,z\nIl.,–,13,5,\n")
+        with self.assertRaises(ValueError):
+            self.make("work,metrical_shape,sedes,x,z\nIl.,–x,1,5,\n")
+
+class TestHTML(unittest.TestCase):
+    def test_html_start_tag_style(self):
+        style = [("color", "a;b"), ("font-size", "8pt")]
+        expected = "<td class=\"x\" style=\"color: a\\3b b; font-size: 8pt;\">"
+        self.assertEqual(common.html_start_tag_style("td", style, [("class", "x")]), expected)
+        self.assertEqual(common.html_start_tag_style("td", tuple(style), (("class", "x"),)), expected)
+        self.assertEqual(common.html_start_tag_style("td"), "<td style=\"\">")
+
+    def test_line_writer(self):
+        f = io.StringIO()
+        out = common.LineWriter(f, buffer_size = 8)
+        out("<tr>")
+        self.assertEqual(f.getvalue(), "")
+        out("<td></td>")
+        self.assertEqual(f.getvalue(), "<tr>\n<td></td>\n")
+        out("")
+        out.close()
+        self.assertEqual(f.getvalue(), "<tr>\n<td></td>\n\n")
+
+class TestZCSS(unittest.TestCase):
+    @staticmethod
+    def direct(z):
+        return common.srgb_css(common.z_srgb(0.0 if z is None else z))
+
+    def check_breakpoints(self):
+        breakpoints, _, _ = common.get_z_css_table()
+        for b in breakpoints:
+            for z in (math.nextafter(b, -math.inf), b):
+                self.assertEqual(common.z_css(z), self.direct(z), z)
+
+    def test_z_css(self):
+        for z in (None, 0.0, -0.0, 1.0, -2.5, 63.9, 64.0, 100.0, -100.0, math.inf, -math.inf):
+            self.assertEqual(common.z_css(z), self.direct(z), z)
+        self.check_breakpoints()
+
+    def test_rebuild(self):
+        saved = common.COLOR_HIGH, common.LUMINANCE_INVERSION_THRESHOLD
+        try:
+            common.COLOR_HIGH = (0x10, 0x80, 0xff)
+            common.LUMINANCE_INVERSION_THRESHOLD = 0.5
+            self.check_breakpoints()
+        finally:
+            common.COLOR_HIGH, common.LUMINANCE_INVERSION_THRESHOLD = saved
+        self.check_breakpoints()
+
+    def test_z_css_array(self):
+        z = np.array([[0.5, math.nan], [-3.0, 200.0]])
+        result = common.z_css_array(z)
+        self.assertEqual(result.shape, z.shape)
+        self.assertEqual(result.tolist(), [
+            [self.direct(0.5), self.direct(None)],
+            [self.direct(-3.0), self.direct(200.0)],
+        ])
+
+class TestStyleSheet(unittest.TestCase):
+    def test_start_tag(self):
+        styles = common.StyleSheet()
+        self.assertEqual(styles.start_tag("td", (("color", "red"), ("padding", "1pt"))), "<td class=s0>")
+        self.assertEqual(styles.start_tag("th", [("color", "red"), ("padding", "1pt")], (("id", "a"),)), "<th id=\"a\" class=s0>")
+        self.assertEqual(styles.start_tag("td", (("padding", "1pt"), ("color", "red"))), "<td class=s1>")
+        self.assertEqual(styles.css(), ".s0 { color: red; padding: 1pt; }\n.s1 { padding: 1pt; color: red; }\n")
+        styles.add_rules("td { color: blue; }\n")
+        styles.add_rules("td { color: blue; }\n")
+        self.assertEqual(styles.css(), "td { color: blue; }\n.s0 { color: red; padding: 1pt; }\n.s1 { padding: 1pt; color: red; }\n")
+        self.assertEqual(
+            styles.insert("<html>\n<head>\n</head>\n<body>\n</body>\n</html>\n"),
+            "<html>\n<head>\n<style>\n" + styles.css() + "</style>\n</head>\n<body>\n</body>\n</html>\n",
+        )
+
+    def test_palette(self):
+        z = np.array([-100.0, -1.0, math.nan, 0.0, 1.0, 100.0])
+        styles = common.StyleSheet(palette = True).z_css_array(z)
+        self.assertEqual(styles.tolist(), common.z_palette_css_array(z).tolist())
+        palette = common.get_z_palette_styles().tolist()
+        self.assertEqual(styles[0], palette[0])
+        self.assertEqual(styles[-1], palette[-1])
+        self.assertEqual(styles[2], styles[3])
+        self.assertEqual(len(set(palette)), common.PALETTE_SIZE)
+        self.assertEqual(common.StyleSheet().z_css_array(z).tolist(), common.z_css_array(z).tolist())
+
+class TestWindowCounts(unittest.TestCase):
+    def setUp(self):
+        work = common.Categorical(np.array([0, 0, 1, 0, 1, 0, 0]), np.array(["a", "b"]))
+        flags = np.array([1, 0, 1, 1, 1, 0, 1], dtype = bool)
+        self.W = common.WindowCounts.from_flags([work], flags)
+
+    def test_groups(self):
+        self.assertEqual(self.W.groups, [("a",), ("b",)])
+        self.assertEqual(self.W.order.tolist(), [0, 1, 3, 5, 6, 2, 4])
+        self.assertEqual(self.W.offsets.tolist(), [0, 5, 7])
+
+    def test_windows(self):
+        # Group a is flagged 1, 0, 1, 0, 1; group b is 1, 1.
+        self.assertEqual(self.W.windows(1).tolist(), [1, 0, 1, 0, 1, 1, 1])
+        self.assertEqual(self.W.windows(2).tolist(), [1, 1, 1, 1, -1, 2, -1])
+        self.assertEqual(self.W.windows(3, "center").tolist(), [-1, 2, 1, 2, -1, -1, -1])
+        self.assertEqual(self.W.windows(4, "center").tolist(), [-1, 2, 2, -1, -1, -1, -1])
+        self.assertEqual(self.W.windows(6).tolist(), [-1] * 7)
+        with self.assertRaises(ValueError):
+            self.W.windows(2, "right")
+
+    def test_histogram(self):
+        self.assertEqual(self.W.histogram(2).tolist(), [[0, 4, 0], [0, 0, 1]])
+
+class TestLineIndex(unittest.TestCase):
+    CORPUS = (
+        "work,book_n,line_n,word_n,word,line_text\n"
+        "A,1,1,1,a,\"a b, c\"\n"
+        "A,1,1,2,b,\"a b, c\"\n"
+        "A,1,2,1,d,\"d\ne\"\n"
+        "A,1,1,1,f,f\n"
+        "A,1,1,1,g,g\n"
+        "A,2,1,1,h,h\n"
+    )
+
+    def test_line_index(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "corpus.csv")
+            with open(filename, "w", newline = "") as f:
+                f.write(self.CORPUS)
+            for cache_dir in ("", os.path.join(tmp, "cache"), os.path.join(tmp, "cache")):
+                index = common.LineIndex.load(filename, cache_dir = cache_dir)
+                self.assertEqual(len(index), 5)
+                # A line 1 that does not follow its own word 1 is a new line.
+                self.assertEqual(index.find("A", "1", "1"), [0, 2, 3])
+                self.assertEqual(index.find("A", "2", "1"), [4])
+                self.assertEqual(index.find("A", "3", "1"), [])
+                self.assertEqual(bytes(index.line_bytes(1)), "A,1,2,1,d,\"d\ne\"\n".encode())
+                self.assertEqual(index.line_rows(0), [["A", "1", "1", "1", "a", "a b, c"], ["A", "1", "1", "2", "b", "a b, c"]])
+                self.assertEqual(index.line_text(1), "d\ne")
+                self.assertEqual(list(index.context(1, 1)), [0, 1, 2])
+                self.assertEqual(list(index.context(3, 5)), [0, 1, 2, 3])
+                self.assertEqual(list(index.context(4, 1)), [4])
+            self.assertIsInstance(index.keys, np.memmap)
+
+    def test_verse_lines(self):
+        corpus = self.CORPUS + "A,2,1,2,\"i\"\"\n,\",\"h \"\"i\"\"\n\"\nB,1,1,1,j,j\n"
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, "corpus.csv")
+            with open(filename, "w", newline = "") as f:
+                f.write(corpus)
+            index = common.LineIndex.load(filename, cache_dir = "")
+            expected = [index.line_rows(i) for i in range(len(index))]
+            self.assertEqual(len(expected), 6)
+            self.assertEqual(len(expected[4]), 2)
+            for n in range(1, len(corpus.encode()) + 2):
+                header, boundaries = common.csv_row_boundaries(filename, n)
+                self.assertEqual(header, ["work", "book_n", "line_n", "word_n", "word", "line_text"])
+                self.assertEqual(len(boundaries), n + 1)
+                lines = [rows for start, stop in zip(boundaries, boundaries[1:]) for rows in common.iter_verse_lines(filename, start, stop)]
+                self.assertEqual(lines, expected, n)
+
+class TestResampling(unittest.TestCase):
+    def test_bootstrap_rate_intervals(self):
+        intervals = common.bootstrap_rate_intervals([0, 50, 10], [100, 100, 10], 2000, np.random.default_rng(0))
+        self.assertEqual(intervals[0].tolist(), [0.0, 0.0])
+        self.assertEqual(intervals[2].tolist(), [1.0, 1.0])
+        # The normal approximation is 0.5 ± 0.098.
+        self.assertAlmostEqual(intervals[1][0], 0.4, delta = 0.02)
+        self.assertAlmostEqual(intervals[1][1], 0.6, delta = 0.02)
+
+    def test_permutation_spread_p(self):
+        rng = np.random.default_rng(0)
+        self.assertIsNone(common.permutation_spread_p([1], [10], 100, rng))
+        self.assertEqual(common.permutation_spread_p([5, 5], [10, 10], 100, rng), 1.0)
+        self.assertLess(common.permutation_spread_p([0, 50], [100, 100], 1000, rng), 0.01)
+
+    def test_resample_books(self):
+        args = ([3, 0, 7], [40, 30, 50], [[0, 1, 2], [0, 2]], 500, np.random.SeedSequence(1, spawn_key = (0, 2)))
+        books, subsets, p = common.resample_books(*args)
+        self.assertEqual(books.shape, (3, 2))
+        self.assertEqual(subsets.shape, (2, 2))
+        self.assertTrue(subsets[0][0] <= 10 / 120 <= subsets[0][1])
+        self.assertTrue(0 < p <= 1)
+        # The same seed gives the same results.
+        again = common.resample_books(*args)
+        self.assertEqual(books.tolist(), again[0].tolist())
+        self.assertEqual(p, again[2])
+
+class TestShapeTableHTML(unittest.TestCase):
+    def test_shape_table_html(self):
+        xvec = np.zeros(len(common.KNOWN_SEDES), dtype = np.int64)
+        xvec[common.KNOWN_SEDES.index("1")] = 3
+        xvec[common.KNOWN_SEDES.index("3")] = 1
+        lines = []
+        common.shape_table_html(lines.append, "–⏑⏑", [("A", xvec, common.expectancy_array(xvec))])
+        self.assertEqual(lines[0], "<h2 id=\"shape-–⏑⏑\">–\u202f⏑\u202f⏑</h2>")
+        cells = [line for line in lines if line.startswith("<td")]
+        self.assertEqual(len(cells), 1 + len(common.KNOWN_SEDES) + 1)
+        for sedes, cell in zip(common.KNOWN_SEDES, cells[1:]):
+            self.assertEqual(cell == "<td class=impermissible>✖</td>", not common.is_metrically_permissible("–⏑⏑", float(sedes)), sedes)
+        self.assertIn("<span class=x>3</span><br><span class=z>+", cells[1])
+        self.assertEqual(cells[-1], "<td><span class=x>4</span></td>")
+
+    def test_style_sheet(self):
+        xvec = np.zeros(len(common.KNOWN_SEDES), dtype = np.int64)
+        xvec[common.KNOWN_SEDES.index("1")] = 3
+        xvec[common.KNOWN_SEDES.index("3")] = 1
+        lines = []
+        style_sheet = common.StyleSheet()
+        common.shape_table_html(lines.append, "–⏑⏑", [("<i>A</i>", xvec, common.expectancy_array(xvec))], style_sheet)
+        rows = [line for line in lines if line.startswith("<tr><td>")]
+        self.assertEqual(len(rows), 1)
+        cells = rows[0].split("<td")[1:]
+        self.assertEqual(cells[0], "><i>A</i>")
+        for sedes, cell in zip(common.KNOWN_SEDES, cells[1:]):
+            self.assertEqual(cell == ">", not common.is_metrically_permissible("–⏑⏑", float(sedes)), sedes)
+        self.assertRegex(cells[1], r"^ class=s0><b>3</b><br><i>\+[0-9.]+</i>$")
+        self.assertEqual(cells[-1], "><b>4</b>")
+        self.assertTrue(style_sheet.css().startswith(common.SHAPE_TABLE_CLASSES_CSS))
+
+class TestInstrumentation(unittest.TestCase):
+    def test_disabled(self):
+        if common.INSTRUMENTATION is None:
+            self.assertFalse(hasattr(common.z_css, "__wrapped__"))
+        common.begin_phase("test")
+
+    def test_enabled(self):
+        script = "\n".join((
+            "import common",
+            "common.begin_phase('one')",
+            "common.z_css(1.0); common.z_css(None)",
+            "common.begin_phase('two')",
+            "common.is_metrically_permissible('–', 1.0)",
+        ))
+        p = subprocess.run(
+            [sys.executable, "-c", script],
+            cwd = os.path.dirname(os.path.abspath(common.__file__)),
+            env = dict(os.environ, EPIC_RHYTHM_PROFILE = "1"),
+            capture_output = True, text = True, check = True,
+        )
+        summary = json.loads(p.stderr)
+        self.assertEqual(set(summary["phases"]), {"one", "two"})
+        self.assertEqual(summary["functions"]["z_css"]["calls"], 2)
+        self.assertEqual(summary["functions"]["is_metrically_permissible"]["calls"], 1)
+        self.assertNotIn("html_start_tag_style", summary["functions"])
+        self.assertGreater(summary["peak_rss_bytes"], 0)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+# Usage:
+#   unexpected-lines.py [--threshold Z] [--min-unexpected N] [-j JOBS] JOINED.CSV > LINES.CSV
+#
+# Summarizes the joined corpus CSV file JOINED.CSV by verse line. Writes a CSV
+# file with a row for each line, in file order, giving the number of words in
+# the line, how many of them are unexpected (z <= Z), how many have an
+# expectancy at all, the minimum and the sum of their z, the metrical shapes of
+# the words separated by "|", and the text of the line. With --min-unexpected,
+# only lines with at least N unexpected words are written.
+#
+# Lines are those of common.LineIndex: a new line starts wherever work, book_n,
+# or line_n changes, or word_n does not increase, like unique_line_n in
+# unexpected.r. The file is divided into ranges of rows of about equal size,
+# which are summarized in parallel by worker processes. Each worker parses its
+# range once, keeping only the current line in memory, and writes its rows to a
+# temporary file, so memory use does not grow with the size of the file.
+
+import argparse
+import concurrent.futures
+import csv
+import math
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+
+import common
+
+Z_THRESHOLD = -2.0
+
+FIELDS = ("work", "book_n", "line_n", "words", "unexpected", "scored", "min_z", "sum_z", "metrical_shapes", "line_text")
+
+# Number of ranges of the input for each worker process.
+RANGES_PER_JOB = 4
+
+def summarize_range(filename, header, start, stop, threshold, min_unexpected, part_filename):
+    """Writes the rows of the lines that common.iter_verse_lines yields for
+    start and stop of filename to part_filename."""
+    work_i, book_n_i, line_n_i, shape_i, z_i, line_text_i = (header.index(name) for name in ("work", "book_n", "line_n", "metrical_shape", "z", "line_text"))
+    with open(part_filename, "w", newline = "") as f:
+        w = csv.writer(f, lineterminator = "\n")
+        for rows in common.iter_verse_lines(filename, start, stop):
+            zs = [float(row[z_i]) for row in rows if row[z_i] != ""]
+            unexpected = sum(z <= threshold for z in zs)
+            if unexpected < min_unexpected:
+                continue
+            first = rows[0]
+            w.writerow((
+                first[work_i],
+                first[book_n_i],
+                first[line_n_i],
+                len(rows),
+                unexpected,
+                len(zs),
+                common.format_z(min(zs) if zs else None),
+                common.format_z(math.fsum(zs) if zs else None),
+                "|".join(row[shape_i] for row in rows),
+                first[line_text_i],
+            ))
+
+parser = argparse.ArgumentParser(description = "Summarize expectancy and unexpected metrical shapes by verse line.")
+parser.add_argument("--threshold", type = float, default = Z_THRESHOLD, metavar = "Z", help = f"z at or below which a shape is unexpected (default {Z_THRESHOLD:+})")
+parser.add_argument("--min-unexpected", type = int, default = 0, metavar = "N", help = "write only lines with at least N unexpected shapes (default 0)")
+parser.add_argument("-j", "--jobs", type = int, help = "number of worker processes")
+parser.add_argument("input", metavar = "JOINED.CSV")
+args = parser.parse_args()
+
+common.begin_phase("split")
+header, boundaries = common.csv_row_boundaries(args.input, RANGES_PER_JOB * (args.jobs or os.cpu_count() or 1))
+
+common.begin_phase("summarize")
+with tempfile.TemporaryDirectory() as tmp:
+    with concurrent.futures.ProcessPoolExecutor(max_workers = args.jobs, mp_context = multiprocessing.get_context("fork")) as executor:
+        part_filenames = [os.path.join(tmp, f"{k}.csv") for k in range(len(boundaries) - 1)]
+        futures = [
+            executor.submit(summarize_range, args.input, header, start, stop, args.threshold, args.min_unexpected, part_filename)
+            for start, stop, part_filename in zip(boundaries, boundaries[1:], part_filenames)
+        ]
+        for future in futures:
+            future.result()
+    csv.writer(sys.stdout, lineterminator = "\n").writerow(FIELDS)
+    sys.stdout.flush()
+    for part_filename in part_filenames:
+        with open(part_filename, newline = "") as f:
+            shutil.copyfileobj(f, sys.stdout)
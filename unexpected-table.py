@@ -1,11 +1,39 @@
 #!/usr/bin/env python3
 
+# Usage:
+#   unexpected-table.py [--thresholds THRESHOLDS] [--sweep-csv SWEEP.CSV] [--css MODE] [JOINED.CSV] > UNEXPECTED-TABLE.HTML
+#
+# Writes an HTML table of the rates of unexpected metrical shapes (those with
+# z <= the threshold) in each work of the joined corpus CSV file JOINED.CSV, and
+# the books with the lowest and highest rates. THRESHOLDS is a comma-separated
+# list of thresholds, or ranges START:STOP:STEP (STOP inclusive); there is one
+# table for each, all computed from a single pass over JOINED.CSV, which bins
+# the z of every word by the thresholds. With --sweep-csv, also writes the
+# numbers and rates of unexpected shapes in the corpus, in each work, and in
+# each book, at each threshold, to SWEEP.CSV.
+#
+# With --bootstrap R, also shows a bootstrap confidence interval at --level
+# next to every rate, and the permutation p-value of the difference between the
+# highest and lowest book rates of each work, each from R replicates. The
+# replicates for each work and threshold are drawn in a pool of --jobs worker
+# processes, with a seed derived from --seed, the threshold, and the work, so
+# the results do not depend on the number of workers.
+#
+# MODE is one of common.CSS_MODES: inline (the default), classes, or palette
+# (which is the same as classes here, as there are no colors).
+
+import argparse
+import collections
+import concurrent.futures
 import csv
 import html
+import io
+import math
+import multiprocessing
 import re
 import sys
 
-import pandas as pd
+import numpy as np
 
 import common
 
@@ -33,54 +61,172 @@ def parse_line_n(line_n):
     n, tag = re.match(r'^(\d+)(\w*)$', line_n).groups()
     return (int(n), tag)
 
-data = pd.read_csv(sys.stdin, dtype = {
+def parse_thresholds(s):
+    thresholds = []
+    for part in s.split(","):
+        try:
+            values = [float(x) for x in part.split(":")]
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid thresholds {part!r}")
+        if len(values) == 1:
+            thresholds.extend(values)
+        elif len(values) == 3 and values[0] <= values[1] and values[2] > 0:
+            start, stop, step = values
+            n = int(math.floor((stop - start) / step + 1e-9))
+            thresholds.extend(round(start + i * step, 12) for i in range(n + 1))
+        else:
+            raise argparse.ArgumentTypeError(f"invalid thresholds {part!r}")
+    if not all(math.isfinite(threshold) for threshold in thresholds):
+        raise argparse.ArgumentTypeError(f"invalid thresholds {s!r}")
+    return sorted(set(thresholds))
+
+parser = argparse.ArgumentParser(description = "Tabulate rates of unexpected metrical shapes.")
+parser.add_argument("--thresholds", type = parse_thresholds, default = [Z_THRESHOLD], help = f"z thresholds, like -2.5,-2 or -3:-1:0.25 (default {Z_THRESHOLD:+})")
+parser.add_argument("--sweep-csv", metavar = "SWEEP.CSV", help = "also write the numbers of unexpected shapes at every threshold")
+parser.add_argument("--bootstrap", type = int, default = 0, metavar = "R", help = "number of bootstrap and permutation replicates (default 0, for none)")
+parser.add_argument("--level", type = float, default = 0.95, help = "confidence level of the bootstrap intervals (default 0.95)")
+parser.add_argument("--seed", type = int, default = 0, help = "random seed for --bootstrap (default 0)")
+parser.add_argument("-j", "--jobs", type = int, help = "number of worker processes for --bootstrap")
+common.add_css_argument(parser)
+parser.add_argument("input", nargs = "?", metavar = "JOINED.CSV")
+args = parser.parse_args()
+if args.bootstrap < 0:
+    parser.error("--bootstrap must not be negative")
+if not 0 < args.level < 1:
+    parser.error("--level must be between 0 and 1")
+thresholds = np.array(args.thresholds)
+
+common.begin_phase("aggregate")
+# Histograms of z per (work, book_n), counted in one pass over chunks of the
+# joined CSV file. Bin k < len(thresholds) counts the words with z in
+# (thresholds[k-1], thresholds[k]]; the last bin counts the rest, including
+# words without an expectancy, as NaN sorts after everything. The keys combine
+# the codes of work and book_n, which are consistent across chunks.
+book_histograms = {}
+work_categories = book_n_categories = None
+for T in common.iter_csv_chunks(args.input if args.input is not None else sys.stdin, {
     "work": str,
     "book_n": str,
-    "line_n": str,
-    "word": str,
-    "lemma": str,
-    "sedes": float,
-    "metrical_shape": str,
-    "scanned": str,
-    "num_scansions": int,
-    "line_text": str,
-    "x": int,
     "z": float,
-}, usecols = [
-    "work",
-    "book_n",
-    "line_n",
-    "sedes",
-    "metrical_shape",
-    "x",
-    "z",
-])
-
-data = (
-    data
-        .assign(
-            num_words = 1,
-            num_unexpected = lambda df: df["z"] <= Z_THRESHOLD,
-        )
-        .groupby(["work", "book_n"], dropna = False)
-            .agg({"num_words": "size", "num_unexpected": "sum"})
-        .reset_index()
-        .assign(
-            frac_unexpected = lambda df: df["num_unexpected"] / df["num_words"],
-        )
-)
+}):
+    keys, inverse = np.unique((T["work"].codes.astype(np.int64) << 32) | T["book_n"].codes, return_inverse = True)
+    bins = np.searchsorted(thresholds, T["z"], "left")
+    histograms = np.bincount(inverse.reshape(-1) * (len(thresholds) + 1) + bins, minlength = len(keys) * (len(thresholds) + 1)).reshape(len(keys), -1)
+    for key, histogram in zip(keys.tolist(), histograms):
+        if key in book_histograms:
+            book_histograms[key] += histogram
+        else:
+            book_histograms[key] = histogram
+    work_categories, book_n_categories = T["work"].categories.tolist(), T["book_n"].categories.tolist()
 
-work_data = (
-    data
-        .groupby(["work"], dropna = False)
-            .agg({"num_words": "sum", "num_unexpected": "sum"})
-        .reset_index()
-        .assign(
-            frac_unexpected = lambda df: df["num_unexpected"] / df["num_words"],
-        )
-)
+# The work and book_n of every book, and its numbers of words and of
+# unexpected words at each threshold.
+book_keys = list(book_histograms)
+H = np.array([book_histograms[key] for key in book_keys], dtype = np.int64).reshape(len(book_keys), len(thresholds) + 1)
+book_num_words = H.sum(axis = 1).tolist()
+book_num_unexpected = np.cumsum(H[:, :-1], axis = 1).T.tolist()
+book_works = [work_categories[key >> 32] for key in book_keys]
+# An empty book_n is NA, as in read_csv.
+book_ns = [book_n_categories[key & 0xffffffff] or None for key in book_keys]
+
+Book = collections.namedtuple("Book", ("book_n", "num_words", "num_unexpected"))
+
+def format_rate(num_unexpected, num_words):
+    return f"{num_unexpected / num_words * 100:.02f}%\xa0({num_unexpected:,}\u202f/\u202f{num_words:,})"
+
+# For every work, the total numbers of words and unexpected words, and the
+# books with the lowest and highest rates of unexpected words (all of them, in
+# case of ties, in order of book number), or None if there are not at least two
+# books.
+WorkSummary = collections.namedtuple("WorkSummary", ("num_words", "num_unexpected", "extremes"))
+
+def summarize_works(books_by_work):
+    work_summaries = {}
+    for work_id, books in books_by_work.items():
+        if len(books) <= 1:
+            extremes = None
+        else:
+            extremes = []
+            for fn in (min, max):
+                frac = fn(book.num_unexpected / book.num_words for book in books)
+                extremes.append(sorted(
+                    (book for book in books if book.num_unexpected / book.num_words == frac),
+                    key = lambda book: int(book.book_n),
+                ))
+        work_summaries[work_id] = WorkSummary(sum(book.num_words for book in books), sum(book.num_unexpected for book in books), extremes)
+    return work_summaries
+
+# (books_by_work, work_summaries) at each threshold.
+sweep = []
+for num_unexpected in book_num_unexpected:
+    books_by_work = collections.defaultdict(list)
+    for work_id, book_n, n, u in zip(book_works, book_ns, book_num_words, num_unexpected):
+        books_by_work[work_id].append(Book(book_n, n, u))
+    sweep.append((books_by_work, summarize_works(books_by_work)))
+
+if args.sweep_csv is not None:
+    with open(args.sweep_csv, "w") as f:
+        w = csv.writer(f, lineterminator = "\n")
+        w.writerow(("threshold", "scope", "work", "book_n", "num_words", "num_unexpected", "rate"))
+        for threshold, (books_by_work, work_summaries) in zip(thresholds.tolist(), sweep):
+            num_words = sum(summary.num_words for summary in work_summaries.values())
+            num_unexpected = sum(summary.num_unexpected for summary in work_summaries.values())
+            w.writerow((f"{threshold:+}", "corpus", "", "", num_words, num_unexpected, num_unexpected / num_words))
+            for work_id, summary in work_summaries.items():
+                w.writerow((f"{threshold:+}", "work", work_id, "", summary.num_words, summary.num_unexpected, summary.num_unexpected / summary.num_words))
+                for book in books_by_work[work_id]:
+                    w.writerow((f"{threshold:+}", "book", work_id, book.book_n, book.num_words, book.num_unexpected, book.num_unexpected / book.num_words))
+
+# Hom.Hymns 2–5 are also shown together.
+def is_subtotal_book(work_id, book):
+    return work_id == "Hom.Hymn" and 2 <= int(book.book_n) <= 5
+
+# For each threshold, a dict from work to a Resampled, whose books is a dict
+# from book_n to the interval of the book, total and subtotal are the
+# intervals of the whole work and of the books of is_subtotal_book, and
+# spread_p is the permutation_spread_p of its books.
+Resampled = collections.namedtuple("Resampled", ("books", "total", "subtotal", "spread_p"))
+resampled = [{} for _ in sweep]
+if args.bootstrap > 0:
+    common.begin_phase("resample")
+    with concurrent.futures.ProcessPoolExecutor(max_workers = args.jobs, mp_context = multiprocessing.get_context("fork")) as executor:
+        futures = {}
+        for k, (books_by_work, _) in enumerate(sweep):
+            for i, (work_id, books) in enumerate(sorted(books_by_work.items())):
+                subsets = [list(range(len(books)))]
+                if work_id == "Hom.Hymn":
+                    subsets.append([j for j, book in enumerate(books) if is_subtotal_book(work_id, book)])
+                futures[executor.submit(
+                    common.resample_books,
+                    [book.num_unexpected for book in books],
+                    [book.num_words for book in books],
+                    subsets,
+                    args.bootstrap,
+                    np.random.SeedSequence(args.seed, spawn_key = (k, i)),
+                    args.level,
+                )] = (k, work_id, books)
+        for future in concurrent.futures.as_completed(futures):
+            k, work_id, books = futures[future]
+            book_intervals, subset_intervals, spread_p = future.result()
+            resampled[k][work_id] = Resampled(
+                {book.book_n: interval for book, interval in zip(books, book_intervals.tolist())},
+                subset_intervals[0].tolist(),
+                subset_intervals[1].tolist() if len(subset_intervals) > 1 else None,
+                spread_p,
+            )
+
+def format_interval(interval):
+    if interval is None:
+        return ""
+    low, high = interval
+    return f"\xa0[{low * 100:.02f}–{high * 100:.02f}%]"
 
-print("""\
+common.begin_phase("render")
+style_sheet = common.css_style_sheet(args.css)
+start_tag_style = common.html_start_tag_style if style_sheet is None else style_sheet.start_tag
+out = common.LineWriter() if style_sheet is None else common.LineWriter(io.StringIO())
+
+out("""\
 <html>
 <head>
 <meta charset=utf-8>
@@ -88,84 +234,94 @@ print("""\
 <body>
 """)
 
-print(common.html_start_tag_style("table", STYLE_TABLE))
+for k, (threshold, (books_by_work, work_summaries)) in enumerate(zip(thresholds.tolist(), sweep)):
+    if len(thresholds) > 1:
+        out(common.html_start_tag("h2") + html.escape(f"z\u202f≤\u202f{threshold:+.2f}".replace("-", "−")) + common.html_end_tag("h2"))
 
-print(common.html_start_tag("tr"))
-print(
-    common.html_start_tag_style("th", STYLE_TH + (("width", "28ex"),)) +
-    html.escape("Work") +
-    common.html_end_tag("th")
-)
-print(
-    common.html_start_tag_style("th", STYLE_TH) +
-    html.escape("Overall rate of unexpected metrical shapes") +
-    common.html_end_tag("th")
-)
-print(
-    common.html_start_tag_style("th", STYLE_TH) +
-    html.escape("Book with lowest rate of unexpected metrical shapes") +
-    common.html_end_tag("th")
-)
-print(
-    common.html_start_tag_style("th", STYLE_TH) +
-    html.escape("Book with highest rate of unexpected metrical shapes") +
-    common.html_end_tag("th")
-)
-print(common.html_end_tag("tr"))
-
-for work in common.KNOWN_WORKS:
-    print(common.html_start_tag("tr"))
-    print(
-        common.html_start_tag_style("td", STYLE_CELL) +
-        work.long_html_name +
-        common.html_end_tag("td")
+    out(start_tag_style("table", STYLE_TABLE))
+
+    out(common.html_start_tag("tr"))
+    out(
+        start_tag_style("th", STYLE_TH + (("width", "28ex"),)) +
+        html.escape("Work") +
+        common.html_end_tag("th")
+    )
+    out(
+        start_tag_style("th", STYLE_TH) +
+        html.escape("Overall rate of unexpected metrical shapes") +
+        common.html_end_tag("th")
+    )
+    out(
+        start_tag_style("th", STYLE_TH) +
+        html.escape("Book with lowest rate of unexpected metrical shapes") +
+        common.html_end_tag("th")
+    )
+    out(
+        start_tag_style("th", STYLE_TH) +
+        html.escape("Book with highest rate of unexpected metrical shapes") +
+        common.html_end_tag("th")
     )
+    out(common.html_end_tag("tr"))
 
-    total = work_data.loc[work_data["work"] == work.id].iloc[0]
-    print(common.html_start_tag_style("td", STYLE_CELL))
-    print(f"{total['num_unexpected'] / total['num_words'] * 100:.02f}%\xa0({total['num_unexpected']:,}\u202f/\u202f{total['num_words']:,})")
-    if work.id == "Hom.Hymn":
-        # Special case: show Hom.Hymns 2–5 separately.
-        print("<br>")
-        sub = data.loc[data["work"] == work.id]
-        sub = sub.loc[(2 <= sub["book_n"].apply(int)) & (sub["book_n"].apply(int) <= 5)]
-        sub = sub.agg({"num_words": "sum", "num_unexpected": "sum"})
-        print(f"{sub['num_unexpected'] / sub['num_words'] * 100:.02f}%\xa0({sub['num_unexpected']:,}\u202f/\u202f{sub['num_words']:,})\xa0[<i>Hy.</i>\xa02–5]")
-    print(common.html_end_tag("td"))
-
-    books = data.loc[data["work"] == work.id]
-    if len(books) <= 1:
-        print(
-            common.html_start_tag_style("td", STYLE_CELL) +
-            html.escape("-") +
+    for work in common.KNOWN_WORKS:
+        out(common.html_start_tag("tr"))
+        out(
+            start_tag_style("td", STYLE_CELL) +
+            work.long_html_name +
             common.html_end_tag("td")
         )
-        print(
-            common.html_start_tag_style("td", STYLE_CELL) +
-            html.escape("-") +
-            common.html_end_tag("td")
-        )
-    else:
-        for fn in (pd.Series.min, pd.Series.max):
-            vals = (
-                books
-                    .loc[books["frac_unexpected"] == fn(books["frac_unexpected"])]
-                    .sort_values(by = "book_n", key = lambda v: v.apply(int))
+
+        summary = work_summaries[work.id]
+        r = resampled[k].get(work.id)
+        out(start_tag_style("td", STYLE_CELL))
+        out(format_rate(summary.num_unexpected, summary.num_words) + format_interval(r and r.total))
+        if work.id == "Hom.Hymn":
+            # Special case: show Hom.Hymns 2–5 separately.
+            out("<br>")
+            sub = [book for book in books_by_work[work.id] if is_subtotal_book(work.id, book)]
+            out(f"{format_rate(sum(book.num_unexpected for book in sub), sum(book.num_words for book in sub))}{format_interval(r and r.subtotal)}\xa0[<i>Hy.</i>\xa02–5]")
+        if r is not None and r.spread_p is not None:
+            out(f"<br>Highest\xa0−\xa0lowest book: <i>p</i>\xa0=\xa0{r.spread_p:.3g}")
+        out(common.html_end_tag("td"))
+
+        if summary.extremes is None:
+            out(
+                start_tag_style("td", STYLE_CELL) +
+                html.escape("-") +
+                common.html_end_tag("td")
             )
-            parts = []
-            for _, row in vals.iterrows():
-                parts.append(f"{row['num_unexpected'] / row['num_words'] * 100:.02f}%\xa0({row['num_unexpected']:,}\u202f/\u202f{row['num_words']:,})\xa0{work.segment_html_name}\xa0{row['book_n']}")
-            print(
-                common.html_start_tag_style("td", STYLE_CELL) +
-                "<br>".join(parts) +
+            out(
+                start_tag_style("td", STYLE_CELL) +
+                html.escape("-") +
                 common.html_end_tag("td")
             )
+        else:
+            for books in summary.extremes:
+                parts = []
+                for book in books:
+                    parts.append(f"{format_rate(book.num_unexpected, book.num_words)}{format_interval(r and r.books[book.book_n])}\xa0{work.segment_html_name}\xa0{book.book_n}")
+                out(
+                    start_tag_style("td", STYLE_CELL) +
+                    "<br>".join(parts) +
+                    common.html_end_tag("td")
+                )
+
+        out(common.html_end_tag("tr"))
 
-    print(common.html_end_tag("tr"))
+    out(common.html_end_tag("table"))
 
-print(common.html_end_tag("table"))
+if args.bootstrap > 0:
+    out(
+        common.html_start_tag("p") +
+        html.escape(f"Intervals are {args.level * 100:g}% percentile bootstrap confidence intervals, and p-values are for the difference between the highest and lowest book rates of a work under random permutation of unexpected shapes among its books, each from {args.bootstrap:,} replicates.") +
+        common.html_end_tag("p")
+    )
 
-print("""\
+out("""\
 </body>
 </html>
 """)
+
+out.close()
+if style_sheet is not None:
+    sys.stdout.write(style_sheet.insert(out.f.getvalue()))
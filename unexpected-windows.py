@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+# Usage:
+#   unexpected-windows.py [--threshold Z] --sizes SIZES [--align ALIGN]... \
+#     [--series SERIES.npz] [JOINED.CSV] > HISTOGRAMS.CSV
+#
+# Counts unexpected metrical shapes (those with z <= Z) in sliding windows of
+# words, within each work and book, for many window sizes at once, from one
+# prefix sum over the joined corpus CSV file JOINED.CSV. SIZES is a
+# comma-separated list of window sizes N, or ranges START-STOP or
+# START-STOP/STEP (STOP inclusive).
+#
+# Writes a CSV file of histograms to standard output, with one row for each
+# work, book_n, window_size, and number of unexpected shapes in a window, giving
+# the number of windows with that many. With --series, also writes the count
+# for the window at every word to SERIES.npz, with one array per ALIGN (left or
+# center, as in RcppRoll's roll_sum) and window size, named like "left-181".
+# The arrays are in grouped order, with -1 where a window does not fit in its
+# book; the "work", "book_n", and "offsets" arrays delimit the books, and "row"
+# gives the row of JOINED.CSV (not counting the header) for each element.
+
+import argparse
+import csv
+import sys
+
+import numpy as np
+
+import common
+
+Z_THRESHOLD = -2.0
+
+def parse_sizes(s):
+    sizes = []
+    for part in s.split(","):
+        start, _, stop = part.partition("-")
+        stop, _, step = stop.partition("/")
+        try:
+            start = int(start)
+            stop = int(stop) if stop else start
+            step = int(step) if step else 1
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid window sizes {part!r}")
+        if not (0 < start <= stop and step > 0):
+            raise argparse.ArgumentTypeError(f"invalid window sizes {part!r}")
+        sizes.extend(range(start, stop + 1, step))
+    return sorted(set(sizes))
+
+parser = argparse.ArgumentParser(description = "Count unexpected metrical shapes in sliding windows.")
+parser.add_argument("--threshold", type = float, default = Z_THRESHOLD, metavar = "Z", help = f"z at or below which a shape is unexpected (default {Z_THRESHOLD:+})")
+parser.add_argument("--sizes", type = parse_sizes, required = True, help = "window sizes, like 74,181 or 10-500/10")
+parser.add_argument("--align", action = "append", choices = ("left", "center"), help = "window alignment for --series (default left)")
+parser.add_argument("--series", metavar = "SERIES.npz", help = "also write the count for every window")
+parser.add_argument("input", nargs = "?", metavar = "JOINED.CSV")
+args = parser.parse_args()
+
+T = common.load_csv(args.input if args.input is not None else sys.stdin, {
+    "work": str,
+    "book_n": str,
+    "z": float,
+})
+# NaN compares false, so shapes without an expectancy are not unexpected.
+W = common.WindowCounts.from_flags([T["work"], T["book_n"]], T["z"] <= args.threshold)
+
+w = csv.writer(sys.stdout, lineterminator = "\n")
+w.writerow(("work", "book_n", "window_size", "unexpected", "windows"))
+for size in args.sizes:
+    histogram = W.histogram(size)
+    for g, k in zip(*np.nonzero(histogram)):
+        work, book_n = W.groups[g]
+        w.writerow((work, book_n, size, k, histogram[g, k]))
+
+if args.series is not None:
+    dtype = np.min_scalar_type(-max(args.sizes))
+    series = {
+        f"{align}-{size}": W.windows(size, align).astype(dtype)
+        for align in (args.align or ["left"])
+        for size in args.sizes
+    }
+    np.savez_compressed(
+        args.series,
+        work = np.array([work for work, _ in W.groups]),
+        book_n = np.array([book_n for _, book_n in W.groups]),
+        offsets = W.offsets,
+        row = W.order,
+        **series,
+    )
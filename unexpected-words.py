@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+# Usage:
+#   unexpected-words.py [--threshold Z] [--context N] JOINED.CSV CORPUS.CSV... > UNEXPECTED-WORDS.CSV
+#
+# Writes a concordance of the unexpected words (those with z <= Z) of the
+# joined corpus CSV file JOINED.CSV, with the text of the line of each word and
+# of up to N lines before and after it in the same book. The lines are looked
+# up in the corpus CSV files CORPUS.CSV that JOINED.CSV was made from, through
+# a common.LineIndex of each, so only the lines that are needed are read.
+#
+# The context_before and context_after columns have one line per line of
+# text.
+
+import argparse
+import collections
+import csv
+import sys
+
+import common
+
+Z_THRESHOLD = -2.0
+
+FIELDS = ("work", "book_n", "line_n", "word_n", "word", "sedes", "metrical_shape")
+
+def find_line(indexes, work, book_n, line_n, word_n, word):
+    """Returns the (LineIndex, line) of the word, or None. When there is more
+    than one line with the same work, book_n, and line_n, returns the first
+    one that has word at word_n."""
+    candidates = [(index, i) for index in indexes for i in index.find(work, book_n, line_n)]
+    if len(candidates) > 1:
+        for index, i in candidates:
+            for row in index.line_rows(i):
+                if row[index.header.index("word_n")] == word_n and row[index.header.index("word")] == word:
+                    return index, i
+    return candidates[0] if candidates else None
+
+parser = argparse.ArgumentParser(description = "Concordance of unexpected words, with context lines.")
+parser.add_argument("--threshold", type = float, default = Z_THRESHOLD, metavar = "Z", help = f"z at or below which a word is unexpected (default {Z_THRESHOLD:+})")
+parser.add_argument("--context", type = int, default = 1, metavar = "N", help = "number of lines of context before and after (default 1)")
+parser.add_argument("input", metavar = "JOINED.CSV")
+parser.add_argument("corpus", nargs = "+", metavar = "CORPUS.CSV")
+args = parser.parse_args()
+if args.context < 0:
+    parser.error("--context must not be negative")
+
+common.begin_phase("index")
+indexes_by_work = collections.defaultdict(list)
+for filename in args.corpus:
+    index = common.LineIndex.load(filename)
+    for work in sorted(set(key.split("\x1f", 1)[0] for key in index.keys.tolist())):
+        indexes_by_work[work].append(index)
+
+common.begin_phase("lookup")
+w = csv.writer(sys.stdout, lineterminator = "\n")
+w.writerow(FIELDS + ("z", "line_text", "context_before", "context_after"))
+for T in common.iter_csv_chunks(args.input, {**{field: str for field in FIELDS}, "z": float}):
+    # NaN compares false, so words without an expectancy are not unexpected.
+    for r in (T["z"] <= args.threshold).nonzero()[0].tolist():
+        values = tuple(str(T[field].categories[T[field].codes[r]]) for field in FIELDS)
+        z = float(T["z"][r])
+        found = find_line(indexes_by_work.get(values[0], []), *values[:5])
+        if found is None:
+            print(f"no line {' '.join(values[:3])} in the corpus", file = sys.stderr)
+            w.writerow(values + (common.format_z(z), "", "", ""))
+            continue
+        index, i = found
+        context = index.context(i, args.context)
+        w.writerow(values + (
+            common.format_z(z),
+            index.line_text(i),
+            "\n".join(index.line_text(j) for j in range(context.start, i)),
+            "\n".join(index.line_text(j) for j in range(i + 1, context.stop)),
+        ))